@@ -23,8 +23,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import math
 import time
-from functools import reduce
+from collections import namedtuple
 
 import serial
 
@@ -82,7 +83,72 @@ PN532_SPI_DATAWRITE                 = 0x01
 PN532_SPI_DATAREAD                  = 0x03
 PN532_SPI_READY                     = 0x01
 
+# Baud rates / modulation types (BrTy) for InListPassiveTarget
 PN532_MIFARE_ISO14443A              = 0x00
+PN532_FELICA_212                    = 0x01
+PN532_FELICA_424                    = 0x02
+PN532_ISO14443B                     = 0x03
+PN532_JEWEL                         = 0x04
+
+# Target types for InAutoPoll
+PN532_AUTOPOLL_GENERIC_106          = 0x00
+PN532_AUTOPOLL_GENERIC_212          = 0x01
+PN532_AUTOPOLL_GENERIC_424          = 0x02
+PN532_AUTOPOLL_ISO14443B            = 0x03
+PN532_AUTOPOLL_JEWEL                = 0x04
+PN532_AUTOPOLL_MIFARE               = 0x10
+PN532_AUTOPOLL_FELICA_212           = 0x11
+PN532_AUTOPOLL_FELICA_424           = 0x12
+PN532_AUTOPOLL_ISO14443_4A          = 0x20
+PN532_AUTOPOLL_ISO14443_4B          = 0x23
+
+# InAutoPoll polls forever when given this as its poll count.
+PN532_AUTOPOLL_ENDLESS              = 0xFF
+
+# SetParameters flags
+PN532_PARAM_NAD_USED                = 0x01
+PN532_PARAM_DID_USED                = 0x02
+PN532_PARAM_AUTOMATIC_ATR_RES       = 0x04
+PN532_PARAM_AUTOMATIC_RATS          = 0x10
+PN532_PARAM_ISO14443_4_PICC         = 0x20
+PN532_PARAM_REMOVE_PREPOSTAMBLE     = 0x40
+
+# TgInitAsTarget modes
+PN532_TARGET_PASSIVE_ONLY           = 0x01
+PN532_TARGET_DEP_ONLY               = 0x02
+PN532_TARGET_PICC_ONLY              = 0x04
+
+# TgInitAsTarget activation mode byte: how the initiator activated the target.
+PN532_TARGET_ACTIVATED_DEP          = 0x04
+PN532_TARGET_ACTIVATED_PICC         = 0x08
+
+# Target mode status: the initiator released (deselected) the target.
+PN532_STATUS_RELEASED               = 0x29
+
+# PowerDown wake-up sources
+PN532_WAKE_INT0                     = 0x01
+PN532_WAKE_INT1                     = 0x02
+PN532_WAKE_RF                       = 0x08
+PN532_WAKE_HSU                      = 0x10
+PN532_WAKE_SPI                      = 0x20
+PN532_WAKE_GPIO                     = 0x40
+PN532_WAKE_I2C                      = 0x80
+
+# Time the PN532 takes to wake up on HSU after the 0x55 byte, in seconds.
+PN532_HSU_WAKE_DELAY                = 0.002
+
+# RFConfiguration items
+PN532_RFCFG_FIELD                   = 0x01
+PN532_RFCFG_TIMINGS                 = 0x02
+PN532_RFCFG_MAX_RTY_COM             = 0x04
+PN532_RFCFG_MAX_RETRIES             = 0x05
+
+# RFConfiguration timeouts: 100 us * 2 ** (n - 1), from 0x01 (100 us) to
+# 0x10 (3.28 s); 0x00 is no timeout.
+PN532_RFCFG_TIMEOUT_NONE            = 0x00
+PN532_RFCFG_TIMEOUT_13MS            = 0x08
+PN532_RFCFG_TIMEOUT_51MS            = 0x0A
+PN532_RFCFG_TIMEOUT_102MS           = 0x0B
 
 # Mifare Commands
 MIFARE_CMD_AUTH_A                   = 0x60
@@ -94,6 +160,15 @@ MIFARE_CMD_DECREMENT                = 0xC0
 MIFARE_CMD_INCREMENT                = 0xC1
 MIFARE_CMD_STORE                    = 0xC2
 MIFARE_ULTRALIGHT_CMD_WRITE         = 0xA2
+NTAG_CMD_GET_VERSION                = 0x60
+NTAG_CMD_FAST_READ                  = 0x3A
+
+# ISO7816-4 instructions and status words, for ISO14443-4 (ISO-DEP) cards
+ISO7816_INS_SELECT                  = 0xA4
+ISO7816_INS_READ_BINARY             = 0xB0
+ISO7816_INS_GET_RESPONSE            = 0xC0
+ISO7816_INS_UPDATE_BINARY           = 0xD6
+ISO7816_SW_OK                       = 0x9000
 
 # Prefixes for NDEF Records (to identify record type)
 NDEF_URIPREFIX_NONE                 = 0x00
@@ -140,201 +215,864 @@ PN532_GPIO_P32                      = 2
 PN532_GPIO_P33                      = 3
 PN532_GPIO_P34                      = 4
 PN532_GPIO_P35                      = 5
+PN532_GPIO_P71                      = 1
+PN532_GPIO_P72                      = 2
+
+# Register addresses for ReadRegister/WriteRegister: contactless interface
+# unit (CIU) registers and special function registers (SFR).
+PN532_REG_CIU_MODE                  = 0x6301
+PN532_REG_CIU_TXMODE                = 0x6302
+PN532_REG_CIU_RXMODE                = 0x6303
+PN532_REG_CIU_TXCONTROL             = 0x6304
+PN532_REG_CIU_TXAUTO                = 0x6305
+PN532_REG_CIU_TXSEL                 = 0x6306
+PN532_REG_CIU_RXSEL                 = 0x6307
+PN532_REG_CIU_RXTHRESHOLD           = 0x6308
+PN532_REG_CIU_DEMOD                 = 0x6309
+PN532_REG_CIU_RFCFG                 = 0x6316
+PN532_REG_CIU_GSNON                 = 0x6317
+PN532_REG_CIU_CWGSP                 = 0x6318
+PN532_REG_CIU_MODGSP                = 0x6319
+PN532_SFR_P7CFGA                    = 0xFFF4
+PN532_SFR_P7CFGB                    = 0xFFF5
+PN532_SFR_P7                        = 0xFFF7
+PN532_SFR_P3CFGA                    = 0xFFFC
+PN532_SFR_P3CFGB                    = 0xFFFD
+PN532_SFR_P3                        = 0xFFB0
+
+# Most registers one ReadRegister (2 address bytes each) and one
+# WriteRegister (2 address bytes and a value each) carry.
+PN532_MAX_READ_REGISTERS            = 131
+PN532_MAX_WRITE_REGISTERS           = 87
 
 PN532_ACK_FRAME                     = b'\x00\x00\xFF\x00\xFF\x00'
+PN532_NACK_FRAME                    = b'\x00\x00\xFF\xFF\x00\x00'
+PN532_ERROR_TFI                     = 0x7F
+
+# Longest frame data (TFI, command code and parameters) the PN532 accepts.
+# Frames with 255 or more data bytes are sent as extended information frames.
+PN532_MAX_FRAME_DATA                = 265
+
+# Most data bytes one InDataExchange carries either way.  Longer exchanges
+# are chained: the MI bit is set in the target byte of every part but the
+# last going out, and in the status byte of every part but the last coming
+# back.
+PN532_MAX_EXCHANGE_DATA             = 262
+PN532_MI                            = 0x40
+
+# HSU baud rates, indexed by their SetSerialBaudRate BR code
+PN532_SERIAL_BAUDRATES              = (9600, 19200, 38400, 57600, 115200, 230400, 460800, 921600, 1288000)
+
+# Frame kinds yielded by FrameParser
+FRAME_ACK                           = 'ack'
+FRAME_NACK                          = 'nack'
+FRAME_ERROR                         = 'error'
+FRAME_INFO                          = 'info'
 # pylint: enable=bad-whitespace
 
+
+class PN532Error(RuntimeError):
+    """Base class of the errors raised when talking to the PN532."""
+
+
+class PN532TimeoutError(PN532Error):
+    """The PN532 did not acknowledge a command in time."""
+
+
+class PN532ChecksumError(PN532Error):
+    """Only corrupted frames arrived from the PN532."""
+
+
+class PN532ProtocolError(PN532Error):
+    """The PN532 answered with an error frame or with an unexpected response."""
+
+
+class RetryPolicy:
+    """How often, and how patiently, a command frame is sent.  A command is
+    sent up to max_attempts times; each attempt waits up to ack_timeout
+    seconds for the PN532's ACK.  Before a resend the host pauses for backoff
+    seconds, multiplied by backoff_factor after every attempt and capped at
+    max_backoff.  The same limit applies to the NACKs sent to get a corrupted
+    response again.
+    """
+
+    def __init__(self, max_attempts=3, ack_timeout=0.1, backoff=0.01, backoff_factor=2.0, max_backoff=0.5):
+        assert max_attempts >= 1, 'At least one attempt is needed.'
+        self.max_attempts = max_attempts
+        self.ack_timeout = ack_timeout
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        """Pause before attempt number attempt (counting from 1)."""
+        if attempt <= 1:
+            return 0.0
+        return min(self.backoff * self.backoff_factor ** (attempt - 2), self.max_backoff)
+
+
+class CommandRecord:
+    """What one call_function call did, handed to the PN532's instrumentation
+    when the call is over.  started, acked and finished are
+    time.perf_counter() readings (acked is None if no ACK came); attempts
+    counts the command frames sent and nacks the NACKs sent for corrupted
+    responses.  sleep_time is the time spent in retry backoff and read_time
+    the time spent blocked reading the transport.  outcome is 'ok',
+    'no_card' or the name of the exception the call raised.
+    """
+
+    __slots__ = ('command', 'started', 'acked', 'finished', 'attempts', 'nacks', 'bytes_out', 'bytes_in',
+                 'sleep_time', 'read_time', 'outcome')
+
+    def __init__(self, command, started):
+        self.command = command
+        self.started = started
+        self.acked = None
+        self.finished = None
+        self.attempts = 0
+        self.nacks = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.sleep_time = 0.0
+        self.read_time = 0.0
+        self.outcome = 'ok'
+
+
 def millis():
-    return int(time.time() * 1000)
+    return time.monotonic_ns() // 1000000
+
+
+def mifare_classic_sector_count(card_size=1024):
+    """Number of sectors on a MiFare Classic card of card_size bytes (1K
+    cards have 16 sectors of 4 blocks, 4K cards add 8 sectors of 16 blocks
+    after the first 32).
+    """
+    return 16 if card_size == 1024 else 40
+
+
+def mifare_classic_sector_blocks(sector):
+    """Return the range of block numbers making up a MiFare Classic sector.
+    The last block of the range is the sector trailer.
+    """
+    if sector < 32:
+        return range(sector * 4, sector * 4 + 4)
+    first = 128 + (sector - 32) * 16
+    return range(first, first + 16)
+
+
+def mifare_classic_block_sector(block_number):
+    """Return the MiFare Classic sector that contains block_number."""
+    if block_number < 128:
+        return block_number // 4
+    return 32 + (block_number - 128) // 16
+
+
+def mifare_classic_is_trailer(block_number):
+    """Return True if block_number is a sector trailer (keys and access bits)."""
+    if block_number < 128:
+        return block_number % 4 == 3
+    return block_number % 16 == 15
+
+
+def mifare_classic_value_block(value, address=0):
+    """Encode a MiFare Classic value block: the signed 32-bit value three
+    times (the middle copy inverted) and the address byte four times
+    (inverted in between), as increment, decrement and restore expect.
+    """
+    value = value.to_bytes(4, 'little', signed=True)
+    inverted = bytes(b ^ 0xFF for b in value)
+    return value + inverted + value + bytes([address, address ^ 0xFF, address, address ^ 0xFF])
+
+
+def mifare_classic_parse_value_block(data):
+    """Decode a MiFare Classic value block into a tuple of (value, address).
+    Raises ValueError if data does not hold a valid value block.
+    """
+    data = bytes(data)
+    if (len(data) != 16 or data[0:4] != data[8:12] or any(a ^ b != 0xFF for a, b in zip(data[0:4], data[4:8]))
+            or data[12] != data[14] or data[13] != data[15] or data[12] ^ data[13] != 0xFF):
+        raise ValueError('Not a value block!')
+    return int.from_bytes(data[0:4], 'little', signed=True), data[12]
+
+
+def encode_apdu(cla, ins, p1, p2, data=b'', le=None):
+    """Build an ISO7816-4 command APDU.  le is the number of bytes expected
+    back (None for none, 256 or 65536 for as many as possible).  The short
+    form is used when data and le fit in it, the extended form otherwise.
+    """
+    data = bytes(data)
+    assert len(data) <= 65535, 'APDU data cannot be more than 65535 bytes.'
+    assert le is None or 0 < le <= 65536, 'Le must be between 1 and 65536.'
+    apdu = bytearray((cla, ins, p1, p2))
+    if len(data) <= 255 and (le is None or le <= 256):
+        if data:
+            apdu.append(len(data))
+            apdu += data
+        if le is not None:
+            apdu.append(le & 0xFF)
+    else:
+        apdu.append(0x00)
+        if data:
+            apdu += len(data).to_bytes(2, 'big')
+            apdu += data
+        if le is not None:
+            apdu += (le & 0xFFFF).to_bytes(2, 'big')
+    return bytes(apdu)
+
+
+ApduResponse = namedtuple('ApduResponse', 'data sw')
+ApduResponse.__doc__ = """A response APDU: data is a bytearray of the response data and sw the
+status word as an integer (ISO7816_SW_OK is 0x9000).
+"""
+
+
+UltralightType = namedtuple('UltralightType', 'name pages user_end fast_read')
+UltralightType.__doc__ = """A MIFARE Ultralight or NTAG tag type: pages is the number of 4-byte pages,
+user memory runs from page 4 up to (not including) user_end, and fast_read
+tells whether the tag knows FAST_READ.
+"""
+
+ULTRALIGHT = UltralightType('MIFARE Ultralight', 16, 16, False)
+
+# Tag types by GET_VERSION product type and storage size bytes.
+ULTRALIGHT_TYPES = {
+    (0x03, 0x0B): UltralightType('MIFARE Ultralight EV1 (MF0UL11)', 20, 16, True),
+    (0x03, 0x0E): UltralightType('MIFARE Ultralight EV1 (MF0UL21)', 41, 36, True),
+    (0x04, 0x0F): UltralightType('NTAG213', 45, 40, True),
+    (0x04, 0x11): UltralightType('NTAG215', 135, 130, True),
+    (0x04, 0x13): UltralightType('NTAG216', 231, 226, True),
+}
+
+
+GpioState = namedtuple('GpioState', 'p3 p7 ioi1')
+GpioState.__doc__ = """The PN532's GPIO ports as ReadGPIO reports them: p3 holds P30 to P35
+(bit n is P3n), p7 P71 and P72 (bits 1 and 2), and ioi1 the I0 and I1 pins
+that select the host interface.
+"""
+
+
+PassiveTarget = namedtuple('PassiveTarget', 'tg type uid sens_res sel_res ats data')
+PassiveTarget.__doc__ = """A target found by InListPassiveTarget or InAutoPoll.  type is the
+InListPassiveTarget baud rate/modulation or the InAutoPoll target type, uid
+is the NFCID1 (ISO14443A), NFCID2 (FeliCa), PUPI (ISO14443B) or Jewel ID,
+and data holds the raw target record.  Fields a target type does not have
+are None.
+"""
+
+# InListPassiveTarget baud rate/modulation of each InAutoPoll target type.
+_AUTOPOLL_BRTY = {
+    PN532_AUTOPOLL_GENERIC_106: PN532_MIFARE_ISO14443A,
+    PN532_AUTOPOLL_MIFARE: PN532_MIFARE_ISO14443A,
+    PN532_AUTOPOLL_ISO14443_4A: PN532_MIFARE_ISO14443A,
+    PN532_AUTOPOLL_GENERIC_212: PN532_FELICA_212,
+    PN532_AUTOPOLL_FELICA_212: PN532_FELICA_212,
+    PN532_AUTOPOLL_GENERIC_424: PN532_FELICA_424,
+    PN532_AUTOPOLL_FELICA_424: PN532_FELICA_424,
+    PN532_AUTOPOLL_ISO14443B: PN532_ISO14443B,
+    PN532_AUTOPOLL_ISO14443_4B: PN532_ISO14443B,
+    PN532_AUTOPOLL_JEWEL: PN532_JEWEL,
+}
+
+
+def response_status(response):
+    """Return the status byte a response to an exchange or target command
+    starts with (0x00 on success), or None if there was no response
+    ("no_card") or it was empty.
+    """
+    if response == "no_card" or not response:
+        return None
+    return response[0]
+
+
+def parse_passive_target(brty, data, offset=0, target_type=None):
+    """Parse the target record starting at offset in data, as returned by
+    InListPassiveTarget for baud rate/modulation brty.  Returns a tuple of the
+    PassiveTarget and the offset just past the record.  target_type is
+    reported as the target's type instead of brty if given.
+    """
+    tg = data[offset]
+    uid = sens_res = sel_res = ats = None
+    if brty == PN532_MIFARE_ISO14443A:
+        sens_res = bytes(data[offset + 1:offset + 3])
+        sel_res = data[offset + 3]
+        end = offset + 5 + data[offset + 4]
+        uid = bytes(data[offset + 5:end])
+        # ISO14443-4 compliant targets are followed by their ATS (length first).
+        if sel_res & 0x20 and end < len(data):
+            ats = bytes(data[end:end + data[end]])
+            end += data[end]
+    elif brty in (PN532_FELICA_212, PN532_FELICA_424):
+        uid = bytes(data[offset + 3:offset + 11])
+        end = offset + 1 + data[offset + 1]
+    elif brty == PN532_ISO14443B:
+        uid = bytes(data[offset + 2:offset + 6])
+        end = offset + 14 + data[offset + 13]
+    elif brty == PN532_JEWEL:
+        sens_res = bytes(data[offset + 1:offset + 3])
+        uid = bytes(data[offset + 3:offset + 7])
+        end = offset + 7
+    else:
+        raise ValueError('Unsupported baud rate/modulation type: {:#x}'.format(brty))
+
+    target = PassiveTarget(tg, brty if target_type is None else target_type, uid, sens_res, sel_res, ats,
+                           bytes(data[offset:end]))
+    return target, end
+
+
+Frame = namedtuple('Frame', 'kind data')
+
+
+class FrameParser:
+    """Incremental parser for the byte stream coming from the PN532.
+
+    Bytes are fed in as they arrive and complete frames are taken out one at a
+    time with next_frame() (or by iterating).  ACK, NACK, application error and
+    normal or extended information frames are recognised by their structure,
+    never by searching for byte patterns, so payloads may contain anything.
+    A frame with a bad length or data checksum is dropped and parsing resumes
+    at the next start code; frames after it in the stream are not lost.
+
+    The buffer is a bytearray with a read position: consumed bytes are only
+    compacted away once enough of them have piled up.  Checksums are computed
+    over memoryview slices, and a frame's data is copied out of the buffer
+    exactly once.
+    """
+
+    # Compact the buffer once this many consumed bytes sit in front of it.
+    COMPACT_THRESHOLD = 4096
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+        self.checksum_errors = 0
+
+    def __len__(self):
+        """Number of buffered bytes not yet consumed."""
+        return len(self._buf) - self._pos
+
+    def __iter__(self):
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame
+            frame = self.next_frame()
+
+    def feed(self, data):
+        self._buf += data
+
+    def reset(self):
+        del self._buf[:]
+        self._pos = 0
+
+    def _compact(self):
+        if self._pos >= self.COMPACT_THRESHOLD or self._pos == len(self._buf):
+            del self._buf[:self._pos]
+            self._pos = 0
+
+    def next_frame(self):
+        """Return the next complete Frame, or None if more bytes are needed."""
+        buf = self._buf
+        pos = self._pos
+        view = memoryview(buf)
+        try:
+            while True:
+                start = buf.find(b'\x00\xFF', pos)
+                if start < 0:
+                    # Keep a trailing 0x00 that may be the first half of a start code.
+                    pos = max(pos, len(buf) - 1)
+                    return None
+                pos = start
+                i = start + 2
+                if len(buf) < i + 2:
+                    return None
+
+                length, lcs = buf[i], buf[i + 1]
+                if length == 0x00 and lcs == 0xFF:
+                    pos = i + 2
+                    return Frame(FRAME_ACK, b'')
+                if length == 0xFF and lcs == 0x00:
+                    pos = i + 2
+                    return Frame(FRAME_NACK, b'')
+
+                if length == 0xFF and lcs == 0xFF:
+                    # Extended information frame: 0xFF 0xFF LENM LENL LCS.
+                    if len(buf) < i + 5:
+                        return None
+                    length = (buf[i + 2] << 8) | buf[i + 3]
+                    if (buf[i + 2] + buf[i + 3] + buf[i + 4]) & 0xFF:
+                        self.checksum_errors += 1
+                        pos = start + 1
+                        continue
+                    data_start = i + 5
+                elif (length + lcs) & 0xFF:
+                    self.checksum_errors += 1
+                    pos = start + 1
+                    continue
+                else:
+                    data_start = i + 2
+
+                end = data_start + length
+                if len(buf) < end + 1:
+                    return None
+
+                if sum(view[data_start:end + 1]) & 0xFF:
+                    self.checksum_errors += 1
+                    pos = start + 1
+                    continue
+
+                pos = end + 1
+                data = bytes(view[data_start:end])
+                if length == 1 and data[0] == PN532_ERROR_TFI:
+                    return Frame(FRAME_ERROR, data)
+                return Frame(FRAME_INFO, data)
+        finally:
+            # The buffer cannot be resized while a view of it exists.
+            view.release()
+            self._pos = pos
+            self._compact()
+
+
+class FrameBuilder:
+    """Builds information frames into one preallocated buffer.
+
+    build() packs the TFI, command code and parameters straight into the
+    buffer, fills in the header and checksums around them and returns a
+    memoryview of the finished frame.  The view is only valid until the next
+    call to build().  Frames with 255 or more data bytes are written as
+    extended information frames (0xFF 0xFF LENM LENL LCS).
+    """
+
+    # Room for the extended header in front of the data.
+    _DATA_OFFSET = 8
+
+    def __init__(self):
+        self._buf = bytearray(self._DATA_OFFSET + PN532_MAX_FRAME_DATA + 2)
+        self._view = memoryview(self._buf)
+
+    def _pack(self, pos, params):
+        buf = self._buf
+        limit = self._DATA_OFFSET + PN532_MAX_FRAME_DATA
+        for i, param in enumerate(params, 1):
+            if isinstance(param, int):
+                if pos >= limit:
+                    raise ValueError('Frame data cannot be more than {} bytes.'.format(PN532_MAX_FRAME_DATA))
+                buf[pos] = param & 0xFF
+                pos += 1
+                continue
+            if isinstance(param, (list, tuple)):
+                pos = self._pack(pos, param)
+                continue
+            if isinstance(param, str):
+                param = param.encode()
+            elif not isinstance(param, (bytes, bytearray, memoryview)):
+                raise ValueError('Param #{} is of unsupported type: {}'.format(i, type(param)))
+            end = pos + len(param)
+            if end > limit:
+                raise ValueError('Frame data cannot be more than {} bytes.'.format(PN532_MAX_FRAME_DATA))
+            buf[pos:end] = param
+            pos = end
+        return pos
+
+    def build(self, tfi, command, params=()):
+        """Return a memoryview of the frame carrying tfi, command and params."""
+        buf = self._buf
+        start = self._DATA_OFFSET
+        buf[start] = tfi
+        buf[start + 1] = command & 0xFF
+        end = self._pack(start + 2, params)
+        length = end - start
+
+        buf[end] = -sum(self._view[start:end]) & 0xFF
+        buf[end + 1] = PN532_POSTAMBLE
+
+        if length < 255:
+            start -= 5
+            buf[start + 3] = length
+            buf[start + 4] = -length & 0xFF
+        else:
+            start -= 8
+            buf[start + 3] = 0xFF
+            buf[start + 4] = 0xFF
+            buf[start + 5] = length >> 8
+            buf[start + 6] = length & 0xFF
+            buf[start + 7] = -((length >> 8) + (length & 0xFF)) & 0xFF
+        buf[start] = PN532_PREAMBLE
+        buf[start + 1] = PN532_STARTCODE1
+        buf[start + 2] = PN532_STARTCODE2
+
+        return self._view[start:end + 2]
+
+
+class Transport:
+    """Byte stream between the host and a PN532.  Subclasses implement the
+    actual link; the PN532 class only ever talks to this interface.
+    """
+
+    def write(self, data):
+        """Send all of data to the PN532."""
+        raise NotImplementedError
+
+    def read(self, size, timeout):
+        """Return up to size bytes received from the PN532.  Blocks until at
+        least one byte is available or timeout seconds pass (None blocks
+        forever, 0 never blocks) and returns b'' on timeout.
+        """
+        raise NotImplementedError
 
+    @property
+    def in_waiting(self):
+        """Number of received bytes that can be read without blocking."""
+        raise NotImplementedError
 
-def uint8_add(a, b):
-    return ((a & 0xFF) + (b & 0xFF)) & 0xFF
+    @property
+    def baudrate(self):
+        """The host side's serial speed.  Setting it raises ValueError (or
+        OSError) if the host cannot use that speed.
+        """
+        raise NotImplementedError
 
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        raise NotImplementedError
 
-def canonicalize_params(params, ignore_errors=False):
-    if not params:
-        return []
+    def flush(self):
+        """Wait until everything written has gone out on the wire."""
 
-    ret = []
-    for i, param in enumerate(params, 1):
-        if isinstance(param, (list, tuple)):
-            ret += canonicalize_params(param)
-        elif isinstance(param, bytes):
-            ret += list(param)
-        elif isinstance(param, str):
-            ret += list(param.encode())
-        elif isinstance(param, int):
-            ret.append(param & 0xFF)
-        elif not ignore_errors:
-            raise ValueError('Param #{} is of unsupported type: {}'.format(i, type(param)))
+    def reset_input_buffer(self):
+        """Discard any received bytes that have not been read yet."""
+        raise NotImplementedError
 
-    return ret
+    def close(self):
+        pass
 
-class PN532:
-    def __init__(self, comport, baudrate=115200):
-        self.message = b''
 
+class SerialTransport(Transport):
+    """Transport over a serial port (HSU) using pyserial."""
+
+    def __init__(self, comport, baudrate=115200):
         self.ser = serial.Serial(comport, baudrate)
         self.ser.timeout = 2
 
+    def write(self, data):
+        self.ser.write(data)
+
+    def read(self, size, timeout):
+        if self.ser.timeout != timeout:
+            self.ser.timeout = timeout
+        buf = self.ser.read(1)
+        if buf and size > 1:
+            waiting = self.ser.in_waiting
+            if waiting:
+                buf += self.ser.read(min(waiting, size - 1))
+        return buf
+
+    @property
+    def in_waiting(self):
+        return self.ser.in_waiting
+
+    @property
+    def baudrate(self):
+        return self.ser.baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self.ser.baudrate = baudrate
+
+    def flush(self):
+        self.ser.flush()
+
+    def reset_input_buffer(self):
+        self.ser.reset_input_buffer()
+
+    def close(self):
+        # Wake up a read blocked in another thread before closing the port.
+        self.ser.cancel_read()
+        self.ser.close()
+
+
+class PN532:
+    # Most bytes pulled from the transport in one read.
+    RX_CHUNK_SIZE = 4096
+
+    # Seconds the PN532 needs to switch its UART to a new baud rate.
+    BAUDRATE_SWITCH_DELAY = 0.01
+
+    # Pages per FAST_READ: 256 bytes, plus the status byte, TFI and command
+    # code, still fit in one (extended) response frame.
+    ULTRALIGHT_FAST_READ_PAGES = 64
+
+    def __init__(self, comport=None, baudrate=115200, transport=None, retry=None, instrumentation=None):
+        """Talk to a PN532 on the serial port comport, or over transport if one
+        is given (for example a simulator.SimulatedPN532).  Retry is the
+        default RetryPolicy for commands.  Instrumentation, if given, is
+        called with a CommandRecord after every command (see
+        metrics.CommandMetrics); it can be set or cleared at any time.
+        """
+        self._parser = FrameParser()
+        self._builder = FrameBuilder()
+        self.retry = RetryPolicy() if retry is None else retry
+        self.instrumentation = instrumentation
+        self._record = None
+        # Seconds the PN532 takes to wake from PowerDown, and the preamble
+        # to send before the next command if it is powered down.
+        self.wake_delay = PN532_HSU_WAKE_DELAY
+        self._wake_preamble = None
+
+        if transport is None:
+            transport = SerialTransport(comport, baudrate)
+        self.transport = transport
+
+    def close(self):
+        self.transport.close()
+
     @staticmethod
     def checksum(data):
-        return ~reduce(uint8_add, data, 0xFF) & 0xFF
-
-    def _write_frame(self, data):
-        # Build frame to send as:
-        # - Preamble (0x00)
-        # - Start code  (0x00, 0xFF)
-        # - Command length (1 byte)
-        # - Command length checksum
-        # - Command bytes
-        # - Checksum
-        # - Postamble (0x00)
-
-        assert 0 < len(data) < 255, 'Data must be array of 1 to 255 bytes.'
-
-        length = len(data)
-        frame = bytes([
-            PN532_PREAMBLE,
-            PN532_STARTCODE1,
-            PN532_STARTCODE2,
-            length & 0xFF,
-            uint8_add(~length, 1)
-        ]) + data + bytes([
-            self.checksum(data),
-            PN532_POSTAMBLE
-        ])
-
-        self.ser.flushInput()
-        ack = False
-        while not ack:
-            self.ser.write(frame)
-            # print('>', frame)
-            ack = self._ack_wait(1000)
-            time.sleep(0.3)
+        return -sum(data) & 0xFF
+
+    def _write_frame(self, frame, retry=None, deadline=None):
+        """Send a frame built by FrameBuilder until the PN532 acknowledges it,
+        at most retry.max_attempts times and not past deadline (in
+        time.monotonic() seconds, None for no deadline).  Raises
+        PN532TimeoutError if no ACK arrived.
+        """
+        retry = self.retry if retry is None else retry
+        record = self._record
+        self.transport.reset_input_buffer()
+        self._parser.reset()
+        sent = 0
+        for attempt in range(1, retry.max_attempts + 1):
+            pause = retry.delay(attempt)
+            if deadline is not None:
+                pause = min(pause, deadline - time.monotonic())
+            if pause > 0:
+                time.sleep(pause)
+                if record is not None:
+                    record.sleep_time += pause
+
+            ack_deadline = time.monotonic() + retry.ack_timeout + self._wire_time(len(frame))
+            if deadline is not None:
+                if time.monotonic() >= deadline:
+                    break
+                ack_deadline = min(ack_deadline, deadline)
+
+            self.transport.write(frame)
+            sent += 1
+            if record is not None:
+                record.attempts = sent
+                record.bytes_out += len(frame)
+            if self._ack_wait(ack_deadline - time.monotonic()):
+                if record is not None:
+                    record.acked = time.perf_counter()
+                return True
+        raise PN532TimeoutError('PN532 did not acknowledge the command (sent {} time(s))!'.format(sent))
+
+    def _wire_time(self, size):
+        """Seconds it takes to send size bytes at the link's speed."""
+        try:
+            return size * 10.0 / self.transport.baudrate
+        except NotImplementedError:
+            return 0.0
+
+    def _receive(self, deadline):
+        """Block until more bytes arrive from the PN532 or the deadline (in
+        time.monotonic() seconds, None for no deadline) passes.  Received bytes
+        are appended to the frame parser.  Returns False if nothing arrived
+        before the deadline.
+        """
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+        record = self._record
+        if record is None:
+            buf = self.transport.read(self.RX_CHUNK_SIZE, remaining)
+        else:
+            start = time.perf_counter()
+            buf = self.transport.read(self.RX_CHUNK_SIZE, remaining)
+            record.read_time += time.perf_counter() - start
+            record.bytes_in += len(buf)
+        if not buf:
+            return False
+        self._parser.feed(buf)
         return True
 
     def _ack_wait(self, timeout):
-        rx_info = b''
-        start_time = millis()
-        current_time = start_time
-
-        while (current_time - start_time < timeout):
-            time.sleep(0.12)  # Stability on receive
-            buf = self.ser.read(self.ser.inWaiting())
-            # print('<', buf)
-            rx_info += buf
-            current_time = millis()
-            if PN532_ACK_FRAME in rx_info:
-                if len(rx_info) > 6:
-                    self.message = b''.join(rx_info.split(PN532_ACK_FRAME))
-                else:
-                    self.message = rx_info
-                self.ser.flush()
+        """Wait up to timeout seconds for an ACK frame.  Returns False on
+        timeout, or right away if the PN532 sent a NACK (asking for the frame
+        again).  Anything received after the ACK stays queued in the frame
+        parser for _read_frame.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = self._parser.next_frame()
+            if frame is None:
+                if not self._receive(deadline):
+                    return False
+            elif frame.kind == FRAME_ACK:
                 return True
+            elif frame.kind == FRAME_NACK:
+                return False
 
-        self.message = b''
-        return False
-
-    def _read_data(self):
-        rx_info = b''
-        if not self.message:
-            self._ack_wait(1000)
-        else:
-            rx_info = self.message
-        return rx_info
-
-    def _read_frame(self):
-        """Read a response frame from the PN532 of at most length bytes in size.
-        Returns the data inside the frame if found, otherwise raises an exception
-        if there is an error parsing the frame.  Note that less than length bytes
-        might be returned!
+    def _abort(self):
+        """Make the PN532 drop the command it is working on, so that the next
+        command is not stuck behind it.
+        """
+        self.transport.write(PN532_ACK_FRAME)
+        self._parser.reset()
+        if self._record is not None:
+            self._record.bytes_out += len(PN532_ACK_FRAME)
+
+    def _read_frame(self, timeout=1.0, retry=None):
+        """Read a response frame from the PN532, waiting up to timeout seconds
+        (or forever if timeout is None) for it to arrive.  Returns the data
+        inside the frame as soon as the full frame has been received and its
+        checksums verified, or "no_card" if no response arrived in time (the
+        pending command is then aborted).  A corrupted response is asked for
+        again with a NACK, up to retry.max_attempts - 1 times; raises
+        PN532ChecksumError if it stays corrupted and PN532ProtocolError if the
+        PN532 answered with an error frame.
         """
-        # Read frame with expected length of data.
-        response = self._read_data()
+        retry = self.retry if retry is None else retry
+        deadline = None if timeout is None else time.monotonic() + timeout
+        checksum_errors = self._parser.checksum_errors
+        nacks = 0
+        while True:
+            frame = self._parser.next_frame()
+            if frame is None:
+                if self._parser.checksum_errors != checksum_errors:
+                    checksum_errors = self._parser.checksum_errors
+                    if nacks + 1 >= retry.max_attempts:
+                        self._abort()
+                        raise PN532ChecksumError('Response checksum did not match expected value!')
+                    nacks += 1
+                    if self._record is not None:
+                        self._record.nacks = nacks
+                        self._record.bytes_out += len(PN532_NACK_FRAME)
+                    self._parser.reset()
+                    self.transport.write(PN532_NACK_FRAME)
+                if not self._receive(deadline):
+                    self._abort()
+                    if nacks:
+                        raise PN532ChecksumError('Response checksum did not match expected value!')
+                    return "no_card"
+            elif frame.kind == FRAME_ERROR:
+                raise PN532ProtocolError('PN532 answered with an application level error frame!')
+            elif frame.kind == FRAME_INFO:
+                return frame.data
 
-        # Check frame starts with 0x01 and then has 0x00FF (preceeded by optional zeros).
-        if response != PN532_ACK_FRAME:
-            if response[0] != 0x00:
-                raise RuntimeError('Response frame does not start with 0x00!')
+    def wakeup(self):
+        self.transport.write(b'\x55\x55\x00\x00\x00')
 
-            # Swallow all the 0x00 values that preceed 0xFF.
-            offset = 1
-            while response[offset] == 0x00:
-                offset += 1
-                if offset >= len(response):
-                    raise RuntimeError('Response frame preamble does not contain 0x00FF!')
-            if response[offset] != 0xFF:
-                raise RuntimeError('Response frame preamble does not contain 0x00FF!')
-            offset += 1
-            if offset >= len(response):
-                raise RuntimeError('Response contains no data!')
-
-            # Check length & length checksum match.
-            frame_len = response[offset]
-            if (frame_len + response[offset + 1]) & 0xFF:
-                raise RuntimeError('Response length checksum did not match length!')
-
-            # Check frame checksum value matches bytes.
-            checksum = reduce(uint8_add, response[offset + 2:offset + 2 + frame_len + 1], 0)
-            if checksum:
-                raise RuntimeError('Response checksum did not match expected value!')
-
-            # Return frame data.
-            return response[offset+2:offset+2+frame_len]
-
-        return "no_card"
+    @property
+    def powered_down(self):
+        """True from a successful power_down() until the next command."""
+        return self._wake_preamble is not None
 
-    def wakeup(self):
-        self.ser.write(b'\x55\x55\x00\x00\x00')
+    def hsu_wake_preamble(self):
+        """Return the shortest HSU preamble that wakes the PN532 from
+        PowerDown: the 0x55 byte, then zeros for as long as it takes the chip
+        to wake at the current baud rate.
+        """
+        byte_time = 10.0 / self.transport.baudrate
+        return b'\x55' + bytes(math.ceil(self.wake_delay / byte_time))
 
-    def call_function(self, command, *params):
+    def call_function(self, command, *params, timeout=1.0, retry=None):
         """Send specified command to the PN532 and expect up to response_length
         bytes back in a response.  Note that less than the expected bytes might
         be returned!  Params can optionally specify an array of bytes to send as
-        parameters to the function call.  Will wait up to timeout_secs seconds
-        for a response and return a bytearray of response bytes, or None if no
-        response is available within the timeout.
+        parameters to the function call.  Will wait up to timeout seconds (or
+        forever if timeout is None) in total for a response and return a
+        bytearray of response bytes, or "no_card" if no response is available
+        within the timeout.  Retry overrides the instance's RetryPolicy.
+        Raises PN532TimeoutError if the PN532 never acknowledged the command,
+        and PN532ChecksumError or PN532ProtocolError for bad responses.
+        """
+        # Build frame with command and parameters.
+        frame = self._builder.build(PN532_HOSTTOPN532, command, params)
+
+        if self.instrumentation is not None:
+            return self._call_instrumented(command, frame, timeout, retry)
+        return self._call(command, frame, timeout, retry)
+
+    def build_frame(self, command, *params):
+        """Return the command frame for command and params as bytes, to be sent
+        (any number of times) with call_frame.
+        """
+        return bytes(self._builder.build(PN532_HOSTTOPN532, command, params))
+
+    def call_frame(self, command, frame, timeout=1.0, retry=None):
+        """Like call_function, but send a frame prepared with build_frame,
+        skipping the work of packing the parameters again.
         """
-        params = canonicalize_params(params)
+        if self.instrumentation is not None:
+            return self._call_instrumented(command, frame, timeout, retry)
+        return self._call(command, frame, timeout, retry)
 
-        # Build frame data with command and parameters.
-        data = bytes([PN532_HOSTTOPN532, command & 0xFF] + params)
+    def _call(self, command, frame, timeout, retry):
+        retry = self.retry if retry is None else retry
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        # Wake the PN532 up first if it was powered down.
+        if self._wake_preamble is not None:
+            self.transport.write(self._wake_preamble)
+            if self._record is not None:
+                self._record.bytes_out += len(self._wake_preamble)
+            self._wake_preamble = None
 
         # Send frame and wait for response.
-        if not self._write_frame(data):
-            return None
+        self._write_frame(frame, retry, deadline)
 
         # Read response bytes.
-        response = self._read_frame()
+        if deadline is not None:
+            timeout = max(0.0, deadline - time.monotonic())
+        response = self._read_frame(timeout, retry)
 
         # Check that response is for the called function.
         if response != "no_card":
             if response[0] != PN532_PN532TOHOST or response[1] != command + 1:
-                raise RuntimeError('Received unexpected command response!')
+                raise PN532ProtocolError('Received unexpected command response!')
 
             # Return response data.
             return response[2:]
 
         return response
 
+    def _call_instrumented(self, command, frame, timeout, retry):
+        """_call, filling in a CommandRecord for the instrumentation."""
+        instrumentation = self.instrumentation
+        record = self._record = CommandRecord(command, time.perf_counter())
+        try:
+            response = self._call(command, frame, timeout, retry)
+            if response == "no_card":
+                record.outcome = response
+            return response
+        except Exception as e:
+            record.outcome = type(e).__name__
+            raise
+        finally:
+            self._record = None
+            record.finished = time.perf_counter()
+            instrumentation(record)
+
     def begin(self):
         """Initialize communication with the PN532.  Must be called before any
         other calls are made against the PN532.
         """
         self.wakeup()
 
-    def get_firmware_version(self):
+    def get_firmware_version(self, timeout=1.0):
         """Call PN532 GetFirmwareVersion function and return a tuple with the IC,
         Ver, Rev, and Support values.
         """
-        response = self.call_function(PN532_COMMAND_GETFIRMWAREVERSION)
-        if response is None:
-            raise RuntimeError('Failed to detect the PN532!  Make sure there is sufficient power (use a 1 amp or greater power supply), the PN532 is wired correctly to the device, and the solder joints on the PN532 headers are solidly connected.')
+        try:
+            response = self.call_function(PN532_COMMAND_GETFIRMWAREVERSION, timeout=timeout)
+        except PN532TimeoutError:
+            response = "no_card"
+        if response == "no_card":
+            raise PN532TimeoutError('Failed to detect the PN532!  Make sure there is sufficient power (use a 1 amp or greater power supply), the PN532 is wired correctly to the device, and the solder joints on the PN532 headers are solidly connected.')
         return (response[0], response[1], response[2], response[3])
 
-    def SAM_configuration(self):
+    def SAM_configuration(self, timeout=1.0):
         """Configure the PN532 to read MiFare cards."""
         # Send SAM configuration command with configuration for:
         # - 0x01, normal mode
@@ -342,84 +1080,297 @@ class PN532:
         # - 0x01, use IRQ pin
         # Note that no other verification is necessary as call_function will
         # check the command was executed as expected.
-        self.call_function(PN532_COMMAND_SAMCONFIGURATION, [0x01, 0x14, 0x01])
+        self.call_function(PN532_COMMAND_SAMCONFIGURATION, [0x01, 0x14, 0x01], timeout=timeout)
 
-    def read_passive_target(self, card_baud=PN532_MIFARE_ISO14443A):
-        """Wait for a MiFare card to be available and return its UID when found.
-        Will wait up to timeout_sec seconds and return None if no card is found,
-        otherwise a bytearray with the UID of the found card is returned.
+    def set_parameters(self, flags, timeout=1.0):
+        """Set the PN532's internal flags (PN532_PARAM_* bits) with
+        SetParameters.
         """
+        self.call_function(PN532_COMMAND_SETPARAMETERS, flags, timeout=timeout)
+
+    def read_registers(self, addresses, timeout=1.0):
+        """Read the registers at addresses (PN532_REG_* and PN532_SFR_*),
+        as many per ReadRegister as fit in a frame, and return a list of their
+        values in the same order, or None on failure.
+        """
+        addresses = list(addresses)
+        values = []
+        for i in range(0, len(addresses), PN532_MAX_READ_REGISTERS):
+            chunk = addresses[i:i + PN532_MAX_READ_REGISTERS]
+            params = bytearray()
+            for address in chunk:
+                params += address.to_bytes(2, 'big')
+            response = self.call_function(PN532_COMMAND_READREGISTER, params, timeout=timeout)
+            if response == "no_card" or len(response) != len(chunk):
+                return None
+            values += response
+        return values
+
+    def write_registers(self, values, timeout=1.0):
+        """Write values (a dict or (address, value) pairs) to the registers,
+        as many per WriteRegister as fit in a frame.  Returns True on success.
+        """
+        values = list(values.items() if isinstance(values, dict) else values)
+        for i in range(0, len(values), PN532_MAX_WRITE_REGISTERS):
+            params = bytearray()
+            for address, value in values[i:i + PN532_MAX_WRITE_REGISTERS]:
+                params += address.to_bytes(2, 'big')
+                params.append(value)
+            if self.call_function(PN532_COMMAND_WRITEREGISTER, params, timeout=timeout) == "no_card":
+                return False
+        return True
+
+    def read_gpio(self, timeout=1.0):
+        """Return the GpioState of the PN532's GPIO ports, or None on failure."""
+        response = self.call_function(PN532_COMMAND_READGPIO, timeout=timeout)
+        if response == "no_card" or len(response) < 3:
+            return None
+        return GpioState(response[0], response[1], response[2])
+
+    def write_gpio(self, p3=None, p7=None, timeout=1.0):
+        """Set the P3 and P7 ports (bit n is pin P3n or P7n); a port left at
+        None keeps its state.  Returns True on success.
+        """
+        response = self.call_function(PN532_COMMAND_WRITEGPIO,
+                                      0x00 if p3 is None else PN532_GPIO_VALIDATIONBIT | (p3 & 0x3F),
+                                      0x00 if p7 is None else PN532_GPIO_VALIDATIONBIT | (p7 & 0x06),
+                                      timeout=timeout)
+        return response != "no_card"
+
+    def rf_configuration(self, item, *data, timeout=1.0):
+        """Set RFConfiguration item (one of PN532_RFCFG_*) to data."""
+        self.call_function(PN532_COMMAND_RFCONFIGURATION, item, *data, timeout=timeout)
+
+    def set_rf_field(self, on, auto_rfca=False, timeout=1.0):
+        """Switch the RF field on or off.  With auto_rfca the PN532 checks for
+        an external field before switching its own on.
+        """
+        self.rf_configuration(PN532_RFCFG_FIELD, (0x02 if auto_rfca else 0x00) | (0x01 if on else 0x00),
+                              timeout=timeout)
+
+    def set_rf_timings(self, atr_res_timeout=PN532_RFCFG_TIMEOUT_102MS, retry_timeout=PN532_RFCFG_TIMEOUT_51MS,
+                       timeout=1.0):
+        """Set how long the PN532 waits for an ATR_RES and for a target's
+        answer (PN532_RFCFG_TIMEOUT_* codes).  A short retry_timeout notices a
+        card that has left sooner.
+        """
+        self.rf_configuration(PN532_RFCFG_TIMINGS, 0x00, atr_res_timeout, retry_timeout, timeout=timeout)
+
+    def set_max_retries(self, passive_activation=0xFF, atr=0xFF, psl=0x01, timeout=1.0):
+        """Set how many times the PN532 retries activations (0xFF for ever).
+        passive_activation (MxRtyPassiveActivation) bounds how long
+        InListPassiveTarget polls an empty field before answering with no
+        target.
+        """
+        self.rf_configuration(PN532_RFCFG_MAX_RETRIES, atr, psl, passive_activation, timeout=timeout)
+
+    def power_down(self, wake_sources=PN532_WAKE_HSU, generate_irq=None, timeout=1.0):
+        """Put the PN532 in PowerDown mode, to be woken by wake_sources
+        (PN532_WAKE_* bits).  The next command is sent after the shortest HSU
+        wake preamble (see hsu_wake_preamble), so there is no need to call
+        wakeup().  Returns True if the PN532 went to sleep.
+        """
+        params = [wake_sources] if generate_irq is None else [wake_sources, generate_irq]
+        response = self.call_function(PN532_COMMAND_POWERDOWN, params, timeout=timeout)
+        if response_status(response) != 0x00:
+            return False
+        self._wake_preamble = self.hsu_wake_preamble()
+        return True
+
+    def set_baudrate(self, baudrate, timeout=1.0):
+        """Switch the serial link to baudrate (one of PN532_SERIAL_BAUDRATES)
+        with SetSerialBaudRate: the PN532 answers at the current speed, the
+        host acknowledges the answer, and then both sides switch.  The link is
+        checked with GetFirmwareVersion afterwards.  Returns True if the link
+        now runs at baudrate, or False if the host cannot use that speed or the
+        check failed and the link was recovered at the old speed.  Raises
+        PN532TimeoutError if the PN532 cannot be reached at either speed.
+        """
+        if baudrate not in PN532_SERIAL_BAUDRATES:
+            raise ValueError('Unsupported baud rate: {}'.format(baudrate))
+        old = self.transport.baudrate
+        if baudrate == old:
+            return True
+
+        # Make sure the host can follow before asking the PN532 to switch.
+        try:
+            self.transport.baudrate = baudrate
+            self.transport.baudrate = old
+        except (ValueError, OSError):
+            self.transport.baudrate = old
+            return False
+
+        response = self.call_function(PN532_COMMAND_SETSERIALBAUDRATE, PN532_SERIAL_BAUDRATES.index(baudrate),
+                                      timeout=timeout)
+        if response == "no_card":
+            return False
+        self.transport.write(PN532_ACK_FRAME)
+        self.transport.flush()
+
+        for rate in (baudrate, old):
+            self.transport.baudrate = rate
+            time.sleep(self.BAUDRATE_SWITCH_DELAY)
+            self.transport.reset_input_buffer()
+            self._parser.reset()
+            try:
+                self.get_firmware_version(timeout)
+            except PN532Error:
+                continue
+            return rate == baudrate
+        raise PN532TimeoutError('Lost the PN532 while switching to {} baud!'.format(baudrate))
+
+    def negotiate_baudrate(self, baudrates=PN532_SERIAL_BAUDRATES, timeout=1.0):
+        """Switch the serial link to the fastest of baudrates that both the
+        host and the PN532 manage, trying them from the fastest down and never
+        going slower than the current speed.  Returns the speed in use.
+        """
+        current = self.transport.baudrate
+        for baudrate in sorted(baudrates, reverse=True):
+            if baudrate <= current:
+                break
+            if self.set_baudrate(baudrate, timeout):
+                return baudrate
+        return current
+
+    def read_passive_targets(self, max_targets=2, card_baud=PN532_MIFARE_ISO14443A, timeout=1.0):
+        """List up to max_targets (1 or 2) targets in the field with one
+        InListPassiveTarget and return a list of PassiveTarget, one per target
+        found (with its UID, SENS_RES, SEL_RES and ATS for ISO14443A cards).
+        The targets' tg numbers can be passed as target= to the exchange
+        methods.  Returns an empty list if no target answered in time.
+        """
+        assert 1 <= max_targets <= 2, 'The PN532 can list 1 or 2 targets.'
 
-        # Send passive read command for 1 card.
         response = self.call_function(
             PN532_COMMAND_INLISTPASSIVETARGET,
-            1,  # amount of cards
-            card_baud
+            max_targets,
+            card_baud,
+            timeout=timeout,
         )
+        if response == "no_card" or not response:
+            return []
 
-        # If no response is available return None to indicate no card is present.
-        if response is None:
-            return None
+        targets = []
+        offset = 1
+        for _ in range(response[0]):
+            target, offset = parse_passive_target(card_baud, response, offset)
+            targets.append(target)
+        return targets
 
-        if response != "no_card":
-            # Check only 1 card with up to a 7 byte UID is present.
-            if response[0] != 0x01:
-                raise RuntimeError('More than one card detected!')
-            if response[5] > 7:
-                raise RuntimeError('Found card with unexpectedly long UID!')
-            # Return UID of card.
-            return response[6:6 + response[5]]
+    def read_passive_target(self, card_baud=PN532_MIFARE_ISO14443A, timeout=1.0):
+        """Wait for a MiFare card to be available and return its UID when found.
+        Will wait up to timeout seconds and return "no_card" if no card is
+        found, otherwise a bytearray with the UID of the found card is returned.
+        """
 
-        return response
+        # Send passive read command for 1 card.
+        targets = self.read_passive_targets(1, card_baud, timeout)
+
+        # The PN532 gave up polling (or the timeout passed) without a card.
+        if not targets:
+            return "no_card"
+
+        # Check the card has up to a 7 byte UID.
+        if len(targets[0].uid) > 7:
+            raise RuntimeError('Found card with unexpectedly long UID!')
+
+        # Return UID of card.
+        return targets[0].uid
+
+    def auto_poll(self, target_types=(PN532_AUTOPOLL_MIFARE,), poll_count=PN532_AUTOPOLL_ENDLESS, period=1):
+        """Let the PN532 poll for targets with InAutoPoll and yield a
+        PassiveTarget for every target it reports, re-arming InAutoPoll after
+        each report.  target_types lists up to 15 PN532_AUTOPOLL_* types,
+        poll_count is the number of polling rounds per InAutoPoll (1 to 254, or
+        PN532_AUTOPOLL_ENDLESS) and period the pause between rounds in units of
+        150ms.  The host simply waits for the chip's answer meanwhile, so
+        nothing is sent over the link while no card is present.  An endless
+        poll never stops; a finite one stops (the generator returns) once an
+        InAutoPoll ends without reporting a target.  A card left on the reader
+        is reported again by every InAutoPoll, so callers should debounce by
+        UID.
+        """
+        assert 1 <= len(target_types) <= 15, 'InAutoPoll takes 1 to 15 target types.'
+        assert 1 <= poll_count <= 0xFF, 'Poll count must be between 1 and 255.'
+        assert 1 <= period <= 0x0F, 'Period must be between 1 and 15.'
+
+        timeout = None
+        if poll_count != PN532_AUTOPOLL_ENDLESS:
+            # Every round polls each type for up to one period.
+            timeout = poll_count * len(target_types) * period * 0.15 + 1.0
+
+        while True:
+            response = self.call_function(PN532_COMMAND_INAUTOPOLL, poll_count, period, target_types,
+                                          timeout=timeout)
+            if response == "no_card" or not response or response[0] == 0:
+                if timeout is None:
+                    continue
+                return
 
-    def mifare_classic_authenticate_block(self, uid, block_number, key_number, key):
+            offset = 1
+            for _ in range(response[0]):
+                target_type, length = response[offset], response[offset + 1]
+                record = response[offset + 2:offset + 2 + length]
+                offset += 2 + length
+                brty = _AUTOPOLL_BRTY.get(target_type)
+                if brty is None:
+                    # DEP targets: no UID, just hand over the raw record.
+                    yield PassiveTarget(record[0], target_type, None, None, None, None, bytes(record))
+                    continue
+                yield parse_passive_target(brty, record, target_type=target_type)[0]
+
+    def mifare_classic_authenticate_block(self, uid, block_number, key_number, key, target=1, timeout=1.0):
         """Authenticate specified block number for a MiFare classic card.  Uid
         should be a byte array with the UID of the card, block number should be
         the block to authenticate, key number should be the key type (like
         MIFARE_CMD_AUTH_A or MIFARE_CMD_AUTH_B), and key should be a byte array
-        with the key data.  Returns True if the block was authenticated, or False
-        if not authenticated.
+        with the key data.  Target is the card's target number (see
+        read_passive_targets).  Returns True if the block was authenticated, or
+        False if not authenticated.
         """
 
         # Send InDataExchange request and verify response is 0x00.
         response = self.call_function(
             PN532_COMMAND_INDATAEXCHANGE,
-            1,  # Max card numbers
+            target,  # Target number
             key_number,
             block_number,
             key,
             uid,
+            timeout=timeout,
         )
 
-        return response[0] == 0x00
+        return response_status(response) == 0x00
 
-    def mifare_classic_read_block(self, block_number):
+    def mifare_classic_read_block(self, block_number, target=1, timeout=1.0):
         """Read a block of data from the card.  Block number should be the block
-        to read.  If the block is successfully read a bytearray of length 16 with
-        data starting at the specified block will be returned.  If the block is
-        not read then None will be returned.
+        to read and target the card's target number.  If the block is
+        successfully read a bytearray of length 16 with data starting at the
+        specified block will be returned.  If the block is not read then None
+        will be returned.
         """
 
         # Send InDataExchange request to read block of MiFare data.
         response = self.call_function(
             PN532_COMMAND_INDATAEXCHANGE,
-            1,
+            target,
             MIFARE_CMD_READ,
             block_number,
+            timeout=timeout,
         )
 
         # Check first response is 0x00 to show success.
-        if response[0] != 0x00:
+        if response_status(response) != 0x00:
             return None
 
         # Return first 4 bytes since 16 bytes are always returned.
         return response[1:]
 
-    def mifare_classic_write_block(self, block_number: int, data: bytes):
+    def mifare_classic_write_block(self, block_number: int, data: bytes, target: int = 1, timeout: float = 1.0):
         """Write a block of data to the card.  Block number should be the block
-        to write and data should be a byte array of length 16 with the data to
-        write.  If the data is successfully written then True is returned,
-        otherwise False is returned.
+        to write, data should be a byte array of length 16 with the data to
+        write and target the card's target number.  If the data is successfully
+        written then True is returned, otherwise False is returned.
         """
 
         assert len(data) == 16, 'Data must be an array of 16 bytes!'
@@ -427,10 +1378,503 @@ class PN532:
         # Send InDataExchange request.
         response = self.call_function(
             PN532_COMMAND_INDATAEXCHANGE,
-            1,  # Max card numbers
+            target,  # Target number
             MIFARE_CMD_WRITE,
             block_number,
             data,
+            timeout=timeout,
         )
 
-        return response[0] == 0x00
+        return response_status(response) == 0x00
+
+    def reselect(self, uid, max_targets=2, timeout=1.0):
+        """Re-activate the card with the given UID after a failed
+        authentication left it halted.  Lists up to max_targets targets again,
+        so that a second card in the field stays listed, and returns the
+        target number the card now has (listing may renumber the targets), or
+        None if it did not answer.
+        """
+        uid = bytes(uid)
+        for target in self.read_passive_targets(max_targets, timeout=timeout):
+            if target.uid == uid:
+                return target.tg
+        return None
+
+    def in_select(self, target=1, timeout=1.0):
+        """Select a target listed by read_passive_targets again.  The PN532
+        re-activates the card, so this fails if it has left the field (and
+        drops any MiFare Classic authentication).  Returns True if the target
+        answered.
+        """
+        response = self.call_function(PN532_COMMAND_INSELECT, target, timeout=timeout)
+        return response_status(response) == 0x00
+
+    def in_release(self, target=0, timeout=1.0):
+        """Release a listed target (0 for all of them); the PN532 forgets it
+        and does not talk to it again until it is listed anew.  Returns True
+        on success.
+        """
+        response = self.call_function(PN532_COMMAND_INRELEASE, target, timeout=timeout)
+        return response_status(response) == 0x00
+
+    def _mifare_classic_authenticate_sector(self, uid, block_number, key_number, key, keys, target, timeout):
+        """Authenticate the sector of block_number with the given key, or with
+        whichever key works from keys (a keymanager.KeyManager) if one is given.
+        """
+        if keys is not None:
+            return keys.authenticate(self, uid, block_number, target, timeout) is not None
+        return self.mifare_classic_authenticate_block(uid, block_number, key_number, key, target, timeout)
+
+    def mifare_classic_read_sector(self, uid, sector, key_number=None, key=None, into=None, keys=None, target=1,
+                                   timeout=1.0):
+        """Authenticate a MiFare Classic sector once and read all of its blocks
+        back to back.  Returns the sector data (64 bytes, or 256 bytes for the
+        upper sectors of a 4K card) or None if authentication or any read
+        failed.  If into is given, the data is written into that writable
+        buffer, which must be the size of the sector, and into is returned.
+        Instead of key_number and key, a keymanager.KeyManager can be passed as
+        keys to find a working key.  Target is the card's target number and
+        timeout applies to each command.
+        """
+        blocks = mifare_classic_sector_blocks(sector)
+        if into is None:
+            into = bytearray(16 * len(blocks))
+
+        if not self._mifare_classic_authenticate_sector(uid, blocks[0], key_number, key, keys, target, timeout):
+            return None
+
+        offset = 0
+        for block_number in blocks:
+            data = self.mifare_classic_read_block(block_number, target, timeout)
+            if data is None:
+                return None
+            into[offset:offset + 16] = data
+            offset += 16
+
+        return into
+
+    def mifare_classic_dump_card(self, uid, key_number=None, key=None, card_size=1024, keys=None, target=1,
+                                 timeout=1.0):
+        """Read a whole MiFare Classic 1K or 4K card with one authentication
+        per sector.  Returns a tuple of the card image (a bytearray of
+        card_size bytes) and a list of the sectors that could not be read.
+        Unread sectors are left zero-filled in the image; after a failed
+        authentication the card is re-selected and the dump carries on.  Note
+        that key A always reads back as zeros from sector trailers.  Instead of
+        key_number and key, a keymanager.KeyManager can be passed as keys to
+        find a working key for every sector.  Target is the card's target number
+        and timeout applies to each command.
+        """
+        image = bytearray(card_size)
+        view = memoryview(image)
+        failed = []
+
+        sector_count = mifare_classic_sector_count(card_size)
+        for sector in range(sector_count):
+            blocks = mifare_classic_sector_blocks(sector)
+            offset = blocks[0] * 16
+            sector_view = view[offset:offset + 16 * len(blocks)]
+            if self.mifare_classic_read_sector(uid, sector, key_number, key, sector_view, keys, target,
+                                               timeout) is not None:
+                continue
+
+            failed.append(sector)
+            sector_view[:] = bytes(len(sector_view))
+            if sector + 1 < sector_count:
+                target = self.reselect(uid, timeout=timeout)
+                if target is None:
+                    # The card has left the field.
+                    failed.extend(range(sector + 1, sector_count))
+                    break
+
+        view.release()
+        return image, failed
+
+    def mifare_classic_write_blocks(self, uid, blocks, key_number=None, key=None, verify=False, allow_trailers=False,
+                                    keys=None, target=1, timeout=1.0):
+        """Write several blocks of a MiFare Classic card.  Blocks should map
+        block numbers to 16 bytes of data each.  Writes are grouped by sector:
+        each sector is authenticated once and its blocks are written in order.
+        With verify, the written blocks of each sector are read back and
+        compared.  Sector trailers hold the keys and access bits, so writing
+        them raises ValueError unless allow_trailers is set.  Returns a list of
+        the block numbers that could not be written (or verified); an empty list
+        means every block was written.  Instead of key_number and key, a
+        keymanager.KeyManager can be passed as keys to find a working key for
+        every sector.  Target is the card's target number and timeout applies
+        to each command.
+        """
+        by_sector = {}
+        for block_number in sorted(blocks):
+            data = blocks[block_number]
+            assert len(data) == 16, 'Data must be an array of 16 bytes!'
+            if mifare_classic_is_trailer(block_number) and not allow_trailers:
+                raise ValueError('Block {} is a sector trailer!'.format(block_number))
+            by_sector.setdefault(mifare_classic_block_sector(block_number), []).append(block_number)
+
+        failed = []
+        sectors = sorted(by_sector.items())
+        for i, (_, block_numbers) in enumerate(sectors):
+            good = self._mifare_classic_write_sector(uid, block_numbers, blocks, key_number, key, keys, verify, target,
+                                                     timeout)
+            if len(good) == len(block_numbers):
+                continue
+
+            failed.extend(b for b in block_numbers if b not in good)
+            if i + 1 < len(sectors):
+                target = self.reselect(uid, timeout=timeout)
+                if target is None:
+                    # The card has left the field.
+                    for _, rest in sectors[i + 1:]:
+                        failed.extend(rest)
+                    break
+
+        return failed
+
+    def _mifare_classic_write_sector(self, uid, block_numbers, blocks, key_number, key, keys, verify, target,
+                                     timeout):
+        """Authenticate the sector of block_numbers once, write them in order
+        and optionally read them back.  Returns the blocks that made it.
+        """
+        if not self._mifare_classic_authenticate_sector(uid, block_numbers[0], key_number, key, keys, target,
+                                                        timeout):
+            return []
+
+        written = []
+        for block_number in block_numbers:
+            if not self.mifare_classic_write_block(block_number, blocks[block_number], target, timeout):
+                break
+            written.append(block_number)
+
+        if not verify:
+            return written
+
+        verified = []
+        for block_number in written:
+            data = self.mifare_classic_read_block(block_number, target, timeout)
+            if data is None:
+                break
+            if bytes(data) == bytes(blocks[block_number]):
+                verified.append(block_number)
+        return verified
+
+    def in_communicate_thru(self, data, timeout=1.0):
+        """Send data as is to the current target (the last one listed or
+        exchanged with) with InCommunicateThru; the PN532 adds the CRC.
+        Returns the target's answer, or None if it did not answer properly.
+        """
+        response = self.call_function(PN532_COMMAND_INCOMMUNICATETHRU, data, timeout=timeout)
+        if response_status(response) != 0x00:
+            return None
+        return response[1:]
+
+    def ultralight_get_version(self, timeout=1.0):
+        """Return the 8 GET_VERSION bytes of the current MIFARE Ultralight EV1
+        or NTAG target, or None if it did not answer (plain Ultralight and
+        Ultralight C tags do not know GET_VERSION).
+        """
+        response = self.in_communicate_thru([NTAG_CMD_GET_VERSION], timeout)
+        if response is None or len(response) != 8:
+            return None
+        return bytes(response)
+
+    def ultralight_identify(self, uid, target=1, timeout=1.0):
+        """Find the UltralightType of the tag uid (target number target) with
+        GET_VERSION, selecting the target first.  Tags that do not answer
+        GET_VERSION are re-selected and taken for a plain MIFARE Ultralight;
+        re-selecting may renumber the target.  Returns a tuple of the tag type
+        and the tag's target number, None if it has left the field.
+        """
+        if not self.in_select(target, timeout):
+            target = self.reselect(uid, timeout=timeout)
+            if target is None:
+                return ULTRALIGHT, None
+        version = self.ultralight_get_version(timeout)
+        if version is None:
+            return ULTRALIGHT, self.reselect(uid, timeout=timeout)
+        tag_type = ULTRALIGHT_TYPES.get((version[2], version[6]))
+        if tag_type is None:
+            # Unknown model: only assume the memory every one of them has.
+            tag_type = UltralightType('Unknown ({})'.format(version.hex()), 16, 16, True)
+        return tag_type, target
+
+    def ultralight_read_pages(self, page, target=1, timeout=1.0):
+        """READ 4 pages (16 bytes) starting at page, wrapping around at the
+        end of the tag.  Returns the 16 bytes or None on error.
+        """
+        response = self.call_function(PN532_COMMAND_INDATAEXCHANGE, target, MIFARE_CMD_READ, page, timeout=timeout)
+        if response_status(response) != 0x00:
+            return None
+        return response[1:]
+
+    def ultralight_fast_read(self, start_page, end_page, timeout=1.0):
+        """FAST_READ pages start_page to end_page (inclusive) of the current
+        target (the last one listed, selected or exchanged with; see
+        in_select).  Returns their data or None on error.  The answer must fit
+        in one PN532 frame, see ULTRALIGHT_FAST_READ_PAGES.
+        """
+        assert 0 <= end_page - start_page < self.ULTRALIGHT_FAST_READ_PAGES, 'Too many pages for one FAST_READ.'
+        response = self.in_communicate_thru([NTAG_CMD_FAST_READ, start_page, end_page], timeout)
+        if response is None or len(response) != (end_page - start_page + 1) * 4:
+            return None
+        return response
+
+    def ultralight_read_tag(self, uid, tag_type=None, target=1, timeout=1.0):
+        """Read a whole MIFARE Ultralight or NTAG tag.  The tag type is found
+        with ultralight_identify unless given.  Tags that know FAST_READ are
+        selected and read ULTRALIGHT_FAST_READ_PAGES pages per exchange (4
+        exchanges for an NTAG216), others with 4-page READs.  Returns a tuple
+        of the tag image (a bytearray of all pages, or None if a read failed)
+        and the tag type.
+        """
+        if tag_type is None:
+            tag_type, target = self.ultralight_identify(uid, target, timeout)
+            if target is None:
+                return None, tag_type
+        elif tag_type.fast_read and not self.in_select(target, timeout):
+            # FAST_READ goes to the current target, so make it this one.
+            return None, tag_type
+
+        image = bytearray(tag_type.pages * 4)
+        step = self.ULTRALIGHT_FAST_READ_PAGES if tag_type.fast_read else 4
+        for page in range(0, tag_type.pages, step):
+            last = min(page + step, tag_type.pages) - 1
+            if tag_type.fast_read:
+                data = self.ultralight_fast_read(page, last, timeout)
+            else:
+                data = self.ultralight_read_pages(page, target, timeout)
+            if data is None:
+                return None, tag_type
+            image[page * 4:(last + 1) * 4] = data[:(last + 1 - page) * 4]
+        return image, tag_type
+
+    def ultralight_write_page(self, page, data, target=1, timeout=1.0):
+        """Write 4 bytes of data to a page.  Returns True on success."""
+        assert len(data) == 4, 'Data must be an array of 4 bytes!'
+        response = self.call_function(PN532_COMMAND_INDATAEXCHANGE, target, MIFARE_ULTRALIGHT_CMD_WRITE, page, data,
+                                      timeout=timeout)
+        return response_status(response) == 0x00
+
+    def ultralight_write(self, page, data, image=None, tag_type=None, allow_special_pages=False, target=1,
+                         timeout=1.0):
+        """Write data (a multiple of 4 bytes) to consecutive pages starting at
+        page, one exchange per page.  With image, a bytearray of the whole tag
+        as returned by ultralight_read_tag, pages whose content is unchanged
+        are skipped and written pages are updated in image.  Pages 0 to 3 (UID,
+        lock bytes and capability container) and, if tag_type is given, the
+        configuration pages after user memory raise ValueError unless
+        allow_special_pages is set: some of their bits can never be cleared
+        again.  Returns a list of the pages that could not be written.
+        """
+        assert len(data) % 4 == 0, 'Data must be a multiple of 4 bytes!'
+        end = page + len(data) // 4
+        if not allow_special_pages and (page < 4 or (tag_type is not None and end > tag_type.user_end)):
+            raise ValueError('Pages {} to {} include special pages!'.format(page, end - 1))
+
+        failed = []
+        for i in range(page, end):
+            chunk = data[(i - page) * 4:(i - page) * 4 + 4]
+            if image is not None and image[i * 4:i * 4 + 4] == chunk:
+                continue
+            if not self.ultralight_write_page(i, chunk, target, timeout):
+                failed.append(i)
+            elif image is not None:
+                image[i * 4:i * 4 + 4] = chunk
+        return failed
+
+    def _mifare_classic_value_command(self, command, block_number, operand, target, timeout):
+        response = self.call_function(PN532_COMMAND_INDATAEXCHANGE, target, command, block_number, operand,
+                                      timeout=timeout)
+        return response_status(response) == 0x00
+
+    def mifare_classic_increment(self, block_number, delta, target=1, timeout=1.0):
+        """Add delta to the value block block_number, leaving the result in the
+        card's transfer buffer for mifare_classic_transfer.  Returns True on
+        success.
+        """
+        assert delta >= 0, 'Delta must not be negative.'
+        return self._mifare_classic_value_command(MIFARE_CMD_INCREMENT, block_number, delta.to_bytes(4, 'little'),
+                                                  target, timeout)
+
+    def mifare_classic_decrement(self, block_number, delta, target=1, timeout=1.0):
+        """Subtract delta from the value block block_number, leaving the result
+        in the card's transfer buffer for mifare_classic_transfer.  Returns
+        True on success.
+        """
+        assert delta >= 0, 'Delta must not be negative.'
+        return self._mifare_classic_value_command(MIFARE_CMD_DECREMENT, block_number, delta.to_bytes(4, 'little'),
+                                                  target, timeout)
+
+    def mifare_classic_restore(self, block_number, target=1, timeout=1.0):
+        """Copy the value block block_number into the card's transfer buffer
+        (to back it up into another block with mifare_classic_transfer).
+        Returns True on success.
+        """
+        return self._mifare_classic_value_command(MIFARE_CMD_STORE, block_number, bytes(4), target, timeout)
+
+    def mifare_classic_transfer(self, block_number, target=1, timeout=1.0):
+        """Write the card's transfer buffer to block_number, which must be in
+        the same sector as the preceding increment, decrement or restore.
+        Returns True on success.
+        """
+        response = self.call_function(PN532_COMMAND_INDATAEXCHANGE, target, MIFARE_CMD_TRANSFER, block_number,
+                                      timeout=timeout)
+        return response_status(response) == 0x00
+
+    def mifare_classic_read_value(self, block_number, target=1, timeout=1.0):
+        """Read a value block.  Returns its value, or None if the block could
+        not be read or does not hold a valid value block.
+        """
+        data = self.mifare_classic_read_block(block_number, target, timeout)
+        if data is None:
+            return None
+        try:
+            return mifare_classic_parse_value_block(data)[0]
+        except ValueError:
+            return None
+
+    def mifare_classic_write_value(self, block_number, value, target=1, timeout=1.0):
+        """Format block_number as a value block holding value.  Returns True on
+        success.
+        """
+        return self.mifare_classic_write_block(block_number, mifare_classic_value_block(value, block_number), target,
+                                               timeout)
+
+    def mifare_classic_value_transaction(self, uid, block_number, operation, delta=0, key_number=None, key=None,
+                                         keys=None, transfer_block=None, expect=None, verify=True, target=1,
+                                         timeout=1.0):
+        """Run one value block transaction: authenticate the sector, apply
+        operation (MIFARE_CMD_INCREMENT, MIFARE_CMD_DECREMENT or
+        MIFARE_CMD_STORE for restore) to block_number with delta and transfer
+        the result to transfer_block (block_number itself by default, which
+        must be in the same sector).  The card only commits the new value on
+        the transfer, so a transaction cut short leaves the old value in place.
+        That takes three exchanges; with verify, a fourth reads the result back
+        and checks it is a valid value block (equal to expect, if given).
+        Returns a tuple of True or False for success and the new value (None
+        unless it was read back).  Instead of key_number and key, a
+        keymanager.KeyManager can be passed as keys.
+        """
+        if operation not in (MIFARE_CMD_INCREMENT, MIFARE_CMD_DECREMENT, MIFARE_CMD_STORE):
+            raise ValueError('Unsupported value block operation: {:#x}'.format(operation))
+        if transfer_block is None:
+            transfer_block = block_number
+        if mifare_classic_block_sector(transfer_block) != mifare_classic_block_sector(block_number):
+            raise ValueError('Block {} is not in the sector of block {}!'.format(transfer_block, block_number))
+        if mifare_classic_is_trailer(block_number) or mifare_classic_is_trailer(transfer_block):
+            raise ValueError('Sector trailers cannot hold values!')
+
+        if not self._mifare_classic_authenticate_sector(uid, block_number, key_number, key, keys, target, timeout):
+            return False, None
+
+        if operation == MIFARE_CMD_INCREMENT:
+            ok = self.mifare_classic_increment(block_number, delta, target, timeout)
+        elif operation == MIFARE_CMD_DECREMENT:
+            ok = self.mifare_classic_decrement(block_number, delta, target, timeout)
+        else:
+            ok = self.mifare_classic_restore(block_number, target, timeout)
+        if not ok or not self.mifare_classic_transfer(transfer_block, target, timeout):
+            return False, None
+
+        if not verify:
+            return True, None
+        value = self.mifare_classic_read_value(transfer_block, target, timeout)
+        return value is not None and (expect is None or value == expect), value
+
+    def transceive(self, data, target=1, timeout=1.0):
+        """Exchange data with an ISO14443-4 (ISO-DEP) target through
+        InDataExchange, which takes care of the ISO-DEP block protocol.  Data
+        longer than PN532_MAX_EXCHANGE_DATA is sent in parts chained with the
+        MI bit, and an answer the PN532 hands over in parts is fetched part by
+        part into one bytearray.  Returns the answer, or None if the target
+        did not answer.  Timeout applies to each part.
+        """
+        data = memoryview(bytes(data))
+        offset = 0
+        while True:
+            part = data[offset:offset + PN532_MAX_EXCHANGE_DATA]
+            offset += PN532_MAX_EXCHANGE_DATA
+            more = PN532_MI if offset < len(data) else 0
+            response = self.call_function(PN532_COMMAND_INDATAEXCHANGE, target | more, part, timeout=timeout)
+            status = response_status(response)
+            if status is None or status & 0x3F:
+                return None
+            if not more:
+                break
+
+        answer = bytearray()
+        while True:
+            answer += memoryview(response)[1:]
+            if not response[0] & PN532_MI:
+                return answer
+            response = self.call_function(PN532_COMMAND_INDATAEXCHANGE, target, timeout=timeout)
+            status = response_status(response)
+            if status is None or status & 0x3F:
+                return None
+
+    def transceive_apdu(self, apdu, target=1, timeout=1.0, get_response=True):
+        """Send a command APDU (see encode_apdu) to an ISO14443-4 target and
+        return its ApduResponse, or None if it did not answer properly.  With
+        get_response, answers the card leaves waiting (status word 61XX) are
+        fetched with GET RESPONSE and appended.
+        """
+        response = self.transceive(apdu, target, timeout)
+        while response is not None and len(response) >= 2:
+            if not get_response or response[-2] != 0x61:
+                sw = (response[-2] << 8) | response[-1]
+                del response[-2:]
+                return ApduResponse(response, sw)
+            le = response[-1] or 256
+            del response[-2:]
+            more = self.transceive(encode_apdu(0x00, ISO7816_INS_GET_RESPONSE, 0x00, 0x00, le=le), target, timeout)
+            if more is None:
+                return None
+            response += more
+        return None
+
+    def run_apdu_script(self, apdus, target=1, timeout=1.0):
+        """Send command APDUs (any iterable, consumed as it goes) one after
+        the other, yielding each ApduResponse as soon as it arrives.  Stops
+        after the first response whose status word is not ISO7816_SW_OK, or
+        after yielding None for an APDU that got no proper answer.
+        """
+        for apdu in apdus:
+            response = self.transceive_apdu(apdu, target, timeout)
+            yield response
+            if response is None or response.sw != ISO7816_SW_OK:
+                return
+
+    def tg_init_as_target(self, mode=PN532_TARGET_PICC_ONLY, sens_res=b'\x04\x00', nfcid1=b'\x12\x34\x56',
+                          sel_res=0x20, felica_params=bytes(18), nfcid3=bytes(10), general_bytes=b'',
+                          historical_bytes=b'', timeout=None):
+        """Configure the PN532 as a target (an emulated card, or a P2P target
+        with PN532_TARGET_DEP_ONLY) and wait up to timeout seconds (None for
+        ever) for an initiator to activate it.  nfcid1 is the last 3 bytes of
+        the emulated UID (the PN532 puts 0x08 in front).  Returns a tuple of
+        the activation mode byte and the initiator's first command, or None
+        if no initiator came.
+        """
+        assert len(sens_res) == 2 and len(nfcid1) == 3, 'SENS_RES is 2 bytes and NFCID1t 3 bytes.'
+        assert len(felica_params) == 18 and len(nfcid3) == 10, 'FeliCa params are 18 bytes and NFCID3t 10 bytes.'
+        response = self.call_function(PN532_COMMAND_TGINITASTARGET, mode, sens_res, nfcid1, sel_res, felica_params,
+                                      nfcid3, len(general_bytes), general_bytes, len(historical_bytes),
+                                      historical_bytes, timeout=timeout)
+        if response == "no_card" or not response:
+            return None
+        return response[0], response[1:]
+
+    def tg_get_data(self, timeout=1.0):
+        """Return the next command from the initiator (as target), or None if
+        the initiator released the target, left or sent nothing in time.
+        """
+        response = self.call_function(PN532_COMMAND_TGGETDATA, timeout=timeout)
+        if response_status(response) != 0x00:
+            return None
+        return response[1:]
+
+    def tg_set_data(self, data, timeout=1.0):
+        """Send the answer to the initiator's last command (as target).
+        Returns True on success.
+        """
+        response = self.call_function(PN532_COMMAND_TGSETDATA, data, timeout=timeout)
+        return response_status(response) == 0x00
@@ -0,0 +1,375 @@
+# UID allowlist for access control with the PN532.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Allow/deny decisions for card UIDs against a large enrolment list.
+
+The list lives in an allowlist file: an open-addressing hash table of
+fixed-size slots (a 4, 7 or 10-byte UID and the window of time it is valid
+in) that Allowlist memory-maps rather than loads, so opening a
+million-entry list is instant and a lookup is a CRC32 and one or two slot
+comparisons:
+
+    write_allowlist('site.acl', [(uid, not_before, not_after), ...])
+    allowlist = Allowlist('site.acl')
+    for uid, decision in access_decisions(CardSession(pn532), allowlist):
+        print(uid.hex(), decision)
+
+Changes between full lists are applied as deltas, kept in memory in front of
+the file until compact() writes a new one.  reload() (or maybe_reload(), for
+a file replaced by another process) swaps the new list in.  Lookups never take
+a lock: writers build a new state and replace it in one assignment.
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+ALLOWLIST_MAGIC = b'PN532ACL'
+ALLOWLIST_VERSION = 1
+
+# Decisions
+ALLOW = 'allow'
+UNKNOWN = 'unknown'
+NOT_YET_VALID = 'not_yet_valid'
+EXPIRED = 'expired'
+
+# Window bounds meaning "no bound".
+NO_NOT_BEFORE = 0
+NO_NOT_AFTER = 0xFFFFFFFF
+
+MAX_UID_LENGTH = 10
+
+# Header: magic, version, slot size, entry count, slot count (a power of 2).
+_HEADER = struct.Struct('<8sHHII')
+# Slot: UID length (0 for an empty slot), UID padded with zeros, not_before,
+# not_after (seconds since the epoch).
+_SLOT = struct.Struct('<B10sxII')
+_SLOTS_OFFSET = _HEADER.size
+_SLOT_SIZE = _SLOT.size
+
+# Length-prefixed lookup keys, as they appear at the start of a slot.
+_LENGTH_PREFIX = [bytes([n]) for n in range(MAX_UID_LENGTH + 1)]
+
+# Lookups hash the UID alone, starting from the CRC32 of its length prefix
+# (crc32(uid, seed) is crc32(prefix + uid)), and read a slot with one unpack
+# laid out for the UID's length: (length, uid, not_before, not_after).
+_CRC_SEEDS = [zlib.crc32(prefix) for prefix in _LENGTH_PREFIX]
+_UNPACK_SLOT = [None] + [struct.Struct('<B{}s{}xII'.format(n, MAX_UID_LENGTH + 1 - n)).unpack_from
+                         for n in range(1, MAX_UID_LENGTH + 1)]
+_crc32 = zlib.crc32
+_NOT_LISTED = object()
+
+
+def _entry(entry):
+    """Normalize a UID or a (uid, not_before, not_after) tuple (None for no
+    bound) to (uid, not_before, not_after).
+    """
+    if isinstance(entry, (bytes, bytearray)):
+        uid, not_before, not_after = entry, None, None
+    else:
+        uid, not_before, not_after = entry
+    assert 0 < len(uid) <= MAX_UID_LENGTH, 'UIDs are 1 to 10 bytes long.'
+    return (bytes(uid), NO_NOT_BEFORE if not_before is None else int(not_before),
+            NO_NOT_AFTER if not_after is None else int(not_after))
+
+
+def write_allowlist(path, entries, load_factor=0.5):
+    """Write entries (UIDs or (uid, not_before, not_after) tuples, bounds in
+    seconds since the epoch or None) to an allowlist file at path.  A UID
+    listed twice keeps its last window.  The file is written beside path and
+    renamed over it, so readers of the old file are never disturbed.  Returns
+    the number of UIDs written.
+    """
+    entries = [_entry(entry) for entry in entries]
+    slots = 8
+    while slots * load_factor < len(entries):
+        slots *= 2
+    mask = slots - 1
+    size = _SLOT.size
+    table = bytearray(_HEADER.size + slots * size)
+
+    count = 0
+    for uid, not_before, not_after in entries:
+        key = _LENGTH_PREFIX[len(uid)] + uid
+        slot = zlib.crc32(key) & mask
+        while True:
+            offset = _HEADER.size + slot * size
+            if table[offset] == 0:
+                count += 1
+                break
+            if table[offset:offset + len(key)] == key:
+                break
+            slot = (slot + 1) & mask
+        _SLOT.pack_into(table, offset, len(uid), uid, not_before, not_after)
+    _HEADER.pack_into(table, 0, ALLOWLIST_MAGIC, ALLOWLIST_VERSION, size, count, slots)
+
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(table)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+class _Table:
+    """A memory-mapped allowlist file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+        magic, version, slot_size, self.count, slots = _HEADER.unpack_from(self.mm, 0)
+        if magic != ALLOWLIST_MAGIC or version != ALLOWLIST_VERSION or slot_size != _SLOT.size:
+            raise ValueError('{} is not a version {} allowlist file.'.format(path, ALLOWLIST_VERSION))
+        if slots & (slots - 1) or len(self.mm) != _HEADER.size + slots * slot_size:
+            raise ValueError('{} is truncated or corrupt.'.format(path))
+        self.mask = slots - 1
+
+    def __iter__(self):
+        """Yield (uid, not_before, not_after) for every entry."""
+        for offset in range(_HEADER.size, len(self.mm), _SLOT.size):
+            length, uid, not_before, not_after = _SLOT.unpack_from(self.mm, offset)
+            if length:
+                yield uid[:length], not_before, not_after
+
+
+class Allowlist:
+    """Lock-free UID lookups in the allowlist file at path, plus the deltas
+    applied since it was loaded.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._set_state(_Table(path), {})
+
+    def _set_state(self, table, overlay):
+        # (mm, mask, overlay, table), swapped in one assignment and holding
+        # what a lookup needs first.  The overlay maps UIDs to windows, None
+        # for UIDs removed since the table was written.
+        self._state = (table.mm, table.mask, overlay, table)
+
+    def __len__(self):
+        mm, mask, overlay, table = self._state
+        count = table.count
+        for uid, window in overlay.items():
+            in_table = self._table_window(mm, mask, uid) is not None
+            count += (window is not None) - in_table
+        return count
+
+    def __contains__(self, uid):
+        return self.window(uid) is not None
+
+    @staticmethod
+    def _table_window(mm, mask, uid):
+        n = len(uid)
+        unpack_slot = _UNPACK_SLOT[n]
+        slot = _crc32(uid, _CRC_SEEDS[n]) & mask
+        while True:
+            length, key, not_before, not_after = unpack_slot(mm, _SLOTS_OFFSET + slot * _SLOT_SIZE)
+            if length == n and key == uid:
+                return not_before, not_after
+            if not length:
+                return None
+            slot = (slot + 1) & mask
+
+    def window(self, uid):
+        """Return the (not_before, not_after) window of uid, or None if it is
+        not on the list.
+        """
+        # _table_window inlined: this is the path every tap takes.
+        mm, mask, overlay, _ = self._state
+        if overlay:
+            window = overlay.get(bytes(uid), _NOT_LISTED)
+            if window is not _NOT_LISTED:
+                return window
+        n = len(uid)
+        unpack_slot = _UNPACK_SLOT[n]
+        slot = _crc32(uid, _CRC_SEEDS[n]) & mask
+        while True:
+            length, key, not_before, not_after = unpack_slot(mm, _SLOTS_OFFSET + slot * _SLOT_SIZE)
+            if length == n and key == uid:
+                return not_before, not_after
+            if not length:
+                return None
+            slot = (slot + 1) & mask
+
+    def decide(self, uid, now=None):
+        """Return ALLOW, UNKNOWN, NOT_YET_VALID or EXPIRED for uid at now
+        (seconds since the epoch, the clock by default).
+        """
+        window = self.window(uid)
+        if window is None:
+            return UNKNOWN
+        now = self.clock() if now is None else now
+        if now < window[0]:
+            return NOT_YET_VALID
+        if now > window[1]:
+            return EXPIRED
+        return ALLOW
+
+    def allowed(self, uid, now=None):
+        """Return True if uid is on the list and valid at now."""
+        # window inlined, without building the window tuple.
+        if now is None:
+            now = self.clock()
+        mm, mask, overlay, _ = self._state
+        if overlay:
+            window = overlay.get(bytes(uid), _NOT_LISTED)
+            if window is not _NOT_LISTED:
+                return window is not None and window[0] <= now <= window[1]
+        n = len(uid)
+        unpack_slot = _UNPACK_SLOT[n]
+        slot = _crc32(uid, _CRC_SEEDS[n]) & mask
+        while True:
+            length, key, not_before, not_after = unpack_slot(mm, _SLOTS_OFFSET + slot * _SLOT_SIZE)
+            if length == n and key == uid:
+                return not_before <= now <= not_after
+            if not length:
+                return False
+            slot = (slot + 1) & mask
+
+    def apply_delta(self, added=(), removed=()):
+        """Add (or change the window of) the added entries and remove the
+        removed UIDs, in memory, until the next reload().
+        """
+        with self._lock:
+            overlay, table = self._state[2:]
+            overlay = dict(overlay)
+            for entry in added:
+                uid, not_before, not_after = _entry(entry)
+                overlay[uid] = (not_before, not_after)
+            for uid in removed:
+                overlay[bytes(uid)] = None
+            self._set_state(table, overlay)
+
+    def apply_delta_file(self, path):
+        """Apply a delta file: lines of '+' or '-', a hex UID and, for
+        additions, optional not_before and not_after ('-' for no bound).
+        Blank lines and lines starting with '#' are skipped.
+        """
+        added, removed = [], []
+        with open(path) as f:
+            for line_number, line in enumerate(f, 1):
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                if fields[0] not in ('+', '-') or len(fields) < 2:
+                    raise ValueError('{}:{}: bad delta line.'.format(path, line_number))
+                if fields[0] == '-':
+                    removed.append(bytes.fromhex(fields[1]))
+                else:
+                    added.append(parse_entry(fields[1:]))
+        self.apply_delta(added, removed)
+
+    def entries(self):
+        """Yield (uid, not_before, not_after) for every UID on the list."""
+        overlay, table = self._state[2:]
+        for uid, not_before, not_after in table:
+            if uid not in overlay:
+                yield uid, not_before, not_after
+        for uid, window in overlay.items():
+            if window is not None:
+                yield (uid,) + window
+
+    def compact(self, path=None):
+        """Write the list with its deltas to path (this list's file by
+        default) and reload from it.
+        """
+        with self._lock:
+            path = self.path if path is None else path
+            write_allowlist(path, self.entries())
+            self.path = path
+            self._set_state(_Table(path), {})
+
+    def reload(self):
+        """Load the file at path again, dropping the deltas: a new full list
+        supersedes them.  Lookups in progress finish on the old list.
+        """
+        with self._lock:
+            self._set_state(_Table(self.path), {})
+
+    def maybe_reload(self):
+        """Reload if the file at path has been replaced or changed since it
+        was loaded.  Returns True if it was.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if (st.st_ino, st.st_size, st.st_mtime_ns) == self._state[3].stat:
+            return False
+        self.reload()
+        return True
+
+
+def parse_entry(fields):
+    """Parse a hex UID and optional not_before and not_after fields ('-' for
+    no bound) into an entry for write_allowlist.
+    """
+    bounds = [None if field == '-' else int(field) for field in fields[1:3]]
+    return (bytes.fromhex(fields[0]),) + tuple(bounds + [None] * (2 - len(bounds)))
+
+
+def access_decisions(session, allowlist, timeout=1.0):
+    """Yield (uid, decision) for every new tap on the reader of a
+    cardsession.CardSession.  A card left on the reader is decided once.
+    """
+    while True:
+        uid = session.poll(timeout)
+        if uid is not None and session.arrived:
+            yield uid, allowlist.decide(uid)
+
+
+def main():
+    p = argparse.ArgumentParser(description='Build or query a UID allowlist file.')
+    sub = p.add_subparsers(dest='command', required=True)
+    s = sub.add_parser('build', help='build an allowlist file from a text file of "UID [not_before [not_after]]" lines')
+    s.add_argument('allowlist')
+    s.add_argument('source')
+    s = sub.add_parser('check', help='print the decision for UIDs')
+    s.add_argument('allowlist')
+    s.add_argument('uids', nargs='+', help='UIDs in hex')
+    args = p.parse_args()
+
+    if args.command == 'build':
+        with open(args.source) as f:
+            entries = [parse_entry(line.split()) for line in f if line.strip() and not line.startswith('#')]
+        print('{} UIDs written.'.format(write_allowlist(args.allowlist, entries)))
+    else:
+        allowlist = Allowlist(args.allowlist)
+        for uid in args.uids:
+            print(uid, allowlist.decide(bytes.fromhex(uid)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+# asyncio PN532 HSU client.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""asyncio version of the PN532 driver.
+
+AsyncPN532 reads the serial port's file descriptor from the event loop
+(non-blocking, POSIX only) instead of blocking a thread per reader:
+
+    async with AsyncPN532('/dev/ttyUSB0') as pn532:
+        await pn532.SAM_configuration()
+        uid = await pn532.read_passive_target()
+
+Commands from any number of coroutines go through a per-device FIFO queue and
+run one at a time, in the order they were issued.  Use transaction() to run
+several commands (like authenticate then read) without other coroutines'
+commands slipping in between.  A command cancelled or timed out while the
+PN532 is working on it is aborted by sending an ACK frame.
+"""
+
+import asyncio
+import os
+
+import serial
+
+import PN532
+from PN532 import (FRAME_ACK, FRAME_ERROR, FRAME_INFO, FRAME_NACK, PN532_ACK_FRAME, PN532_HOSTTOPN532,
+                   PN532_NACK_FRAME, PN532_PN532TOHOST, FrameBuilder, FrameParser, PN532ChecksumError,
+                   PN532ProtocolError, PN532TimeoutError, RetryPolicy, response_status)
+
+
+class AsyncSerialTransport:
+    """Serial port read and written without blocking from the event loop."""
+
+    def __init__(self, comport, baudrate=115200):
+        self.ser = serial.Serial(comport, baudrate, timeout=0)
+        self._fd = self.ser.fileno()
+        os.set_blocking(self._fd, False)
+        self._loop = None
+
+    @property
+    def baudrate(self):
+        return self.ser.baudrate
+
+    def start(self, on_data):
+        """Call on_data(bytes) from the running event loop whenever data
+        arrives.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._fd, self._on_readable, on_data)
+
+    def _on_readable(self, on_data):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        if data:
+            on_data(data)
+
+    async def write(self, data):
+        data = memoryview(bytes(data))
+        while data:
+            try:
+                written = os.write(self._fd, data)
+            except BlockingIOError:
+                written = 0
+            data = data[written:]
+            if data:
+                writable = self._loop.create_future()
+                self._loop.add_writer(self._fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    self._loop.remove_writer(self._fd)
+
+    def write_nowait(self, data):
+        """Best effort immediate write of a short frame (used to abort)."""
+        try:
+            os.write(self._fd, data)
+        except OSError:
+            pass
+
+    def reset_input_buffer(self):
+        self.ser.reset_input_buffer()
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self._fd)
+        self.ser.close()
+
+
+class AsyncPN532:
+    def __init__(self, comport=None, baudrate=115200, transport=None, retry=None):
+        if transport is None:
+            transport = AsyncSerialTransport(comport, baudrate)
+        self.transport = transport
+        self.retry = RetryPolicy() if retry is None else retry
+
+        self._parser = FrameParser()
+        self._builder = FrameBuilder()
+        self._data = None
+        self._queue = None
+        self._owner = None
+
+    async def open(self):
+        """Start reading from the transport.  Must be awaited (or the instance
+        used with async with) before any command.
+        """
+        self._data = asyncio.Event()
+        self._queue = asyncio.Lock()
+        self.transport.start(self._on_data)
+
+    async def close(self):
+        self.transport.close()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _on_data(self, data):
+        self._parser.feed(data)
+        self._data.set()
+
+    async def _next_frame(self, kinds):
+        while True:
+            frame = self._parser.next_frame()
+            if frame is None:
+                self._data.clear()
+                await self._data.wait()
+            elif frame.kind in kinds:
+                return frame
+
+    def _abort(self):
+        """Make the PN532 drop the command it is working on."""
+        self.transport.write_nowait(PN532_ACK_FRAME)
+        self._parser.reset()
+
+    async def _write_frame(self, frame, retry, deadline):
+        """Send frame until the PN532 acknowledges it, like
+        PN532._write_frame.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, retry.max_attempts + 1):
+            pause = retry.delay(attempt)
+            if pause > 0:
+                await asyncio.sleep(pause)
+            ack_timeout = retry.ack_timeout + self._wire_time(len(frame))
+            if deadline is not None:
+                ack_timeout = min(ack_timeout, deadline - loop.time())
+                if ack_timeout <= 0:
+                    break
+
+            await self.transport.write(frame)
+            try:
+                ack = await asyncio.wait_for(self._next_frame((FRAME_ACK, FRAME_NACK)), ack_timeout)
+            except asyncio.TimeoutError:
+                continue
+            if ack.kind == FRAME_ACK:
+                return
+        raise PN532TimeoutError('PN532 did not acknowledge the command!')
+
+    def _wire_time(self, size):
+        """Seconds it takes to send size bytes at the link's speed."""
+        try:
+            return size * 10.0 / self.transport.baudrate
+        except (AttributeError, NotImplementedError):
+            return 0.0
+
+    async def _read_frame(self, retry, deadline):
+        """Wait for the response frame until deadline (in loop.time()
+        seconds, None for ever), like PN532._read_frame.  Returns its data, or
+        "no_card" if no response arrived in time (the pending command is then
+        aborted).  A corrupted response is asked for again with a NACK, up to
+        retry.max_attempts - 1 times; raises PN532ChecksumError if it stays
+        corrupted.
+        """
+        loop = asyncio.get_running_loop()
+        checksum_errors = self._parser.checksum_errors
+        nacks = 0
+        while True:
+            frame = self._parser.next_frame()
+            if frame is None:
+                if self._parser.checksum_errors != checksum_errors:
+                    checksum_errors = self._parser.checksum_errors
+                    if nacks + 1 >= retry.max_attempts:
+                        self._abort()
+                        raise PN532ChecksumError('Response checksum did not match expected value!')
+                    nacks += 1
+                    self._parser.reset()
+                    await self.transport.write(PN532_NACK_FRAME)
+                self._data.clear()
+                try:
+                    await asyncio.wait_for(self._data.wait(), None if deadline is None else
+                                           max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    self._abort()
+                    if nacks:
+                        raise PN532ChecksumError('Response checksum did not match expected value!')
+                    return "no_card"
+            elif frame.kind == FRAME_ERROR:
+                raise PN532ProtocolError('PN532 answered with an application level error frame!')
+            elif frame.kind == FRAME_INFO:
+                return frame.data
+
+    async def _exchange(self, command, params, timeout, retry):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        frame = bytes(self._builder.build(PN532_HOSTTOPN532, command, params))
+        self.transport.reset_input_buffer()
+        self._parser.reset()
+        try:
+            await self._write_frame(frame, retry, deadline)
+            return await self._read_frame(retry, deadline)
+        except asyncio.CancelledError:
+            self._abort()
+            raise
+
+    def transaction(self):
+        """Async context manager holding the command queue, so that the
+        commands issued inside it by the current task run back to back.
+        """
+        return _Transaction(self)
+
+    async def call_function(self, command, *params, timeout=1.0, retry=None):
+        """Queue a command and return its response data, like
+        PN532.call_function.  Returns "no_card" if no response arrived within
+        timeout seconds (None waits forever).
+        """
+        retry = self.retry if retry is None else retry
+        if self._owner is asyncio.current_task():
+            response = await self._exchange(command, params, timeout, retry)
+        else:
+            async with self._queue:
+                response = await self._exchange(command, params, timeout, retry)
+
+        if response == "no_card":
+            return response
+        if response[0] != PN532_PN532TOHOST or response[1] != command + 1:
+            raise PN532ProtocolError('Received unexpected command response!')
+        return response[2:]
+
+    async def begin(self):
+        await self.transport.write(b'\x55\x55\x00\x00\x00')
+
+    async def get_firmware_version(self, timeout=1.0):
+        try:
+            response = await self.call_function(PN532.PN532_COMMAND_GETFIRMWAREVERSION, timeout=timeout)
+        except PN532TimeoutError:
+            response = "no_card"
+        if response == "no_card":
+            raise PN532TimeoutError('Failed to detect the PN532!')
+        return (response[0], response[1], response[2], response[3])
+
+    async def SAM_configuration(self, timeout=1.0):
+        await self.call_function(PN532.PN532_COMMAND_SAMCONFIGURATION, [0x01, 0x14, 0x01], timeout=timeout)
+
+    async def read_passive_targets(self, max_targets=2, card_baud=PN532.PN532_MIFARE_ISO14443A, timeout=1.0):
+        assert 1 <= max_targets <= 2, 'The PN532 can list 1 or 2 targets.'
+        response = await self.call_function(PN532.PN532_COMMAND_INLISTPASSIVETARGET, max_targets, card_baud,
+                                            timeout=timeout)
+        if response == "no_card" or not response:
+            return []
+        targets = []
+        offset = 1
+        for _ in range(response[0]):
+            target, offset = PN532.parse_passive_target(card_baud, response, offset)
+            targets.append(target)
+        return targets
+
+    async def read_passive_target(self, card_baud=PN532.PN532_MIFARE_ISO14443A, timeout=1.0):
+        targets = await self.read_passive_targets(1, card_baud, timeout)
+        if not targets:
+            return "no_card"
+        return targets[0].uid
+
+    async def mifare_classic_authenticate_block(self, uid, block_number, key_number, key, target=1, timeout=1.0):
+        response = await self.call_function(PN532.PN532_COMMAND_INDATAEXCHANGE, target, key_number, block_number,
+                                            key, uid, timeout=timeout)
+        return response_status(response) == 0x00
+
+    async def mifare_classic_read_block(self, block_number, target=1, timeout=1.0):
+        response = await self.call_function(PN532.PN532_COMMAND_INDATAEXCHANGE, target, PN532.MIFARE_CMD_READ,
+                                            block_number, timeout=timeout)
+        if response_status(response) != 0x00:
+            return None
+        return response[1:]
+
+    async def mifare_classic_write_block(self, block_number, data, target=1, timeout=1.0):
+        assert len(data) == 16, 'Data must be an array of 16 bytes!'
+        response = await self.call_function(PN532.PN532_COMMAND_INDATAEXCHANGE, target, PN532.MIFARE_CMD_WRITE,
+                                            block_number, data, timeout=timeout)
+        return response_status(response) == 0x00
+
+
+class _Transaction:
+    def __init__(self, pn532):
+        self._pn532 = pn532
+
+    async def __aenter__(self):
+        await self._pn532._queue.acquire()
+        self._pn532._owner = asyncio.current_task()
+        return self._pn532
+
+    async def __aexit__(self, *exc_info):
+        self._pn532._owner = None
+        self._pn532._queue.release()
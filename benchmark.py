@@ -0,0 +1,1226 @@
+# Benchmarks for the PN532 HSU driver, run against a simulated PN532.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from functools import reduce
+
+import ndef
+import PN532
+from allowlist import Allowlist, write_allowlist
+from asyncpn532 import AsyncPN532
+from capture import RECORD_RX, CaptureReader, RecordingTransport, ReplayTransport
+from cardsession import CardSession
+from metrics import CommandMetrics
+from powermanager import PROFILES, PowerManager
+from readerpool import ReaderPool
+from registers import RegisterShadow, gpio_pins
+from simulator import (PtyBridge, SimulatedPN532, VirtualInitiator, VirtualIsoDepCard, VirtualMifareClassic,
+                       VirtualUltralight, type4_reader)
+from targetmode import TargetServer, Type4Tag
+
+
+class LegacyPN532(PN532.PN532):
+    """Frozen copy of the sleep-polling receive path, kept for comparison."""
+
+    def __init__(self, transport):
+        super().__init__(transport=transport)
+        self.message = b''
+
+    def _write_frame(self, frame, retry=None, deadline=None):
+        frame = bytes(frame)
+        self.transport.reset_input_buffer()
+        ack = False
+        while not ack:
+            self.transport.write(frame)
+            ack = self._ack_wait(1000)
+            time.sleep(0.3)
+        return True
+
+    def _ack_wait(self, timeout):
+        rx_info = b''
+        start_time = PN532.millis()
+        current_time = start_time
+        while current_time - start_time < timeout:
+            time.sleep(0.12)
+            rx_info += self.transport.read(self.transport.in_waiting, 0)
+            current_time = PN532.millis()
+            if PN532.PN532_ACK_FRAME in rx_info:
+                if len(rx_info) > 6:
+                    self.message = b''.join(rx_info.split(PN532.PN532_ACK_FRAME))
+                else:
+                    self.message = rx_info
+                return True
+        self.message = b''
+        return False
+
+    def _read_frame(self, timeout=1.0, retry=None):
+        if not self.message:
+            self._ack_wait(1000)
+        response = self.message
+        if response == PN532.PN532_ACK_FRAME:
+            return "no_card"
+        offset = response.index(b'\x00\xFF') + 2
+        frame_len = response[offset]
+        return response[offset + 2:offset + 2 + frame_len]
+
+
+def uint8_add(a, b):
+    """Frozen copy of the 8-bit addition the legacy checksum is built on."""
+    return ((a & 0xFF) + (b & 0xFF)) & 0xFF
+
+
+def canonicalize_params(params, ignore_errors=False):
+    """Frozen copy of the parameter flattening the legacy frames use."""
+    if not params:
+        return []
+
+    ret = []
+    for i, param in enumerate(params, 1):
+        if isinstance(param, (list, tuple)):
+            ret += canonicalize_params(param)
+        elif isinstance(param, bytes):
+            ret += list(param)
+        elif isinstance(param, str):
+            ret += list(param.encode())
+        elif isinstance(param, int):
+            ret.append(param & 0xFF)
+        elif not ignore_errors:
+            raise ValueError('Param #{} is of unsupported type: {}'.format(i, type(param)))
+
+    return ret
+
+
+def legacy_checksum(data):
+    """Frozen copy of the byte-at-a-time checksum, kept for comparison."""
+    return ~reduce(uint8_add, data, 0xFF) & 0xFF
+
+
+def legacy_build_frame(command, *params):
+    """Frozen copy of the list-based frame building, kept for comparison."""
+    params = canonicalize_params(params)
+    data = bytes([PN532.PN532_HOSTTOPN532, command & 0xFF] + params)
+    length = len(data)
+    return bytes([
+        PN532.PN532_PREAMBLE,
+        PN532.PN532_STARTCODE1,
+        PN532.PN532_STARTCODE2,
+        length & 0xFF,
+        uint8_add(~length, 1)
+    ]) + data + bytes([
+        legacy_checksum(data),
+        PN532.PN532_POSTAMBLE
+    ])
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    print('{:<10} n={:<4} mean={:8.2f} ms  median={:8.2f} ms  p95={:8.2f} ms'.format(
+        name,
+        len(samples),
+        statistics.mean(samples) * 1000,
+        statistics.median(samples) * 1000,
+        samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+    ))
+
+
+def bench_latency(args):
+    """Per-command round-trip time of GetFirmwareVersion, before and after."""
+    for name, cls, count in (('legacy', LegacyPN532, args.legacy_count), ('current', PN532.PN532, args.count)):
+        pn532 = cls(transport=SimulatedPN532())
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            pn532.get_firmware_version()
+            samples.append(time.perf_counter() - start)
+        report(name, samples)
+
+
+def synthetic_frame(rng, tfi=PN532.PN532_PN532TOHOST):
+    """Return (encoded frame, Frame) for a random frame as the PN532 sends them."""
+    kind = rng.random()
+    if kind < 0.1:
+        return PN532.PN532_ACK_FRAME, PN532.Frame(PN532.FRAME_ACK, b'')
+    if kind < 0.15:
+        return PN532.PN532_NACK_FRAME, PN532.Frame(PN532.FRAME_NACK, b'')
+    if kind < 0.2:
+        return b'\x00\x00\xFF\x01\xFF\x7F\x81\x00', PN532.Frame(PN532.FRAME_ERROR, b'\x7F')
+
+    # Payloads are random, so they regularly contain start codes and ACKs.
+    length = rng.randint(1, 264) if kind < 0.3 else rng.randint(1, 40)
+    data = bytes([tfi]) + bytes(rng.getrandbits(8) for _ in range(length - 1))
+    if length < 255:
+        header = bytes([0x00, 0x00, 0xFF, length, (-length) & 0xFF])
+    else:
+        header = bytes([0x00, 0x00, 0xFF, 0xFF, 0xFF, length >> 8, length & 0xFF, (-(length >> 8) - length) & 0xFF])
+    return header + data + bytes([(-sum(data)) & 0xFF, 0x00]), PN532.Frame(PN532.FRAME_INFO, data)
+
+
+def synthetic_stream(rng, size, garbage=0.0, corrupt=0.0):
+    """Build about size bytes of back-to-back frames.  Returns the stream and
+    the frames a parser must recover from it, in order.
+    """
+    stream = bytearray()
+    expected = []
+    while len(stream) < size:
+        if rng.random() < garbage:
+            stream += bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 8)))
+        encoded, frame = synthetic_frame(rng)
+        if frame.kind == PN532.FRAME_INFO and rng.random() < corrupt:
+            encoded = bytearray(encoded)
+            encoded[-3] ^= 1 + rng.getrandbits(7)
+        else:
+            expected.append(frame)
+        stream += encoded
+    return bytes(stream), expected
+
+
+def is_subsequence(needle, haystack):
+    it = iter(haystack)
+    return all(any(x == y for y in it) for x in needle)
+
+
+def bench_parser(args):
+    """FrameParser fuzzing and throughput over synthetic frame streams."""
+    rng = random.Random(args.seed)
+
+    # Fuzz: random chunking, garbage between frames and corrupted checksums.
+    # Every intact frame must come out, in order; garbage may add extra frames.
+    for _ in range(args.fuzz_rounds):
+        stream, expected = synthetic_stream(rng, 64 * 1024, garbage=0.05, corrupt=0.05)
+        parser = PN532.FrameParser()
+        frames = []
+        pos = 0
+        while pos < len(stream):
+            step = rng.randint(1, 300)
+            parser.feed(stream[pos:pos + step])
+            frames.extend(parser)
+            pos += step
+        if not is_subsequence(expected, frames):
+            raise SystemExit('Fuzz round lost frames (seed {})'.format(args.seed))
+    print('fuzz       {} rounds of 64 KiB OK'.format(args.fuzz_rounds))
+
+    # Throughput: clean stream, fed in serial-sized chunks.
+    stream, expected = synthetic_stream(rng, args.megabytes * 1024 * 1024)
+    parser = PN532.FrameParser()
+    count = 0
+    start = time.perf_counter()
+    for pos in range(0, len(stream), args.chunk):
+        parser.feed(stream[pos:pos + args.chunk])
+        for _ in parser:
+            count += 1
+    elapsed = time.perf_counter() - start
+    assert count == len(expected)
+    print('throughput {:.1f} MB/s, {:.0f} frames/s ({} frames, {} byte chunks)'.format(
+        len(stream) / elapsed / 1e6, count / elapsed, count, args.chunk))
+
+
+def bench_builder(args):
+    """Frames built per second, list-based path against FrameBuilder."""
+    uid = b'\xDE\xAD\xBE\xEF'
+    key = [0xFF] * 6
+    block = bytes(range(16))
+    apdu = bytes(250)
+    cases = (
+        ('auth', (PN532.PN532_COMMAND_INDATAEXCHANGE, 1, PN532.MIFARE_CMD_AUTH_B, 4, key, uid)),
+        ('write', (PN532.PN532_COMMAND_INDATAEXCHANGE, 1, PN532.MIFARE_CMD_WRITE, 4, block)),
+        ('apdu-250', (PN532.PN532_COMMAND_INDATAEXCHANGE, 1, apdu)),
+    )
+
+    builder = PN532.FrameBuilder()
+    for name, (command, *params) in cases:
+        assert bytes(builder.build(PN532.PN532_HOSTTOPN532, command, params)) == legacy_build_frame(command, *params)
+        results = []
+        for label, func in (('legacy', lambda: legacy_build_frame(command, *params)),
+                            ('builder', lambda: builder.build(PN532.PN532_HOSTTOPN532, command, params))):
+            start = time.perf_counter()
+            for _ in range(args.count):
+                func()
+            results.append((label, args.count / (time.perf_counter() - start)))
+        print('{:<10} {}'.format(name, '  '.join('{}={:>9.0f}/s'.format(*r) for r in results)))
+
+    # Extended frames must round trip through the parser.
+    payload = bytes(range(256)) + bytes(6)
+    parser = PN532.FrameParser()
+    parser.feed(builder.build(PN532.PN532_HOSTTOPN532, PN532.PN532_COMMAND_INDATAEXCHANGE, (1, payload)))
+    frame = parser.next_frame()
+    assert frame.data[3:] == payload, 'Extended frame did not round trip'
+    print('extended   {} data bytes round trip OK'.format(len(frame.data)))
+
+
+def bench_micro(args):
+    """Checksum, build and parse throughput for frames of 1 to 264 data bytes."""
+    builder = PN532.FrameBuilder()
+    print('{:>5}  {:>12} {:>12}  {:>12}  {:>12}'.format(
+        'bytes', 'cksum legacy', 'cksum sum', 'build', 'parse'))
+    for size in args.sizes:
+        data = bytes(range(256)) * 2
+        view = memoryview(data)[:size]
+        rates = []
+        for func in (legacy_checksum, PN532.PN532.checksum):
+            assert func(view) == legacy_checksum(view)
+            start = time.perf_counter()
+            for _ in range(args.count):
+                func(view)
+            rates.append(args.count / (time.perf_counter() - start))
+
+        # Frames carry size data bytes (TFI, command code and parameters, so at
+        # least two).
+        params = (view[:max(0, size - 2)],)
+        start = time.perf_counter()
+        for _ in range(args.count):
+            builder.build(PN532.PN532_PN532TOHOST, 0x41, params)
+        rates.append(args.count / (time.perf_counter() - start))
+
+        frame = bytes(builder.build(PN532.PN532_PN532TOHOST, 0x41, params))
+        stream = frame * 64
+        parser = PN532.FrameParser()
+        start = time.perf_counter()
+        for _ in range(args.count // 64):
+            parser.feed(stream)
+            for _ in parser:
+                pass
+        rates.append((args.count // 64) * 64 / (time.perf_counter() - start))
+
+        print('{:>5}  {:>10.0f}/s {:>10.0f}/s  {:>10.0f}/s  {:>10.0f}/s'.format(size, *rates))
+
+
+def bench_apdu(args):
+    """Reading a file from an ISO-DEP card: short READ BINARYs against one chained extended-length APDU."""
+    aid = bytes.fromhex('D2760000850101')
+    data = bytes(random.getrandbits(8) for _ in range(args.size))
+    card = VirtualIsoDepCard(applications={aid: data})
+    sim = SimulatedPN532(cards=[card], command_latency={
+        PN532.PN532_COMMAND_INDATAEXCHANGE: args.exchange_latency,
+    })
+    pn532 = PN532.PN532(transport=sim)
+    pn532.read_passive_target()
+    assert pn532.transceive_apdu(PN532.encode_apdu(0x00, PN532.ISO7816_INS_SELECT, 0x04, 0x00, aid)).sw == 0x9000
+
+    def short_reads():
+        apdus = (PN532.encode_apdu(0x00, PN532.ISO7816_INS_READ_BINARY, offset >> 8, offset & 0xFF, le=256)
+                 for offset in range(0, args.size, 256))
+        out = bytearray()
+        for response in pn532.run_apdu_script(apdus):
+            out += response.data
+        return out, len(range(0, args.size, 256))
+
+    def extended_read():
+        apdu = PN532.encode_apdu(0x00, PN532.ISO7816_INS_READ_BINARY, 0x00, 0x00, le=args.size)
+        return pn532.transceive_apdu(apdu).data, 1
+
+    for name, func in (('short', short_reads), ('extended', extended_read)):
+        before = sim.commands_handled
+        start = time.perf_counter()
+        out, apdus = func()
+        elapsed = time.perf_counter() - start
+        assert out == data, name
+        print('{:<10} {:3} APDUs  {:3} exchanges  {:7.1f} ms'.format(
+            name, apdus, sim.commands_handled - before, elapsed * 1000))
+
+    # Reassembling a 64K answer: bytes concatenation copies everything
+    # received so far for every part, a bytearray grows in place.
+    parts = [memoryview(bytes(PN532.PN532_MAX_EXCHANGE_DATA))] * (65536 // PN532.PN532_MAX_EXCHANGE_DATA)
+    for name, out in (('bytes', b''), ('bytearray', bytearray())):
+        start = time.perf_counter()
+        for _ in range(args.count):
+            buf = out[:0]
+            for part in parts:
+                buf += part
+        print('reassemble 64K into {:<10} {:8.1f} us'.format(name, (time.perf_counter() - start) / args.count * 1e6))
+
+
+def bench_session(args):
+    """Reader traffic for a card resting on the reader: polling and dumping it every time against a CardSession."""
+    key = [0xFF] * 6
+    card = VirtualMifareClassic()
+    sim = SimulatedPN532(cards=[card], command_latency={
+        PN532.PN532_COMMAND_INDATAEXCHANGE: args.exchange_latency,
+    })
+    pn532 = PN532.PN532(transport=sim)
+
+    def uncached():
+        uid = pn532.read_passive_target()
+        return pn532.mifare_classic_dump_card(uid, PN532.MIFARE_CMD_AUTH_B, key)
+
+    session = CardSession(pn532)
+
+    def cached():
+        session.poll()
+        return session.dump_card(PN532.MIFARE_CMD_AUTH_B, key)
+
+    for name, func in (('uncached', uncached), ('session', cached)):
+        before = sim.commands_handled
+        start = time.perf_counter()
+        for _ in range(args.polls):
+            _, failed = func()
+            assert not failed, name
+        elapsed = time.perf_counter() - start
+        print('{:<10} {:6.1f} exchanges  {:7.2f} ms per poll'.format(
+            name, (sim.commands_handled - before) / args.polls, elapsed / args.polls * 1000))
+    print('session: {}'.format(session.stats()))
+
+
+def bench_value(args):
+    """Stored-value debit: read-modify-write against value block transactions."""
+    key = [0xFF] * 6
+    card = VirtualMifareClassic()
+    sim = SimulatedPN532(cards=[card], command_latency={
+        PN532.PN532_COMMAND_INDATAEXCHANGE: args.exchange_latency,
+    })
+    pn532 = PN532.PN532(transport=sim)
+    uid = pn532.read_passive_target()
+    pn532.mifare_classic_authenticate_block(uid, 4, PN532.MIFARE_CMD_AUTH_B, key)
+    pn532.mifare_classic_write_value(4, args.count * 10)
+
+    def read_modify_write():
+        pn532.mifare_classic_authenticate_block(uid, 4, PN532.MIFARE_CMD_AUTH_B, key)
+        value = PN532.mifare_classic_parse_value_block(pn532.mifare_classic_read_block(4))[0]
+        pn532.mifare_classic_write_block(4, PN532.mifare_classic_value_block(value - 1, 4))
+        return PN532.mifare_classic_parse_value_block(pn532.mifare_classic_read_block(4))[0] == value - 1
+
+    def transaction(verify):
+        ok, _ = pn532.mifare_classic_value_transaction(uid, 4, PN532.MIFARE_CMD_DECREMENT, 1, PN532.MIFARE_CMD_AUTH_B,
+                                                       key, verify=verify)
+        return ok
+
+    for name, func in (('read-modify-write', read_modify_write),
+                       ('transaction', lambda: transaction(True)),
+                       ('transaction, no verify', lambda: transaction(False))):
+        before = sim.commands_handled
+        start = time.perf_counter()
+        for _ in range(args.count):
+            assert func(), name
+        elapsed = time.perf_counter() - start
+        print('{:<24} {:4.1f} exchanges  {:6.2f} ms per debit'.format(
+            name, (sim.commands_handled - before) / args.count, elapsed / args.count * 1000))
+
+    # A debit cut short before the transfer leaves the balance untouched.
+    balance = pn532.mifare_classic_read_value(4)
+    pn532.mifare_classic_authenticate_block(uid, 4, PN532.MIFARE_CMD_AUTH_B, key)
+    pn532.mifare_classic_decrement(4, 100)
+    sim.remove_card(card)
+    sim.add_card(card)
+    pn532.read_passive_target()
+    pn532.mifare_classic_authenticate_block(uid, 4, PN532.MIFARE_CMD_AUTH_B, key)
+    assert pn532.mifare_classic_read_value(4) == balance
+    print('interrupted debit: balance unchanged ({})'.format(balance))
+
+
+def bench_ultralight(args):
+    """Whole NTAG216 read, 4-page READs against FAST_READ, and page writes with and without a cached image."""
+    tag = VirtualUltralight(model='NTAG216')
+    sim = SimulatedPN532(cards=[tag], command_latency={
+        PN532.PN532_COMMAND_INDATAEXCHANGE: args.exchange_latency,
+        PN532.PN532_COMMAND_INCOMMUNICATETHRU: args.exchange_latency,
+    })
+    pn532 = PN532.PN532(transport=sim)
+    uid = pn532.read_passive_target()
+    tag_type, _ = pn532.ultralight_identify(uid)
+
+    for name in ('read', 'fast_read'):
+        before = sim.commands_handled
+        start = time.perf_counter()
+        if name == 'read':
+            image = bytearray()
+            for page in range(0, tag_type.pages, 4):
+                image += pn532.ultralight_read_pages(page)
+            del image[tag_type.pages * 4:]
+        else:
+            image, _ = pn532.ultralight_read_tag(uid, tag_type)
+        elapsed = time.perf_counter() - start
+        assert image == tag.memory, 'Tag image does not match'
+        print('{:<12} {:>4} exchanges  {:8.1f} ms'.format(name, sim.commands_handled - before, elapsed * 1000))
+
+    # Rewrite the NDEF area with a URL that differs in its last few bytes.
+    message = ndef.encode_tlv(ndef.encode_message([ndef.uri_record('https://example.com/kiosk/0001')]))
+    pn532.ultralight_write(4, message + bytes(-len(message) % 4), image, tag_type)
+    message = ndef.encode_tlv(ndef.encode_message([ndef.uri_record('https://example.com/kiosk/0002')]))
+    data = message + bytes(-len(message) % 4)
+    for name, cached in (('write', None), ('write cached', image)):
+        before = sim.commands_handled
+        start = time.perf_counter()
+        failed = pn532.ultralight_write(4, data, cached, tag_type)
+        elapsed = time.perf_counter() - start
+        assert not failed and tag.memory[16:16 + len(data)] == data, 'Write failed'
+        print('{:<12} {:>4} exchanges  {:8.1f} ms'.format(name, sim.commands_handled - before, elapsed * 1000))
+
+    # Two tags in the field: FAST_READ goes to the current target, so reading
+    # target 2 must not read the tag listed first.
+    other = VirtualUltralight(uid=b'\x04\x99\x88\x77\x66\x55\x44', model='NTAG213',
+                              data=bytes(range(180)))
+    sim = SimulatedPN532(cards=[VirtualUltralight(model='NTAG213'), other])
+    pn532 = PN532.PN532(transport=sim)
+    targets = pn532.read_passive_targets()
+    for tag_type in (None, PN532.ULTRALIGHT_TYPES[(0x04, 0x0F)]):
+        image, _ = pn532.ultralight_read_tag(other.uid, tag_type, targets[1].tg)
+        assert image == other.memory, 'Read the wrong tag'
+    print('2 tags: target 2 read with FAST_READ')
+
+
+def bench_ndef(args):
+    """NDEF decoding time per tag: Type 2 URL tag, MiFare Classic MAD layout and a large tag scanned lazily."""
+    url = ndef.encode_tlv(ndef.encode_message([ndef.uri_record('https://example.com/kiosk/0001')]))
+
+    type2 = bytearray(16 + 888)
+    type2[12:16] = b'\xE1\x10\x6D\x00'
+    type2[16:16 + len(url)] = url
+
+    classic = bytearray(1024)
+    mad = bytearray(b'\x00\x01' + b'\x03\xE1' * 15)
+    mad[0] = ndef.mad_crc(mad[1:])
+    classic[16:48] = mad
+    classic[64:64 + len(url)] = url
+
+    # A URI record behind 20 MIME records on a 2 KB tag: only their headers
+    # are parsed, no payload is copied.
+    records = [ndef.mime_record('application/octet-stream', bytes(64))] * 20
+    big = ndef.encode_tlv(ndef.encode_message(records + [ndef.uri_record('https://example.com/last')]))
+    large = bytearray(16 + len(big))
+    large[12:16] = bytes((0xE1, 0x10, len(big) // 8 + 1, 0x00))
+    large[16:] = big
+
+    def first_uri(message):
+        for record in ndef.iter_records(message):
+            if record.is_uri():
+                return record.uri()
+        return None
+
+    cases = (
+        ('type2', lambda: first_uri(ndef.type2_message(type2))),
+        ('classic', lambda: first_uri(ndef.classic_message(classic))),
+        ('large', lambda: first_uri(ndef.type2_message(large))),
+    )
+    for name, func in cases:
+        assert func().startswith('https://example.com/'), name
+        start = time.perf_counter()
+        for _ in range(args.count):
+            func()
+        elapsed = time.perf_counter() - start
+        print('{:<8} {:7.2f} us/tag'.format(name, elapsed / args.count * 1e6))
+
+
+def bench_dump(args):
+    """Full MiFare Classic card read, per-block auth against per-sector auth."""
+    key = [0xFF] * 6
+    for card_size in (1024, 4096):
+        for name in ('per-block', 'dump_card'):
+            sim = SimulatedPN532(cards=[VirtualMifareClassic(size=card_size)], command_latency={
+                PN532.PN532_COMMAND_INDATAEXCHANGE: args.exchange_latency,
+            })
+            pn532 = PN532.PN532(transport=sim)
+            uid = pn532.read_passive_target()
+            before = sim.commands_handled
+            start = time.perf_counter()
+            if name == 'per-block':
+                for block in range(card_size // 16):
+                    pn532.mifare_classic_authenticate_block(uid, block, PN532.MIFARE_CMD_AUTH_B, key)
+                    pn532.mifare_classic_read_block(block)
+            else:
+                image, failed = pn532.mifare_classic_dump_card(uid, PN532.MIFARE_CMD_AUTH_B, key, card_size)
+                expected = bytearray(sim.cards[0].memory)
+                for sector in range(PN532.mifare_classic_sector_count(card_size)):
+                    trailer = PN532.mifare_classic_sector_blocks(sector)[-1]
+                    expected[trailer * 16:trailer * 16 + 6] = bytes(6)
+                assert not failed and image == expected, 'Card image does not match'
+            elapsed = time.perf_counter() - start
+            print('{}K {:<10} {:>4} exchanges  {:8.1f} ms'.format(
+                card_size // 1024, name, sim.commands_handled - before, elapsed * 1000))
+
+    # Two cards: a failed authentication on target 1 re-selects it, and
+    # target 2 must still be listed afterwards.
+    first, second = VirtualMifareClassic(uid=b'\x01\x02\x03\x04'), VirtualMifareClassic(uid=b'\x05\x06\x07\x08')
+    trailer = PN532.mifare_classic_sector_blocks(3)[-1]
+    first.memory[trailer * 16 + 10:trailer * 16 + 16] = b'\x01' * 6  # sector 3 has another key B
+    sim = SimulatedPN532(cards=[first, second])
+    pn532 = PN532.PN532(transport=sim)
+    targets = pn532.read_passive_targets(2)
+    assert [t.uid for t in targets] == [first.uid, second.uid], 'Both cards must be listed'
+    image, failed = pn532.mifare_classic_dump_card(first.uid, PN532.MIFARE_CMD_AUTH_B, key, target=1)
+    assert failed == [3], 'Only sector 3 of target 1 should fail'
+    blocks = {block: bytes([block]) * 16 for block in (4, 5, 8)}
+    failed = pn532.mifare_classic_write_blocks(second.uid, blocks, PN532.MIFARE_CMD_AUTH_B, key, verify=True,
+                                               target=2)
+    assert not failed and all(second.memory[b * 16:b * 16 + 16] == d for b, d in blocks.items()), \
+        'Target 2 must still be writable after target 1 was re-selected'
+    print('2 cards: target 2 written after a failed authentication on target 1')
+
+
+def bench_autopoll(args):
+    """Host CPU time and tap-to-event latency, read_passive_target loop against auto_poll."""
+    rng = random.Random(args.seed)
+    gaps = [rng.uniform(0.05, 0.25) for _ in range(args.taps)]
+
+    for name in ('loop', 'auto_poll'):
+        sim = SimulatedPN532()
+        # A reader loop needs InListPassiveTarget to give up quickly when no
+        # card is present, or it could not do anything else.
+        sim.passive_activation_retries = args.retries
+        pn532 = PN532.PN532(transport=sim)
+        card = VirtualMifareClassic()
+
+        lock = threading.Lock()
+        tapped_at = [None]
+        detected = threading.Event()
+        latencies = []
+
+        def tap():
+            for gap in gaps:
+                time.sleep(gap)
+                detected.clear()
+                with lock:
+                    tapped_at[0] = time.monotonic()
+                sim.add_card(card)
+                detected.wait()
+                sim.remove_card(card)
+
+        def on_card():
+            with lock:
+                if tapped_at[0] is not None:
+                    latencies.append(time.monotonic() - tapped_at[0])
+                    tapped_at[0] = None
+                    detected.set()
+            return len(latencies) >= len(gaps)
+
+        tapper = threading.Thread(target=tap)
+        cpu_start, wall_start = time.thread_time(), time.monotonic()
+        tapper.start()
+        if name == 'loop':
+            while True:
+                uid = pn532.read_passive_target()
+                if uid not in (None, 'no_card') and on_card():
+                    break
+        else:
+            for _ in pn532.auto_poll():
+                if on_card():
+                    break
+        tapper.join()
+        cpu, wall = time.thread_time() - cpu_start, time.monotonic() - wall_start
+
+        print('{:<10} cpu={:6.1f} ms/s  commands={:<5}  tap-to-event mean={:6.2f} ms  max={:6.2f} ms'.format(
+            name, cpu / wall * 1000, sim.commands_handled, statistics.mean(latencies) * 1000, max(latencies) * 1000))
+
+
+def bench_metrics(args):
+    """Instrumentation overhead per command, and where a card dump over a noisy link spends its time."""
+    sim = SimulatedPN532(latency=0.0, ack_latency=0.0, baudrate=PN532.PN532_SERIAL_BAUDRATES[-1])
+    pn532 = PN532.PN532(transport=sim)
+    for name, instrumentation in (('off', None), ('on', CommandMetrics())):
+        pn532.instrumentation = instrumentation
+        start = time.perf_counter()
+        for _ in range(args.count):
+            pn532.get_firmware_version()
+        elapsed = time.perf_counter() - start
+        print('instrumentation {:<4} {:7.1f} us per GetFirmwareVersion'.format(name, elapsed / args.count * 1e6))
+
+    key = [0xFF] * 6
+    metrics = CommandMetrics()
+    sim = SimulatedPN532(cards=[VirtualMifareClassic()], command_latency={
+        PN532.PN532_COMMAND_INDATAEXCHANGE: 0.003,
+    })
+    pn532 = PN532.PN532(transport=sim, instrumentation=metrics)
+    for _ in range(args.dumps):
+        sim.drop_commands = 1
+        sim.corrupt_responses = 1
+        uid = pn532.read_passive_target()
+        pn532.mifare_classic_dump_card(uid, PN532.MIFARE_CMD_AUTH_B, key)
+
+    print('{:<20} {:>6} {:>7} {:>9} {:>9} {:>9} {:>9}'.format(
+        'command', 'calls', 'retries', 'checksum', 'total ms', 'sleep ms', 'read ms'))
+    for name, stats in metrics.snapshot().items():
+        print('{:<20} {:>6} {:>7} {:>9} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            name, stats['calls'], stats['retries'], stats['checksum_errors'], stats['total_seconds'] * 1000,
+            stats['sleep_seconds'] * 1000, stats['read_seconds'] * 1000))
+    if args.prometheus:
+        print(metrics.prometheus_text())
+
+
+def bench_replay(args):
+    """Record a simulated session to a capture, then replay it through the driver and the frame parser."""
+    key = [0xFF] * 6
+
+    def session(pn532):
+        pn532.SAM_configuration()
+        for _ in range(args.dumps):
+            uid = pn532.read_passive_target()
+            image, failed = pn532.mifare_classic_dump_card(uid, PN532.MIFARE_CMD_AUTH_B, key)
+            assert not failed, 'Dump failed'
+        return image
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'session.cap')
+        sim = SimulatedPN532(cards=[VirtualMifareClassic()], command_latency={
+            PN532.PN532_COMMAND_INDATAEXCHANGE: args.exchange_latency,
+        })
+        sim.corrupt_responses = 1
+        pn532 = PN532.PN532(transport=RecordingTransport(sim, path))
+        start = time.perf_counter()
+        recorded = session(pn532)
+        print('{:<16} {:8.1f} ms'.format('live', (time.perf_counter() - start) * 1000))
+        pn532.close()
+        print('capture          {:8} bytes'.format(os.path.getsize(path)))
+
+        for speed in args.speeds:
+            pn532 = PN532.PN532(transport=ReplayTransport(path, speed=speed or None))
+            start = time.perf_counter()
+            replayed = session(pn532)
+            elapsed = time.perf_counter() - start
+            assert replayed == recorded and pn532.transport.done, 'Replay diverged'
+            pn532.close()
+            print('{:<16} {:8.1f} ms'.format('replay x{}'.format(speed) if speed else 'replay, no wait',
+                                             elapsed * 1000))
+
+        # The frame parser alone, over everything the PN532 sent.
+        with CaptureReader(path) as reader:
+            rx = [record.data for record in reader if record.kind == RECORD_RX]
+        size = sum(len(data) for data in rx)
+        parser = PN532.FrameParser()
+        start = time.perf_counter()
+        frames = 0
+        for _ in range(args.rounds):
+            for data in rx:
+                parser.feed(data)
+                for _ in parser:
+                    frames += 1
+        elapsed = time.perf_counter() - start
+        print('parser           {:8.1f} MB/s  {:8.0f} frames/s'.format(
+            size * args.rounds / elapsed / 1e6, frames / elapsed))
+
+
+def bench_allowlist(args):
+    """Allow/deny lookups against a million-UID allowlist file, with deltas and a hot reload under load."""
+    rng = random.Random(args.seed)
+    uids = [rng.getrandbits(8 * n).to_bytes(n, 'big') for n in (4, 7, 10) * (args.size // 3)]
+    enrolled = set(uids)
+    absent = [uid for uid in (rng.getrandbits(8 * n).to_bytes(n, 'big') for n in (4, 7, 10) * 10000)
+              if uid not in enrolled]
+    now = time.time()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'site.acl')
+        start = time.perf_counter()
+        write_allowlist(path, ((uid, None, now + 86400) for uid in uids))
+        print('build            {:8.2f} s   {:6.1f} MB'.format(time.perf_counter() - start,
+                                                                  os.path.getsize(path) / 1e6))
+        start = time.perf_counter()
+        allowlist = Allowlist(path)
+        print('open             {:8.1f} us'.format((time.perf_counter() - start) * 1e6))
+        start = time.perf_counter()
+        set(uids)
+        print('set() of UIDs    {:8.2f} s   (for comparison)'.format(time.perf_counter() - start))
+
+        sample = rng.sample(uids, min(30000, len(uids)))
+        delta = min(args.delta, len(sample) // 2)
+
+        def lookups(name, keys, expected):
+            allowed = allowlist.allowed
+            start = time.perf_counter()
+            for uid in keys:
+                if allowed(uid, now) != expected:
+                    raise AssertionError(name)
+            print('{:<16} {:8.0f} ns/lookup'.format(name, (time.perf_counter() - start) / len(keys) * 1e9))
+
+        lookups('hit', sample, True)
+        lookups('miss', absent, False)
+        allowlist.apply_delta(added=absent[:delta], removed=sample[:delta])
+        lookups('hit, delta', sample[delta:], True)
+        lookups('miss, delta', absent[delta:], False)
+
+        # Hot reloads of a replaced file while another thread keeps looking up.
+        write_allowlist(path, ((uid, None, now + 86400) for uid in uids[:args.size // 2]))
+        start = time.perf_counter()
+        assert allowlist.maybe_reload()
+        print('reload           {:8.1f} us   {} UIDs now'.format((time.perf_counter() - start) * 1e6, len(allowlist)))
+
+        done = threading.Event()
+        looked_up = 0
+
+        def lookup_loop():
+            nonlocal looked_up
+            allowed = allowlist.allowed
+            keys = sample[-1000:]
+            while not done.is_set():
+                for uid in keys:
+                    allowed(uid, now)
+                looked_up += len(keys)
+
+        thread = threading.Thread(target=lookup_loop)
+        thread.start()
+        for _ in range(args.reloads):
+            allowlist.reload()
+            time.sleep(0.001)
+        done.set()
+        thread.join()
+        print('{} lookups during {} reloads, none blocked or failed'.format(looked_up, args.reloads))
+
+
+def bench_target(args):
+    """Emulating a Type 4 NDEF tag to simulated phones: exchanges per second and host turnaround."""
+    message = ndef.encode_message([ndef.uri_record('https://example.com/' + 'x' * (args.size - 24))])
+    for name, cache_size in (('prebuilt', 256), ('per-exchange', 0)):
+        sim = SimulatedPN532(baudrate=args.baudrate, command_latency={
+            PN532.PN532_COMMAND_TGGETDATA: args.exchange_latency,
+            PN532.PN532_COMMAND_TGSETDATA: args.exchange_latency,
+        })
+        pn532 = PN532.PN532(transport=sim)
+        server = TargetServer(pn532, Type4Tag(message), frame_cache_size=cache_size)
+        turnarounds = []
+        start = time.perf_counter()
+        for _ in range(args.readers):
+            result = []
+            sim.set_initiator(VirtualInitiator(type4_reader(result)))
+            before = server.turnaround
+            exchanges = server.serve(timeout=1.0)
+            assert result == [message], 'Reader got the wrong message'
+            turnarounds.append((server.turnaround - before) / exchanges)
+        elapsed = time.perf_counter() - start
+        print('{:<13} {:6.0f} exchanges/s  turnaround mean {:6.1f} us  max {:6.1f} us'.format(
+            name, server.exchanges / elapsed, statistics.mean(turnarounds) * 1e6, server.max_turnaround * 1e6))
+
+    # Served according to the activation mode byte: with any mode allowed, a
+    # DEP initiator is served from TgGetData on; an emulated ISO14443-4 card
+    # turns one away (here the chip lost its SetParameters, so it answers the
+    # reader with DEP).
+    sim = SimulatedPN532()
+    pn532 = PN532.PN532(transport=sim)
+    result = []
+    sim.set_initiator(VirtualInitiator(type4_reader(result)))
+    assert TargetServer(pn532, Type4Tag(message), mode=0).serve(timeout=1.0) and result == [message]
+    server = TargetServer(pn532, Type4Tag(message))
+    sim.set_initiator(VirtualInitiator(type4_reader(result)))
+    assert server.serve(timeout=1.0) and len(result) == 2
+    sim.parameters = 0
+    sim.set_initiator(VirtualInitiator(type4_reader(result)))
+    assert server.serve(timeout=1.0) == 0 and (server.sessions, server.rejected) == (1, 1)
+    print('DEP initiator: served by a P2P target, turned away by an emulated card')
+
+
+def bench_power(args):
+    """PowerDown wake-to-first-command latency, and polls per second, tap-to-detect latency and time awake per profile."""
+    sim = SimulatedPN532()
+    pn532 = PN532.PN532(transport=sim)
+
+    def awake():
+        pass
+
+    def legacy_wakeup():
+        pn532.power_down()
+        pn532._wake_preamble = None
+        pn532.wakeup()
+
+    def minimal_preamble():
+        pn532.power_down()
+
+    for name, prepare in (('awake', awake), ('wakeup()', legacy_wakeup), ('minimal preamble', minimal_preamble)):
+        samples = []
+        for _ in range(args.wakes):
+            prepare()
+            start = time.perf_counter()
+            pn532.get_firmware_version()
+            samples.append(time.perf_counter() - start)
+        print('wake, {:<16} first command mean {:7.2f} ms  max {:7.2f} ms'.format(
+            name, statistics.mean(samples) * 1000, max(samples) * 1000))
+
+    rng = random.Random(args.seed)
+    gaps = [rng.uniform(0.2, 1.0) for _ in range(args.taps)]
+    for name in args.profiles:
+        sim = SimulatedPN532()
+        pn532 = PN532.PN532(transport=sim)
+        manager = PowerManager(pn532, PROFILES[name])
+        card = VirtualMifareClassic()
+        tapped_at = []
+        latencies = []
+
+        def tap():
+            for gap in gaps:
+                time.sleep(gap)
+                tapped_at.append(time.monotonic())
+                sim.add_card(card)
+                while len(latencies) < len(tapped_at):
+                    time.sleep(0.001)
+                sim.remove_card(card)
+
+        tapper = threading.Thread(target=tap)
+        start = time.monotonic()
+        tapper.start()
+        while len(latencies) < len(gaps):
+            if manager.poll() is not None and len(tapped_at) > len(latencies):
+                latencies.append(time.monotonic() - tapped_at[len(latencies)])
+        tapper.join()
+        wall = time.monotonic() - start
+        print('{:<10} {:6.1f} polls/s  tap-to-detect mean {:6.1f} ms  max {:6.1f} ms  awake {:5.1f}%'.format(
+            name, manager.polls / wall, statistics.mean(latencies) * 1000, max(latencies) * 1000,
+            (1 - sim.time_asleep / wall) * 100))
+
+
+def bench_registers(args):
+    """Per-tap LED and buzzer feedback with CIU tuning: a register per exchange, batched, and batched with a shadow."""
+    pins = (PN532.PN532_GPIO_P32, PN532.PN532_GPIO_P34)  # LED, buzzer
+    tuning = {
+        PN532.PN532_REG_CIU_RFCFG: 0x59,
+        PN532.PN532_REG_CIU_GSNON: 0xF4,
+        PN532.PN532_REG_CIU_CWGSP: 0x3F,
+        PN532.PN532_REG_CIU_MODGSP: 0x11,
+    }
+    feedback_on = dict(tuning)
+    feedback_on[PN532.PN532_SFR_P3] = gpio_pins(high=pins)
+    feedback_off = {PN532.PN532_SFR_P3: gpio_pins(low=pins)}
+
+    def one_by_one(pn532, shadow):
+        for address, value in tuning.items():
+            pn532.write_registers([(address, value)])
+        for set_bit in (True, False):
+            for pin in pins:
+                p3 = pn532.read_registers([PN532.PN532_SFR_P3])[0]
+                p3 = p3 | 1 << pin if set_bit else p3 & ~(1 << pin)
+                pn532.write_registers([(PN532.PN532_SFR_P3, p3)])
+
+    def batched(pn532, shadow):
+        RegisterShadow(pn532).apply(feedback_on)
+        RegisterShadow(pn532).apply(feedback_off)
+
+    def shadowed(pn532, shadow):
+        shadow.apply(feedback_on)
+        shadow.apply(feedback_off)
+
+    for name, feedback in (('one by one', one_by_one), ('batched', batched), ('shadowed', shadowed)):
+        sim = SimulatedPN532()
+        pn532 = PN532.PN532(transport=sim)
+        shadow = RegisterShadow(pn532)
+        start = time.perf_counter()
+        for _ in range(args.taps):
+            feedback(pn532, shadow)
+        elapsed = time.perf_counter() - start
+        assert sim.registers[PN532.PN532_REG_CIU_RFCFG] == 0x59 and sim.registers[PN532.PN532_SFR_P3] & 0x14 == 0
+        print('{:<11} {:5.1f} exchanges/tap  {:6.1f} ms/tap'.format(
+            name, sim.commands_handled / args.taps, elapsed / args.taps * 1000))
+
+    # reads and writes count frames; a register whose write raised is
+    # forgotten, so the next apply() reads it again.
+    sim = SimulatedPN532()
+    shadow = RegisterShadow(PN532.PN532(transport=sim))
+    profile = {0x6300 + i: (0x01, 0x01) for i in range(PN532.PN532_MAX_READ_REGISTERS + 1)}
+    profile[PN532.PN532_SFR_P3] = 0xFF
+    assert shadow.apply(profile) and (shadow.reads, shadow.writes) == (2, 2), (shadow.reads, shadow.writes)
+    sim.unresponsive = True
+    try:
+        shadow.apply({PN532.PN532_SFR_P3: 0x00}, timeout=0.1)
+        raise AssertionError('The write to an unresponsive PN532 succeeded')
+    except PN532.PN532TimeoutError:
+        pass
+    assert PN532.PN532_SFR_P3 not in shadow and 0x6300 in shadow
+    print('{} registers: {} read and {} write frames; failed write forgotten'.format(
+        len(profile), shadow.reads, shadow.writes))
+
+
+def bench_baudrate(args):
+    """InDataExchange throughput (MiFare block reads) at every HSU baud rate, and negotiation."""
+    key = [0xFF] * 6
+    for baudrate in PN532.PN532_SERIAL_BAUDRATES:
+        sim = SimulatedPN532(cards=[VirtualMifareClassic()], command_latency={
+            PN532.PN532_COMMAND_INDATAEXCHANGE: args.exchange_latency,
+        })
+        pn532 = PN532.PN532(transport=sim)
+        assert pn532.set_baudrate(baudrate), 'Could not switch to {} baud'.format(baudrate)
+        uid = pn532.read_passive_target()
+        pn532.mifare_classic_authenticate_block(uid, 4, PN532.MIFARE_CMD_AUTH_B, key)
+        start = time.perf_counter()
+        for _ in range(args.count):
+            pn532.mifare_classic_read_block(4)
+        elapsed = time.perf_counter() - start
+        print('{:>8} baud  {:8.0f} bytes/s  {:6.2f} ms/block'.format(
+            baudrate, args.count * 16 / elapsed, elapsed / args.count * 1000))
+
+    for host_max in (None, 460800):
+        sim = SimulatedPN532(host_max_baudrate=host_max)
+        pn532 = PN532.PN532(transport=sim)
+        start = time.perf_counter()
+        baudrate = pn532.negotiate_baudrate()
+        print('negotiate (host max {}): {} baud in {:.1f} ms'.format(
+            host_max or 'any', baudrate, (time.perf_counter() - start) * 1000))
+
+
+def bench_retry(args):
+    """GetFirmwareVersion latency over a lossy link: dropped commands, corrupted responses and a dead reader."""
+    rng = random.Random(args.seed)
+    sim = SimulatedPN532()
+    pn532 = PN532.PN532(transport=sim)
+    outcomes = {}
+    samples = []
+    for _ in range(args.count):
+        roll = rng.random()
+        sim.drop_commands = int(roll < args.loss)
+        sim.corrupt_responses = int(args.loss <= roll < 2 * args.loss)
+        sim.unresponsive = roll >= 1 - args.dead
+        start = time.perf_counter()
+        try:
+            pn532.get_firmware_version()
+            outcome = 'ok'
+        except PN532.PN532Error as e:
+            outcome = type(e).__name__
+        samples.append(time.perf_counter() - start)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    report('lossy', samples)
+    print('max={:.2f} ms  {}'.format(max(samples) * 1000, '  '.join(
+        '{}={}'.format(k, v) for k, v in sorted(outcomes.items()))))
+
+
+def bench_async(args):
+    """AsyncPN532 over a pseudo-terminal: GetFirmwareVersion latency, and recovery from corrupted responses."""
+    sim = SimulatedPN532(cards=[VirtualMifareClassic()])
+    bridge = PtyBridge(sim)
+
+    async def run():
+        async with AsyncPN532(bridge.port) as pn532:
+            samples = []
+            for _ in range(args.count):
+                start = time.perf_counter()
+                await pn532.get_firmware_version()
+                samples.append(time.perf_counter() - start)
+            report('async', samples)
+
+            # A response with a bad DCS is NACKed and sent again, not run again.
+            handled = sim.commands_handled
+            sim.corrupt_responses = 1
+            assert await pn532.get_firmware_version() == tuple(sim.firmware)
+            assert sim.commands_handled == handled + 1, 'The command was run again'
+            sim.corrupt_responses = pn532.retry.max_attempts
+            try:
+                await pn532.get_firmware_version()
+                raise AssertionError('A response that stays corrupted was accepted')
+            except PN532.PN532ChecksumError:
+                pass
+            sim.corrupt_responses = 0
+            assert await pn532.read_passive_target() == sim.cards[0].uid
+            # No card: the same "no_card" as PN532.read_passive_target.
+            sim.remove_card(sim.cards[0])
+            assert await pn532.read_passive_target() == "no_card"
+            print('bad DCS: NACKed and recovered; corrupted {} times: PN532ChecksumError'.format(
+                pn532.retry.max_attempts))
+
+    try:
+        asyncio.run(run())
+    finally:
+        bridge.close()
+
+
+def bench_pool(args):
+    """Cards and exchanges per second against number of simulated readers, each dumping a 1K card per tap."""
+    key = [0xFF] * 6
+
+    def on_card(pn532, uid):
+        image, failed = pn532.mifare_classic_dump_card(uid, PN532.MIFARE_CMD_AUTH_B, key)
+        assert not failed, 'Dump failed'
+        return len(image)
+
+    def reader(i, sims):
+        def open_reader():
+            sim = SimulatedPN532(cards=[VirtualMifareClassic(uid=i.to_bytes(4, 'big'))], command_latency={
+                PN532.PN532_COMMAND_INDATAEXCHANGE: args.exchange_latency,
+            })
+            sims[i] = sim
+            return PN532.PN532(transport=sim)
+        return open_reader
+
+    single = None
+    for count in args.readers:
+        sims = {}
+        pool = ReaderPool({i: reader(i, sims) for i in range(count)}, on_card=on_card, repeat=True)
+        with pool:
+            time.sleep(args.seconds)
+        rate = sum(s.cards_per_second for s in pool.stats().values())
+        # Scaling counts the exchanges completed, so that cards cut short by
+        # the end of the run still count.
+        exchange_rate = sum(sim.commands_handled for sim in sims.values()) / args.seconds
+        single = single or exchange_rate / count
+        print('{:>3} readers  {:7.1f} cards/s  {:8.1f} exchanges/s  scaling={:5.2f}x of linear'.format(
+            count, rate, exchange_rate, exchange_rate / (single * count) if single else 0.0))
+
+    # Nobody reads the events: once the queue is full they are dropped, and
+    # the readers are not taken for wedged.
+    sims = {}
+    pool = ReaderPool({0: reader(0, sims)}, repeat=True, wedge_timeout=0.5, max_events=1)
+    with pool:
+        time.sleep(1.5)
+    stats = pool.stats()[0]
+    assert stats.restarts == 0 and stats.dropped_events > 0, stats
+    print('full event queue: {} events dropped, no restarts'.format(stats.dropped_events))
+
+    # Wedge one reader: the others keep going while it is restarted.
+    sims = {}
+    count = max(args.readers)
+    pool = ReaderPool({i: reader(i, sims) for i in range(count)}, on_card=on_card, repeat=True,
+                      wedge_timeout=1.0)
+    with pool:
+        time.sleep(0.5)
+        sims[0].unresponsive = True
+        time.sleep(args.seconds + 1.0)
+    stats = pool.stats()
+    print('wedged reader 0: restarts={} cards={}; others: {:.1f} cards/s'.format(
+        stats[0].restarts, stats[0].cards, sum(s.cards_per_second for i, s in stats.items() if i != 0)))
+
+
+def main():
+    p = argparse.ArgumentParser()
+    sub = p.add_subparsers(dest='benchmark')
+    sub.required = True
+
+    s = sub.add_parser('latency', help=bench_latency.__doc__)
+    s.add_argument('-n', '--count', type=int, default=200)
+    s.add_argument('--legacy-count', type=int, default=10)
+    s.set_defaults(func=bench_latency)
+
+    s = sub.add_parser('parser', help=bench_parser.__doc__)
+    s.add_argument('--megabytes', type=int, default=8)
+    s.add_argument('--chunk', type=int, default=4096)
+    s.add_argument('--fuzz-rounds', type=int, default=20)
+    s.add_argument('--seed', type=int, default=0)
+    s.set_defaults(func=bench_parser)
+
+    s = sub.add_parser('builder', help=bench_builder.__doc__)
+    s.add_argument('-n', '--count', type=int, default=100000)
+    s.set_defaults(func=bench_builder)
+
+    s = sub.add_parser('micro', help=bench_micro.__doc__)
+    s.add_argument('-n', '--count', type=int, default=50000)
+    s.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 16, 64, 128, 254, 255, 264])
+    s.set_defaults(func=bench_micro)
+
+    s = sub.add_parser('apdu', help=bench_apdu.__doc__)
+    s.add_argument('--size', type=int, default=4096, help='file size in bytes')
+    s.add_argument('-n', '--count', type=int, default=20, help='reassembly rounds')
+    s.add_argument('--exchange-latency', type=float, default=0.003,
+                   help='simulated RF time per InDataExchange, in seconds')
+    s.set_defaults(func=bench_apdu)
+
+    s = sub.add_parser('session', help=bench_session.__doc__)
+    s.add_argument('-n', '--polls', type=int, default=20)
+    s.add_argument('--exchange-latency', type=float, default=0.003,
+                   help='simulated RF time per InDataExchange, in seconds')
+    s.set_defaults(func=bench_session)
+
+    s = sub.add_parser('value', help=bench_value.__doc__)
+    s.add_argument('-n', '--count', type=int, default=50)
+    s.add_argument('--exchange-latency', type=float, default=0.003,
+                   help='simulated RF time per InDataExchange, in seconds')
+    s.set_defaults(func=bench_value)
+
+    s = sub.add_parser('ultralight', help=bench_ultralight.__doc__)
+    s.add_argument('--exchange-latency', type=float, default=0.003,
+                   help='simulated RF time per InDataExchange/InCommunicateThru, in seconds')
+    s.set_defaults(func=bench_ultralight)
+
+    s = sub.add_parser('ndef', help=bench_ndef.__doc__)
+    s.add_argument('-n', '--count', type=int, default=20000)
+    s.set_defaults(func=bench_ndef)
+
+    s = sub.add_parser('dump', help=bench_dump.__doc__)
+    s.add_argument('--exchange-latency', type=float, default=0.003,
+                   help='simulated RF time per InDataExchange, in seconds')
+    s.set_defaults(func=bench_dump)
+
+    s = sub.add_parser('autopoll', help=bench_autopoll.__doc__)
+    s.add_argument('--taps', type=int, default=20)
+    s.add_argument('--retries', type=int, default=0,
+                   help='MxRtyPassiveActivation for the read_passive_target loop')
+    s.add_argument('--seed', type=int, default=0)
+    s.set_defaults(func=bench_autopoll)
+
+    s = sub.add_parser('metrics', help=bench_metrics.__doc__)
+    s.add_argument('-n', '--count', type=int, default=2000)
+    s.add_argument('--dumps', type=int, default=5)
+    s.add_argument('--prometheus', action='store_true', help='print the Prometheus export')
+    s.set_defaults(func=bench_metrics)
+
+    s = sub.add_parser('replay', help=bench_replay.__doc__)
+    s.add_argument('--dumps', type=int, default=3, help='1K card dumps in the session')
+    s.add_argument('--speeds', type=float, nargs='+', default=[1, 10, 0],
+                   help='replay speeds (0 for no waiting)')
+    s.add_argument('--rounds', type=int, default=200, help='passes of the parser over the capture')
+    s.add_argument('--exchange-latency', type=float, default=0.003,
+                   help='simulated RF time per InDataExchange, in seconds')
+    s.set_defaults(func=bench_replay)
+
+    s = sub.add_parser('allowlist', help=bench_allowlist.__doc__)
+    s.add_argument('--size', type=int, default=1000000, help='UIDs on the list')
+    s.add_argument('--delta', type=int, default=1000, help='UIDs added and removed by the delta')
+    s.add_argument('--reloads', type=int, default=100, help='reloads under concurrent lookups')
+    s.add_argument('--seed', type=int, default=0)
+    s.set_defaults(func=bench_allowlist)
+
+    s = sub.add_parser('target', help=bench_target.__doc__)
+    s.add_argument('--readers', type=int, default=50, help='phones reading the tag in turn')
+    s.add_argument('--size', type=int, default=1024, help='NDEF message size in bytes')
+    s.add_argument('--baudrate', type=int, default=115200, help='HSU link speed')
+    s.add_argument('--exchange-latency', type=float, default=0.0005,
+                   help='simulated RF time per TgGetData/TgSetData, in seconds')
+    s.set_defaults(func=bench_target)
+
+    s = sub.add_parser('power', help=bench_power.__doc__)
+    s.add_argument('--wakes', type=int, default=20)
+    s.add_argument('--taps', type=int, default=10)
+    s.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=['always_on', 'balanced', 'low_power'])
+    s.add_argument('--seed', type=int, default=0)
+    s.set_defaults(func=bench_power)
+
+    s = sub.add_parser('registers', help=bench_registers.__doc__)
+    s.add_argument('--taps', type=int, default=50)
+    s.set_defaults(func=bench_registers)
+
+    s = sub.add_parser('baudrate', help=bench_baudrate.__doc__)
+    s.add_argument('-n', '--count', type=int, default=100)
+    s.add_argument('--exchange-latency', type=float, default=0.003,
+                   help='simulated RF time per InDataExchange, in seconds')
+    s.set_defaults(func=bench_baudrate)
+
+    s = sub.add_parser('retry', help=bench_retry.__doc__)
+    s.add_argument('-n', '--count', type=int, default=500)
+    s.add_argument('--loss', type=float, default=0.05,
+                   help='share of commands dropped, and of responses corrupted')
+    s.add_argument('--dead', type=float, default=0.01, help='share of commands sent to an unresponsive reader')
+    s.add_argument('--seed', type=int, default=0)
+    s.set_defaults(func=bench_retry)
+
+    s = sub.add_parser('async', help=bench_async.__doc__)
+    s.add_argument('-n', '--count', type=int, default=200)
+    s.set_defaults(func=bench_async)
+
+    s = sub.add_parser('pool', help=bench_pool.__doc__)
+    s.add_argument('--readers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    s.add_argument('--seconds', type=float, default=2.0)
+    s.add_argument('--exchange-latency', type=float, default=0.003,
+                   help='simulated RF time per InDataExchange, in seconds')
+    s.set_defaults(func=bench_pool)
+
+    args = p.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# Wire-level capture and replay of PN532 sessions.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Capture and replay of the byte stream between the host and a PN532.
+
+RecordingTransport wraps another Transport and appends everything written
+and read, with monotonic timestamps, to a capture file:
+
+    transport = RecordingTransport(PN532.SerialTransport('/dev/ttyUSB0'), 'field.cap')
+    pn532 = PN532.PN532(transport=transport)
+
+ReplayTransport plays a capture back to a PN532 instance: every frame the
+host writes is checked against the recorded one and answered with what the
+real PN532 sent, at the original speed, faster, or with no waiting at all.
+The same driver code runs against production traffic without hardware:
+
+    pn532 = PN532.PN532(transport=ReplayTransport('field.cap', speed=None))
+
+Decode a capture into annotated frames with:
+
+    python capture.py field.cap
+
+The file is a 22-byte header (magic, format version, initial baud rate,
+wall clock time the capture started) followed by records of a 13-byte
+header (nanoseconds since the start, kind, data length) and the data, all
+little-endian.  Records are only ever appended, and a record cut short by a
+crash is ignored when reading.
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import time
+from collections import deque, namedtuple
+
+import PN532
+
+
+CAPTURE_MAGIC = b'PN532CAP'
+CAPTURE_VERSION = 1
+
+# Record kinds
+RECORD_TX = 1  # bytes written to the PN532
+RECORD_RX = 2  # bytes read from the PN532
+RECORD_RESET = 3  # host discarded unread input
+RECORD_BAUDRATE = 4  # host changed its serial speed (data: the new speed)
+
+_HEADER = struct.Struct('<8sHId')
+_RECORD = struct.Struct('<QBI')
+_BAUDRATE = struct.Struct('<I')
+
+COMMAND_NAMES = {value: name for name, value in vars(PN532).items() if name.startswith('PN532_COMMAND_')}
+
+
+CaptureRecord = namedtuple('CaptureRecord', 'timestamp kind data')
+CaptureRecord.__doc__ = """One capture record: timestamp is in seconds since the capture started,
+kind one of the RECORD_* constants and data a bytes object.
+"""
+
+
+class ReplayMismatch(RuntimeError):
+    """The host wrote something other than what the capture holds."""
+
+
+class CaptureReader:
+    """Reads a capture file through mmap.  Iterating yields CaptureRecords.
+    baudrate and started are the initial baud rate (0 if unknown) and the
+    wall clock time the capture started.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = None
+        try:
+            if os.fstat(self._file.fileno()).st_size < _HEADER.size:
+                raise ValueError('{} is not a PN532 capture!'.format(path))
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, self.baudrate, self.started = _HEADER.unpack_from(self._map)
+            if magic != CAPTURE_MAGIC:
+                raise ValueError('{} is not a PN532 capture!'.format(path))
+            if version != CAPTURE_VERSION:
+                raise ValueError('Unsupported capture format version {}!'.format(version))
+        except Exception:
+            self.close()
+            raise
+
+    def __iter__(self):
+        data = self._map
+        pos = _HEADER.size
+        while pos + _RECORD.size <= len(data):
+            timestamp, kind, length = _RECORD.unpack_from(data, pos)
+            start = pos + _RECORD.size
+            pos = start + length
+            if pos > len(data):
+                break
+            yield CaptureRecord(timestamp / 1e9, kind, data[start:pos])
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingTransport(PN532.Transport):
+    """Passes everything through to transport and appends it to the capture
+    file at path (created if needed).  With flush, every record is flushed
+    to the OS as it is written, so a crash loses nothing.
+    """
+
+    def __init__(self, transport, path, flush=True):
+        self.transport = transport
+        self.flush_records = flush
+        self._start = time.monotonic_ns()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            try:
+                baudrate = transport.baudrate
+            except NotImplementedError:
+                baudrate = 0
+            self._file.write(_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, baudrate, time.time()))
+        else:
+            # Appending to an existing capture: keep its time base.
+            with CaptureReader(path) as reader:
+                records = list(reader)
+                last = records[-1].timestamp if records else 0.0
+            self._start -= int(last * 1e9)
+
+    def _record(self, kind, data):
+        self._file.write(_RECORD.pack(time.monotonic_ns() - self._start, kind, len(data)))
+        self._file.write(data)
+        if self.flush_records:
+            self._file.flush()
+
+    def write(self, data):
+        self._record(RECORD_TX, data)
+        self.transport.write(data)
+
+    def read(self, size, timeout):
+        data = self.transport.read(size, timeout)
+        if data:
+            self._record(RECORD_RX, data)
+        return data
+
+    @property
+    def in_waiting(self):
+        return self.transport.in_waiting
+
+    @property
+    def baudrate(self):
+        return self.transport.baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self.transport.baudrate = baudrate
+        self._record(RECORD_BAUDRATE, _BAUDRATE.pack(baudrate))
+
+    def flush(self):
+        self.transport.flush()
+
+    def reset_input_buffer(self):
+        self._record(RECORD_RESET, b'')
+        self.transport.reset_input_buffer()
+
+    def close(self):
+        self._file.close()
+        self.transport.close()
+
+
+class ReplayTransport(PN532.Transport):
+    """Plays the capture at path back to the host.  Each write must match
+    the next recorded write (ReplayMismatch is raised otherwise, unless
+    strict is off); the bytes the PN532 sent after it are then handed out,
+    speed times faster than they arrived (speed None hands them out at
+    once).  A read that the capture says went unanswered returns b'' right
+    away instead of waiting out its timeout.
+    """
+
+    def __init__(self, path, speed=1.0, strict=True):
+        assert speed is None or speed > 0, 'Speed must be positive.'
+        self.speed = speed
+        self.strict = strict
+        self.writes = 0
+        self._reader = CaptureReader(path)
+        self._baudrate = self._reader.baudrate or 115200
+        self._records = deque(self._reader)
+        self._pending = deque()  # [due, data] in arrival order
+
+    def write(self, data):
+        data = bytes(data)
+        records = self._records
+        # Whatever came in before this write and was not read is dropped,
+        # as a reset of the input buffer would.
+        while records and records[0].kind != RECORD_TX:
+            if records[0].kind == RECORD_BAUDRATE:
+                self._baudrate = _BAUDRATE.unpack(records[0].data)[0]
+            records.popleft()
+        if not records:
+            raise ReplayMismatch('Write #{} is past the end of the capture!'.format(self.writes + 1))
+        sent = records.popleft()
+        self.writes += 1
+        if self.strict and sent.data != data:
+            raise ReplayMismatch('Write #{} was {} but the capture has {}!'.format(
+                self.writes, data.hex(), sent.data.hex()))
+
+        now = time.monotonic()
+        self._pending.clear()
+        while records and records[0].kind != RECORD_TX:
+            record = records.popleft()
+            if record.kind == RECORD_RX:
+                delay = 0.0 if self.speed is None else (record.timestamp - sent.timestamp) / self.speed
+                self._pending.append([now + delay, record.data])
+            elif record.kind == RECORD_BAUDRATE:
+                self._baudrate = _BAUDRATE.unpack(record.data)[0]
+
+    def read(self, size, timeout):
+        pending = self._pending
+        if not pending:
+            return b''
+        wait = pending[0][0] - time.monotonic()
+        if wait > 0:
+            if timeout is not None and wait > timeout:
+                time.sleep(timeout)
+                return b''
+            time.sleep(wait)
+
+        now = time.monotonic()
+        out = bytearray()
+        while pending and pending[0][0] <= now and len(out) < size:
+            entry = pending[0]
+            take = size - len(out)
+            out += entry[1][:take]
+            if take < len(entry[1]):
+                entry[1] = entry[1][take:]
+            else:
+                pending.popleft()
+        return bytes(out)
+
+    @property
+    def in_waiting(self):
+        now = time.monotonic()
+        return sum(len(data) for due, data in self._pending if due <= now)
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self._baudrate = baudrate
+
+    def reset_input_buffer(self):
+        now = time.monotonic()
+        while self._pending and self._pending[0][0] <= now:
+            self._pending.popleft()
+
+    @property
+    def done(self):
+        """True once every recorded write has been replayed."""
+        return not any(record.kind == RECORD_TX for record in self._records)
+
+    def close(self):
+        self._records.clear()
+        self._pending.clear()
+        self._reader.close()
+
+
+def describe_frame(frame):
+    """One line describing a Frame from either direction."""
+    if frame.kind == PN532.FRAME_ACK:
+        return 'ACK'
+    if frame.kind == PN532.FRAME_NACK:
+        return 'NACK'
+    if frame.kind == PN532.FRAME_ERROR:
+        return 'ERROR (application level error frame)'
+    data = frame.data
+    if len(data) < 2 or data[0] not in (PN532.PN532_HOSTTOPN532, PN532.PN532_PN532TOHOST):
+        return 'INFO {}'.format(data.hex())
+    if data[0] == PN532.PN532_HOSTTOPN532:
+        name = COMMAND_NAMES.get(data[1], 'command {:#04x}'.format(data[1]))
+        return '{} {}'.format(name, data[2:].hex()).rstrip()
+    name = COMMAND_NAMES.get(data[1] - 1, 'command {:#04x}'.format(data[1] - 1))
+    return '{} response {}'.format(name, data[2:].hex()).rstrip()
+
+
+def decode(path, raw=False, out=print):
+    """Print the capture at path as annotated frames, one per line."""
+    parsers = {RECORD_TX: PN532.FrameParser(), RECORD_RX: PN532.FrameParser()}
+    arrows = {RECORD_TX: '>', RECORD_RX: '<'}
+    with CaptureReader(path) as reader:
+        out('# capture started {} at {} baud'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reader.started)), reader.baudrate or 'unknown'))
+        for record in reader:
+            if record.kind == RECORD_RESET:
+                if raw:
+                    out('{:12.6f}   reset input buffer'.format(record.timestamp))
+                continue
+            if record.kind == RECORD_BAUDRATE:
+                out('{:12.6f}   host baud rate {}'.format(record.timestamp, _BAUDRATE.unpack(record.data)[0]))
+                continue
+            if record.kind not in parsers:
+                out('{:12.6f} ? record kind {} ({} bytes)'.format(record.timestamp, record.kind, len(record.data)))
+                continue
+
+            arrow = arrows[record.kind]
+            if raw:
+                out('{:12.6f} {} raw {}'.format(record.timestamp, arrow, record.data.hex()))
+            parser = parsers[record.kind]
+            errors = parser.checksum_errors
+            parser.feed(record.data)
+            for frame in parser:
+                out('{:12.6f} {} {}'.format(record.timestamp, arrow, describe_frame(frame)))
+            if parser.checksum_errors != errors:
+                out('{:12.6f} {} checksum error ({} frame(s) dropped)'.format(
+                    record.timestamp, arrow, parser.checksum_errors - errors))
+
+
+def main():
+    p = argparse.ArgumentParser(description='Decode a PN532 capture into annotated frames.')
+    p.add_argument('capture')
+    p.add_argument('--raw', action='store_true', help='also print the raw bytes of every record')
+    args = p.parse_args()
+    decode(args.capture, args.raw)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+# Card-tap sessions with a block cache for the PN532.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Card-tap sessions: MiFare Classic reads cached for as long as a card
+stays on the reader.
+
+CardSession tracks the card in the field.  Once a card is listed, poll()
+checks it is still there with InSelect instead of listing it again, and
+blocks read while it stays are served from a BlockCache.  Only when the card
+leaves (InSelect fails; the target is then released with InRelease) is its
+cache dropped, so the next tap reads the card afresh:
+
+    session = CardSession(pn532)
+    while True:
+        uid = session.poll()
+        if uid is None:
+            continue
+        image, failed = session.dump_card(PN532.MIFARE_CMD_AUTH_B, key)
+
+A card taken away and put back between two polls looks like it never left;
+ttl bounds how long such a card can be served stale data.  Writes through
+the session update the cache.  Anything else that changes the card (value
+block operations, writes through the PN532 instance) should be followed by
+invalidate().
+"""
+
+import time
+from collections import OrderedDict, namedtuple
+
+import PN532
+from PN532 import mifare_classic_block_sector, mifare_classic_is_trailer, mifare_classic_sector_blocks
+
+
+SessionStats = namedtuple('SessionStats', 'taps hits misses cached_blocks')
+
+
+class BlockCache:
+    """LRU cache of 16-byte card blocks keyed by UID and block number.  Holds
+    at most max_blocks blocks (least recently used go first); with a ttl,
+    blocks are dropped that many seconds after they were read.
+    """
+
+    def __init__(self, ttl=None, max_blocks=256, clock=time.monotonic):
+        assert max_blocks > 0, 'The cache must hold at least one block.'
+        self.ttl = ttl
+        self.max_blocks = max_blocks
+        self.clock = clock
+        self._blocks = OrderedDict()  # (uid, block number) -> (data, read at)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, uid, block_number):
+        """Return the cached block, or None if it is not cached or expired."""
+        key = (uid, block_number)
+        entry = self._blocks.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and self.clock() - entry[1] >= self.ttl:
+            del self._blocks[key]
+            return None
+        self._blocks.move_to_end(key)
+        return entry[0]
+
+    def put(self, uid, block_number, data):
+        key = (uid, block_number)
+        self._blocks[key] = (bytes(data), self.clock())
+        self._blocks.move_to_end(key)
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+
+    def invalidate(self, uid, block_numbers=None):
+        """Drop the given blocks of a card, or all of them."""
+        if block_numbers is None:
+            for key in [key for key in self._blocks if key[0] == uid]:
+                del self._blocks[key]
+        else:
+            for block_number in block_numbers:
+                self._blocks.pop((uid, block_number), None)
+
+    def clear(self):
+        self._blocks.clear()
+
+
+class CardSession:
+    """Track the MiFare Classic card on a PN532 and cache its blocks while it
+    stays in the field.  The card is always target 1.  ttl and max_blocks
+    configure the BlockCache (the default holds one 4K card).  Like the
+    PN532 methods, reads return None and writes False on failure, and timeout
+    applies to each command.
+    """
+
+    def __init__(self, pn532, ttl=30.0, max_blocks=256, card_baud=PN532.PN532_MIFARE_ISO14443A):
+        self.pn532 = pn532
+        self.card_baud = card_baud
+        self.cache = BlockCache(ttl, max_blocks)
+        self.uid = None
+        self.arrived = False
+        self.taps = 0
+        self.hits = 0
+        self.misses = 0
+        self._auth_sector = None
+
+    def poll(self, timeout=1.0):
+        """Return the UID of the card in the field, or None if there is none.
+        A card that is still there from the last poll is only checked with
+        InSelect; a new one is listed with InListPassiveTarget.  arrived is
+        set when the returned card is a new tap.
+        """
+        self.arrived = False
+        if self.uid is not None:
+            self._auth_sector = None
+            if self.pn532.in_select(1, timeout):
+                return self.uid
+            self.release(timeout)
+
+        uid = self.pn532.read_passive_target(self.card_baud, timeout)
+        if uid == "no_card":
+            return None
+        self.uid = bytes(uid)
+        self.cache.invalidate(self.uid)
+        self.arrived = True
+        self.taps += 1
+        return self.uid
+
+    def release(self, timeout=1.0):
+        """Forget the current card and its cached blocks and release the
+        target, so that the next poll lists the field afresh.
+        """
+        if self.uid is None:
+            return
+        self.cache.invalidate(self.uid)
+        self.uid = None
+        self._auth_sector = None
+        try:
+            self.pn532.in_release(0, timeout)
+        except PN532.PN532Error:
+            pass
+
+    def invalidate(self, block_numbers=None):
+        """Drop the given blocks of the current card from the cache, or all
+        of them.
+        """
+        if self.uid is not None:
+            self.cache.invalidate(self.uid, block_numbers)
+
+    def stats(self):
+        return SessionStats(self.taps, self.hits, self.misses, len(self.cache))
+
+    def _authenticate(self, block_number, key_number, key, keys, timeout):
+        sector = mifare_classic_block_sector(block_number)
+        if self._auth_sector == sector:
+            return True
+        if keys is not None:
+            ok = keys.authenticate(self.pn532, self.uid, block_number, 1, timeout) is not None
+        else:
+            ok = self.pn532.mifare_classic_authenticate_block(self.uid, block_number, key_number, key, 1, timeout)
+        if ok:
+            self._auth_sector = sector
+        else:
+            # A failed authentication halts the card; wake it up again.
+            self._auth_sector = None
+            self.pn532.reselect(self.uid, 1, timeout)
+        return ok
+
+    def _cached(self, block_numbers):
+        blocks = []
+        for block_number in block_numbers:
+            data = self.cache.get(self.uid, block_number)
+            if data is None:
+                return None
+            blocks.append(data)
+        return blocks
+
+    def read_block(self, block_number, key_number=None, key=None, keys=None, timeout=1.0):
+        """Return the block's 16 bytes, read from the card (authenticating its
+        sector with key_number and key, or keys, a keymanager.KeyManager) only
+        if not cached.
+        """
+        assert self.uid is not None, 'No card; call poll() first.'
+        data = self.cache.get(self.uid, block_number)
+        if data is not None:
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        if not self._authenticate(block_number, key_number, key, keys, timeout):
+            return None
+        data = self.pn532.mifare_classic_read_block(block_number, 1, timeout)
+        if data is None:
+            self._auth_sector = None
+            return None
+        self.cache.put(self.uid, block_number, data)
+        return bytes(data)
+
+    def read_sector(self, sector, key_number=None, key=None, into=None, keys=None, timeout=1.0):
+        """Like PN532.mifare_classic_read_sector, served from the cache when
+        the whole sector is cached.
+        """
+        assert self.uid is not None, 'No card; call poll() first.'
+        block_numbers = mifare_classic_sector_blocks(sector)
+        blocks = self._cached(block_numbers)
+        if blocks is not None:
+            self.hits += len(blocks)
+            if into is None:
+                into = bytearray(16 * len(blocks))
+            into[:] = b''.join(blocks)
+            return into
+
+        self.misses += len(block_numbers)
+        into = self.pn532.mifare_classic_read_sector(self.uid, sector, key_number, key, into, keys, 1, timeout)
+        if into is None:
+            self._auth_sector = None
+            return None
+        self._auth_sector = sector
+        for i, block_number in enumerate(block_numbers):
+            self.cache.put(self.uid, block_number, into[i * 16:i * 16 + 16])
+        return into
+
+    def dump_card(self, key_number=None, key=None, card_size=1024, keys=None, timeout=1.0):
+        """Like PN532.mifare_classic_dump_card, reading only the sectors that
+        are not cached.  Returns a tuple of the card image and a list of the
+        sectors that could not be read.
+        """
+        assert self.uid is not None, 'No card; call poll() first.'
+        image = bytearray(card_size)
+        view = memoryview(image)
+        failed = []
+
+        sector_count = PN532.mifare_classic_sector_count(card_size)
+        for sector in range(sector_count):
+            blocks = mifare_classic_sector_blocks(sector)
+            offset = blocks[0] * 16
+            sector_view = view[offset:offset + 16 * len(blocks)]
+            if self.read_sector(sector, key_number, key, sector_view, keys, timeout) is not None:
+                continue
+
+            failed.append(sector)
+            sector_view[:] = bytes(len(sector_view))
+            if sector + 1 < sector_count and self.pn532.reselect(self.uid, 1, timeout) is None:
+                # The card has left the field.
+                failed.extend(range(sector + 1, sector_count))
+                break
+
+        view.release()
+        return image, failed
+
+    def _written(self, block_number, data):
+        # Sector trailers read back differently from what was written (key A
+        # reads as zeros), so they are read again rather than written through.
+        if mifare_classic_is_trailer(block_number):
+            self.cache.invalidate(self.uid, (block_number,))
+        else:
+            self.cache.put(self.uid, block_number, data)
+
+    def write_block(self, block_number, data, key_number=None, key=None, keys=None, timeout=1.0):
+        """Write a block through the cache.  Returns True on success; on
+        failure the block is dropped from the cache.
+        """
+        assert self.uid is not None, 'No card; call poll() first.'
+        assert len(data) == 16, 'Data must be an array of 16 bytes!'
+        if (self._authenticate(block_number, key_number, key, keys, timeout) and
+                self.pn532.mifare_classic_write_block(block_number, data, 1, timeout)):
+            self._written(block_number, data)
+            return True
+        self._auth_sector = None
+        self.cache.invalidate(self.uid, (block_number,))
+        return False
+
+    def write_blocks(self, blocks, key_number=None, key=None, verify=False, allow_trailers=False, keys=None,
+                     timeout=1.0):
+        """Like PN532.mifare_classic_write_blocks, writing through the cache.
+        Returns a list of the blocks that could not be written.
+        """
+        assert self.uid is not None, 'No card; call poll() first.'
+        failed = self.pn532.mifare_classic_write_blocks(self.uid, blocks, key_number, key, verify, allow_trailers,
+                                                        keys, 1, timeout)
+        self._auth_sector = None
+        for block_number, data in blocks.items():
+            if block_number in failed:
+                self.cache.invalidate(self.uid, (block_number,))
+            else:
+                self._written(block_number, data)
+        return failed
@@ -0,0 +1,125 @@
+# MiFare Classic key dictionary search with a per-card cache.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Finding working MiFare Classic keys in a mixed card population.
+
+Every failed authentication costs a round trip and halts the card, which then
+has to be re-selected, so the order keys are tried in matters.  KeyManager
+tries the key that last worked for the same card and sector first, then the
+rest of its dictionary ordered by how often each key has worked so far:
+
+    keys = KeyManager([[0xFF] * 6, SITE_KEY_1, SITE_KEY_2])
+    image, failed = pn532.mifare_classic_dump_card(uid, keys=keys)
+
+One KeyManager can be shared by several readers (and threads).
+"""
+
+import threading
+from collections import OrderedDict
+
+import PN532
+from PN532 import mifare_classic_block_sector
+
+
+class KeyManager:
+    """Key dictionary with an LRU cache of the key that worked per
+    (UID, sector).  Every key is tried with each of key_types (MIFARE_CMD_AUTH_A
+    and/or MIFARE_CMD_AUTH_B).  cache_size bounds the number of remembered
+    (UID, sector) pairs; the least recently used are evicted first.
+    """
+
+    def __init__(self, keys, key_types=(PN532.MIFARE_CMD_AUTH_A, PN532.MIFARE_CMD_AUTH_B), cache_size=4096):
+        self.cache_size = cache_size
+        self._order = [(key_type, bytes(key)) for key in keys for key_type in key_types]
+        self._hits = dict.fromkeys(self._order, 0)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of cached (UID, sector) entries."""
+        return len(self._cache)
+
+    def hit_counts(self):
+        """Return a list of ((key_type, key), successful authentications),
+        most successful first.
+        """
+        with self._lock:
+            return [(candidate, self._hits[candidate]) for candidate in self._order]
+
+    def candidates(self, uid, sector):
+        """Return the (key_type, key) pairs to try for a sector, best first."""
+        with self._lock:
+            cached = self._cache.get((bytes(uid), sector))
+            if cached is None:
+                return list(self._order)
+            self._cache.move_to_end((bytes(uid), sector))
+            return [cached] + [c for c in self._order if c != cached]
+
+    def record(self, uid, sector, key_type, key):
+        """Remember that key_type/key authenticated sector of the card uid."""
+        candidate = (key_type, bytes(key))
+        with self._lock:
+            self._cache[(bytes(uid), sector)] = candidate
+            self._cache.move_to_end((bytes(uid), sector))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+            if candidate not in self._hits:
+                self._hits[candidate] = 0
+                self._order.append(candidate)
+            self._hits[candidate] += 1
+            # Stable sort, so keys with equal hit counts keep dictionary order.
+            self._order.sort(key=self._hits.__getitem__, reverse=True)
+
+    def forget(self, uid, sector=None):
+        """Drop cached keys for a card, or for one of its sectors."""
+        with self._lock:
+            if sector is not None:
+                self._cache.pop((bytes(uid), sector), None)
+                return
+            for entry in [e for e in self._cache if e[0] == bytes(uid)]:
+                del self._cache[entry]
+
+    def authenticate(self, pn532, uid, block_number, target=1, timeout=1.0):
+        """Authenticate the sector of block_number on the card uid (target
+        number target), trying candidate keys in order and re-selecting the
+        card after each failure.
+        Returns the (key_type, key) that worked, or None if none did (the card
+        is then left halted, as after any failed authentication).  Timeout
+        applies to each command.
+        """
+        sector = mifare_classic_block_sector(block_number)
+        candidates = self.candidates(uid, sector)
+        for i, (key_type, key) in enumerate(candidates):
+            if pn532.mifare_classic_authenticate_block(uid, block_number, key_type, key, target, timeout):
+                self.record(uid, sector, key_type, key)
+                return key_type, key
+            if i == 0:
+                self.forget(uid, sector)
+            if i + 1 < len(candidates):
+                target = pn532.reselect(uid, timeout=timeout)
+                if target is None:
+                    # The card has left the field.
+                    break
+        return None
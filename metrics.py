@@ -0,0 +1,218 @@
+# Per-command metrics for the PN532 driver.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Per-command metrics for PN532 readers.
+
+CommandMetrics is an instrumentation hook for PN532.PN532: it aggregates the
+CommandRecord of every command by command code (calls by outcome, retries,
+checksum failures, bytes both ways, time sleeping and reading, and latency
+histograms from write to ACK and from ACK to response) and exports them as
+Prometheus text or JSON:
+
+    metrics = CommandMetrics(labels={'reader': 'gate-1'})
+    pn532 = PN532.PN532('/dev/ttyUSB0', instrumentation=metrics)
+    ...
+    print(metrics.prometheus_text())
+
+One CommandMetrics can be shared by several readers (on several threads).
+A PN532 without instrumentation pays nothing but an attribute check per
+command.
+"""
+
+import bisect
+import json
+import threading
+
+import PN532
+
+
+# Latency histogram bucket bounds, in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Command names by command code, from the PN532_COMMAND_* constants.
+COMMAND_NAMES = {value: name[len('PN532_COMMAND_'):].lower()
+                 for name, value in vars(PN532).items() if name.startswith('PN532_COMMAND_')}
+
+
+def command_name(command):
+    return COMMAND_NAMES.get(command, '{:#04x}'.format(command))
+
+
+class Histogram:
+    """Counts of observations per bucket (the last bucket is +Inf), with
+    their sum.
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self):
+        return {
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class _CommandStats:
+    __slots__ = ('outcomes', 'retries', 'checksum_errors', 'bytes_out', 'bytes_in', 'sleep_time', 'read_time',
+                 'total_time', 'ack_latency', 'response_latency')
+
+    def __init__(self, buckets):
+        self.outcomes = {}
+        self.retries = 0
+        self.checksum_errors = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.sleep_time = 0.0
+        self.read_time = 0.0
+        self.total_time = 0.0
+        self.ack_latency = Histogram(buckets)
+        self.response_latency = Histogram(buckets)
+
+
+class CommandMetrics:
+    """Aggregates PN532 CommandRecords per command code.  Pass an instance as
+    a PN532's instrumentation.  labels are added to every exported
+    Prometheus series (to tell readers apart across a fleet).
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, labels=None, prefix='pn532'):
+        self.buckets = tuple(buckets)
+        self.labels = dict(labels or {})
+        self.prefix = prefix
+        self._commands = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            stats = self._commands.get(record.command)
+            if stats is None:
+                stats = self._commands[record.command] = _CommandStats(self.buckets)
+            stats.outcomes[record.outcome] = stats.outcomes.get(record.outcome, 0) + 1
+            stats.retries += max(0, record.attempts - 1)
+            stats.checksum_errors += record.nacks
+            stats.bytes_out += record.bytes_out
+            stats.bytes_in += record.bytes_in
+            stats.sleep_time += record.sleep_time
+            stats.read_time += record.read_time
+            stats.total_time += record.finished - record.started
+            if record.acked is not None:
+                stats.ack_latency.observe(record.acked - record.started)
+                if record.outcome == 'ok':
+                    stats.response_latency.observe(record.finished - record.acked)
+
+    def reset(self):
+        with self._lock:
+            self._commands.clear()
+
+    def snapshot(self):
+        """Return the metrics as a dict keyed by command name, sorted by the
+        time spent in each command (busiest first).
+        """
+        with self._lock:
+            ret = {}
+            for command, stats in sorted(self._commands.items(), key=lambda item: -item[1].total_time):
+                ret[command_name(command)] = {
+                    'code': command,
+                    'calls': sum(stats.outcomes.values()),
+                    'outcomes': dict(stats.outcomes),
+                    'retries': stats.retries,
+                    'checksum_errors': stats.checksum_errors,
+                    'bytes_out': stats.bytes_out,
+                    'bytes_in': stats.bytes_in,
+                    'sleep_seconds': stats.sleep_time,
+                    'read_seconds': stats.read_time,
+                    'total_seconds': stats.total_time,
+                    'ack_latency_seconds': stats.ack_latency.as_dict(),
+                    'response_latency_seconds': stats.response_latency.as_dict(),
+                }
+            return ret
+
+    def to_json(self, **kwargs):
+        """Return snapshot() as JSON; kwargs go to json.dumps."""
+        return json.dumps({'labels': self.labels, 'commands': self.snapshot()}, **kwargs)
+
+    def _series(self, name, labels, value):
+        label_text = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                              for k, v in labels.items())
+        return '{}_{}{{{}}} {}'.format(self.prefix, name, label_text, value)
+
+    def prometheus_text(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        counters = (
+            ('command_retries_total', 'Command frames sent again for lack of an ACK.', 'retries'),
+            ('command_checksum_errors_total', 'NACKs sent for corrupted responses.', 'checksum_errors'),
+            ('command_bytes_out_total', 'Bytes written to the PN532.', 'bytes_out'),
+            ('command_bytes_in_total', 'Bytes read from the PN532.', 'bytes_in'),
+            ('command_sleep_seconds_total', 'Time spent in retry backoff.', 'sleep_time'),
+            ('command_read_seconds_total', 'Time spent blocked reading from the PN532.', 'read_time'),
+            ('command_seconds_total', 'Time spent in commands.', 'total_time'),
+        )
+        histograms = (
+            ('command_ack_latency_seconds', 'Time from sending a command to its ACK.', 'ack_latency'),
+            ('command_response_latency_seconds', 'Time from a command\'s ACK to its response.',
+             'response_latency'),
+        )
+
+        with self._lock:
+            commands = sorted(self._commands.items())
+            lines = ['# HELP {}_commands_total Commands run, by outcome.'.format(self.prefix),
+                     '# TYPE {}_commands_total counter'.format(self.prefix)]
+            for command, stats in commands:
+                for outcome, count in sorted(stats.outcomes.items()):
+                    labels = dict(self.labels, command=command_name(command), outcome=outcome)
+                    lines.append(self._series('commands_total', labels, count))
+
+            for name, help_text, attr in counters:
+                lines.append('# HELP {}_{} {}'.format(self.prefix, name, help_text))
+                lines.append('# TYPE {}_{} counter'.format(self.prefix, name))
+                for command, stats in commands:
+                    labels = dict(self.labels, command=command_name(command))
+                    lines.append(self._series(name, labels, getattr(stats, attr)))
+
+            for name, help_text, attr in histograms:
+                lines.append('# HELP {}_{} {}'.format(self.prefix, name, help_text))
+                lines.append('# TYPE {}_{} histogram'.format(self.prefix, name))
+                for command, stats in commands:
+                    histogram = getattr(stats, attr)
+                    labels = dict(self.labels, command=command_name(command))
+                    cumulative = 0
+                    for bound, count in zip(list(self.buckets) + ['+Inf'], histogram.counts):
+                        cumulative += count
+                        lines.append(self._series(name + '_bucket', dict(labels, le=bound), cumulative))
+                    lines.append(self._series(name + '_sum', labels, histogram.sum))
+                    lines.append(self._series(name + '_count', labels, histogram.count))
+
+        return '\n'.join(lines) + '\n'
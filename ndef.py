@@ -0,0 +1,431 @@
+# NDEF message and TLV encoding and decoding.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Reading and writing NDEF messages.
+
+Decoding works on memoryviews of a tag dump and is lazy: iter_records()
+parses one record header at a time and hands out payloads as views into the
+dump, so scanning a large tag for its first URI touches only the bytes it
+needs:
+
+    for record in ndef.iter_records(ndef.type2_message(dump)):
+        if record.is_uri():
+            print(record.uri())
+
+NDEF messages live in an NDEF TLV, both on Type 2 tags (after the capability
+container) and on MiFare Classic cards (in the sectors the MAD assigns to
+NDEF).  Encoding goes the other way:
+
+    data = ndef.encode_tlv(ndef.encode_message([ndef.uri_record('https://example.com/')]))
+"""
+
+from collections import namedtuple
+
+import PN532
+from PN532 import mifare_classic_sector_blocks, mifare_classic_sector_count
+
+
+# pylint: disable=bad-whitespace
+# Record header flags
+NDEF_MB                             = 0x80
+NDEF_ME                             = 0x40
+NDEF_CF                             = 0x20
+NDEF_SR                             = 0x10
+NDEF_IL                             = 0x08
+
+# Type name formats
+TNF_EMPTY                           = 0x00
+TNF_WELL_KNOWN                      = 0x01
+TNF_MIME                            = 0x02
+TNF_ABSOLUTE_URI                    = 0x03
+TNF_EXTERNAL                        = 0x04
+TNF_UNKNOWN                         = 0x05
+TNF_UNCHANGED                       = 0x06
+
+# TLV blocks
+TLV_NULL                            = 0x00
+TLV_LOCK_CONTROL                    = 0x01
+TLV_MEMORY_CONTROL                  = 0x02
+TLV_NDEF                            = 0x03
+TLV_PROPRIETARY                     = 0xFD
+TLV_TERMINATOR                      = 0xFE
+
+# MAD application ID of NDEF sectors (stored as 03 E1, read little endian),
+# and the MAD's CRC parameters
+MAD_NDEF_AID                        = 0xE103
+MAD_CRC_PRESET                      = 0xC7
+MAD_CRC_POLY                        = 0x1D
+# pylint: enable=bad-whitespace
+
+URI_PREFIXES = {
+    PN532.NDEF_URIPREFIX_NONE: '',
+    PN532.NDEF_URIPREFIX_HTTP_WWWDOT: 'http://www.',
+    PN532.NDEF_URIPREFIX_HTTPS_WWWDOT: 'https://www.',
+    PN532.NDEF_URIPREFIX_HTTP: 'http://',
+    PN532.NDEF_URIPREFIX_HTTPS: 'https://',
+    PN532.NDEF_URIPREFIX_TEL: 'tel:',
+    PN532.NDEF_URIPREFIX_MAILTO: 'mailto:',
+    PN532.NDEF_URIPREFIX_FTP_ANONAT: 'ftp://anonymous:anonymous@',
+    PN532.NDEF_URIPREFIX_FTP_FTPDOT: 'ftp://ftp.',
+    PN532.NDEF_URIPREFIX_FTPS: 'ftps://',
+    PN532.NDEF_URIPREFIX_SFTP: 'sftp://',
+    PN532.NDEF_URIPREFIX_SMB: 'smb://',
+    PN532.NDEF_URIPREFIX_NFS: 'nfs://',
+    PN532.NDEF_URIPREFIX_FTP: 'ftp://',
+    PN532.NDEF_URIPREFIX_DAV: 'dav://',
+    PN532.NDEF_URIPREFIX_NEWS: 'news:',
+    PN532.NDEF_URIPREFIX_TELNET: 'telnet://',
+    PN532.NDEF_URIPREFIX_IMAP: 'imap:',
+    PN532.NDEF_URIPREFIX_RTSP: 'rtsp://',
+    PN532.NDEF_URIPREFIX_URN: 'urn:',
+    PN532.NDEF_URIPREFIX_POP: 'pop:',
+    PN532.NDEF_URIPREFIX_SIP: 'sip:',
+    PN532.NDEF_URIPREFIX_SIPS: 'sips:',
+    PN532.NDEF_URIPREFIX_TFTP: 'tftp:',
+    PN532.NDEF_URIPREFIX_BTSPP: 'btspp://',
+    PN532.NDEF_URIPREFIX_BTL2CAP: 'btl2cap://',
+    PN532.NDEF_URIPREFIX_BTGOEP: 'btgoep://',
+    PN532.NDEF_URIPREFIX_TCPOBEX: 'tcpobex://',
+    PN532.NDEF_URIPREFIX_IRDAOBEX: 'irdaobex://',
+    PN532.NDEF_URIPREFIX_FILE: 'file://',
+    PN532.NDEF_URIPREFIX_URN_EPC_ID: 'urn:epc:id:',
+    PN532.NDEF_URIPREFIX_URN_EPC_TAG: 'urn:epc:tag:',
+    PN532.NDEF_URIPREFIX_URN_EPC_PAT: 'urn:epc:pat:',
+    PN532.NDEF_URIPREFIX_URN_EPC_RAW: 'urn:epc:raw:',
+    PN532.NDEF_URIPREFIX_URN_EPC: 'urn:epc:',
+    PN532.NDEF_URIPREFIX_URN_NFC: 'urn:nfc:',
+}
+
+# Longest prefixes first, so that encoding picks the best abbreviation.
+_URI_ENCODE_ORDER = sorted(((p, c) for c, p in URI_PREFIXES.items() if p), key=lambda pc: -len(pc[0]))
+
+
+class Record(namedtuple('Record', 'tnf type id payload')):
+    """One NDEF record.  type and id are bytes; payload is bytes or, for
+    decoded records, a memoryview into the decoded data (copy it with bytes()
+    to keep it beyond the data's lifetime).
+    """
+
+    __slots__ = ()
+
+    def is_uri(self):
+        return self.tnf == TNF_WELL_KNOWN and self.type == b'U'
+
+    def is_text(self):
+        return self.tnf == TNF_WELL_KNOWN and self.type == b'T'
+
+    def uri(self):
+        """The URI of a URI record, with its abbreviated prefix expanded."""
+        if not self.is_uri():
+            raise ValueError('Not a URI record!')
+        if not self.payload:
+            raise ValueError('Empty URI record!')
+        prefix = URI_PREFIXES.get(self.payload[0], '')
+        return prefix + bytes(self.payload[1:]).decode('utf-8')
+
+    def text(self):
+        """The (text, language code) of a Text record."""
+        if not self.is_text():
+            raise ValueError('Not a Text record!')
+        status = self.payload[0]
+        lang_end = 1 + (status & 0x3F)
+        encoding = 'utf-8'
+        if status & 0x80:
+            # UTF-16 is big endian unless a byte order mark says otherwise.
+            bom = bytes(self.payload[lang_end:lang_end + 2])
+            encoding = 'utf-16' if bom in (b'\xFE\xFF', b'\xFF\xFE') else 'utf-16-be'
+        return (bytes(self.payload[lang_end:]).decode(encoding),
+                bytes(self.payload[1:lang_end]).decode('ascii'))
+
+
+def uri_record(uri):
+    """A well known URI record, abbreviating the longest matching prefix."""
+    for prefix, code in _URI_ENCODE_ORDER:
+        if uri.startswith(prefix):
+            return Record(TNF_WELL_KNOWN, b'U', b'', bytes([code]) + uri[len(prefix):].encode('utf-8'))
+    return Record(TNF_WELL_KNOWN, b'U', b'', b'\x00' + uri.encode('utf-8'))
+
+
+def text_record(text, lang='en'):
+    """A well known Text record, UTF-8 encoded."""
+    lang = lang.encode('ascii')
+    assert len(lang) < 64, 'Language code too long!'
+    return Record(TNF_WELL_KNOWN, b'T', b'', bytes([len(lang)]) + lang + text.encode('utf-8'))
+
+
+def mime_record(mime_type, data):
+    """A MIME type record, like mime_record('application/json', b'{}')."""
+    return Record(TNF_MIME, mime_type.encode('ascii'), b'', bytes(data))
+
+
+def external_record(external_type, data):
+    """An NFC Forum external type record, like
+    external_record('example.com:kiosk', b'...').
+    """
+    return Record(TNF_EXTERNAL, external_type.encode('ascii'), b'', bytes(data))
+
+
+def encode_record(record, flags=NDEF_MB | NDEF_ME):
+    """Encode one record with the given MB/ME/CF flags.  The short record
+    format and the ID length field are used when they apply.
+    """
+    payload_length = len(record.payload)
+    flags |= record.tnf & 0x07
+    if payload_length < 256:
+        flags |= NDEF_SR
+    if record.id:
+        flags |= NDEF_IL
+
+    out = bytearray((flags, len(record.type)))
+    if payload_length < 256:
+        out.append(payload_length)
+    else:
+        out += payload_length.to_bytes(4, 'big')
+    if record.id:
+        out.append(len(record.id))
+    out += record.type
+    out += record.id
+    out += record.payload
+    return bytes(out)
+
+
+def encode_message(records, chunk_size=None):
+    """Encode a list of records as an NDEF message.  With chunk_size,
+    payloads longer than that are split into chunked records.
+    """
+    out = bytearray()
+    for i, record in enumerate(records):
+        flags = (NDEF_MB if i == 0 else 0) | (NDEF_ME if i == len(records) - 1 else 0)
+        payload = record.payload
+        if chunk_size is None or len(payload) <= chunk_size:
+            out += encode_record(record, flags)
+            continue
+
+        # The first chunk carries the type and ID, the rest are TNF_UNCHANGED.
+        chunks = [payload[j:j + chunk_size] for j in range(0, len(payload), chunk_size)]
+        for j, chunk in enumerate(chunks):
+            chunk_flags = flags & NDEF_MB if j == 0 else 0
+            if j < len(chunks) - 1:
+                chunk_flags |= NDEF_CF
+            else:
+                chunk_flags |= flags & NDEF_ME
+            if j == 0:
+                out += encode_record(Record(record.tnf, record.type, record.id, chunk), chunk_flags)
+            else:
+                out += encode_record(Record(TNF_UNCHANGED, b'', b'', chunk), chunk_flags)
+    return bytes(out)
+
+
+def iter_records(data):
+    """Lazily decode the NDEF message in data (any bytes-like object),
+    yielding a Record per record.  Payloads are memoryview slices of data,
+    except for chunked records, whose chunks are joined into bytes.  Raises
+    ValueError on a malformed message.
+    """
+    view = memoryview(data)
+    pos = 0
+    end = len(view)
+    chunked = None
+    while pos < end:
+        flags = view[pos]
+        if pos + 3 > end:
+            raise ValueError('Truncated NDEF record header!')
+        type_length = view[pos + 1]
+        if flags & NDEF_SR:
+            payload_length = view[pos + 2]
+            pos += 3
+        else:
+            if pos + 6 > end:
+                raise ValueError('Truncated NDEF record header!')
+            payload_length = int.from_bytes(view[pos + 2:pos + 6], 'big')
+            pos += 6
+        id_length = 0
+        if flags & NDEF_IL:
+            if pos >= end:
+                raise ValueError('Truncated NDEF record header!')
+            id_length = view[pos]
+            pos += 1
+
+        type_end = pos + type_length
+        id_end = type_end + id_length
+        payload_end = id_end + payload_length
+        if payload_end > end:
+            raise ValueError('NDEF record runs past the end of the message!')
+        tnf = flags & 0x07
+        payload = view[id_end:payload_end]
+
+        if chunked is not None:
+            if tnf != TNF_UNCHANGED:
+                raise ValueError('Chunked NDEF record interrupted!')
+            chunked[3].append(payload)
+            if not flags & NDEF_CF:
+                yield Record(chunked[0], chunked[1], chunked[2], b''.join(chunked[3]))
+                chunked = None
+        elif flags & NDEF_CF:
+            chunked = (tnf, bytes(view[pos:type_end]), bytes(view[type_end:id_end]), [payload])
+        else:
+            yield Record(tnf, bytes(view[pos:type_end]), bytes(view[type_end:id_end]), payload)
+
+        pos = payload_end
+        if flags & NDEF_ME:
+            break
+    if chunked is not None:
+        raise ValueError('NDEF message ends inside a chunked record!')
+
+
+def decode_message(data):
+    """Decode the whole NDEF message in data into a list of Records."""
+    return list(iter_records(data))
+
+
+def iter_tlvs(data):
+    """Yield (tag, value) for every TLV block in data up to the terminator
+    TLV.  Values are memoryview slices of data; NULL TLVs are skipped.
+    """
+    view = memoryview(data)
+    pos = 0
+    end = len(view)
+    while pos < end:
+        tag = view[pos]
+        if tag == TLV_NULL:
+            pos += 1
+            continue
+        if tag == TLV_TERMINATOR:
+            return
+        if pos + 2 > end:
+            raise ValueError('Truncated TLV!')
+        length = view[pos + 1]
+        pos += 2
+        if length == 0xFF:
+            if pos + 2 > end:
+                raise ValueError('Truncated TLV!')
+            length = (view[pos] << 8) | view[pos + 1]
+            pos += 2
+        if pos + length > end:
+            raise ValueError('TLV runs past the end of the data!')
+        yield tag, view[pos:pos + length]
+        pos += length
+
+
+def find_message(data):
+    """Return the value of the first NDEF TLV in data (a memoryview), or None
+    if there is none.
+    """
+    for tag, value in iter_tlvs(data):
+        if tag == TLV_NDEF:
+            return value
+    return None
+
+
+def encode_tlv(message):
+    """Wrap an encoded NDEF message in an NDEF TLV followed by a terminator."""
+    length = len(message)
+    if length < 0xFF:
+        header = bytes((TLV_NDEF, length))
+    else:
+        header = bytes((TLV_NDEF, 0xFF, length >> 8, length & 0xFF))
+    return header + bytes(message) + bytes((TLV_TERMINATOR,))
+
+
+def type2_data_area(dump):
+    """Return a memoryview of the data area of a Type 2 tag dump (starting at
+    page 0), as sized by its capability container.  Raises ValueError if the
+    tag is not NDEF formatted.
+    """
+    view = memoryview(dump)
+    if len(view) < 16 or view[12] != 0xE1:
+        raise ValueError('Not an NDEF formatted Type 2 tag!')
+    return view[16:16 + view[14] * 8]
+
+
+def type2_message(dump):
+    """Return the NDEF message of a Type 2 tag dump as a memoryview, or None
+    if the tag holds no NDEF TLV.
+    """
+    return find_message(type2_data_area(dump))
+
+
+def _mad_crc_table():
+    table = []
+    for crc in range(256):
+        for _ in range(8):
+            crc = ((crc << 1) ^ MAD_CRC_POLY) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+_MAD_CRC_TABLE = _mad_crc_table()
+
+
+def mad_crc(data):
+    """CRC-8 of the MAD, over its info byte and application IDs."""
+    crc = MAD_CRC_PRESET
+    table = _MAD_CRC_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+
+def mad_sectors(image, aid=MAD_NDEF_AID, check_crc=True):
+    """Return the sectors that the MAD of a MiFare Classic card image (from
+    PN532.mifare_classic_dump_card) assigns to application aid (read little
+    endian), in order.  A
+    4K image's MAD2 is read as well.  Raises ValueError on a bad MAD CRC
+    unless check_crc is false.
+    """
+    view = memoryview(image)
+    mads = [(view[16:48], 1)]
+    if len(view) > 1024:
+        mads.append((view[64 * 16:64 * 16 + 48], 17))
+
+    sectors = []
+    for mad, first_sector in mads:
+        if check_crc and mad_crc(mad[1:]) != mad[0]:
+            raise ValueError('Bad MAD CRC for sectors from {}!'.format(first_sector))
+        for i in range(2, len(mad), 2):
+            if mad[i] | (mad[i + 1] << 8) == aid:
+                sectors.append(first_sector + i // 2 - 1)
+    return sectors
+
+
+def classic_data_area(image, check_crc=True):
+    """Return the NDEF data area of a MiFare Classic 1K or 4K card image: the
+    data blocks of the MAD's NDEF sectors, joined (trailers left out).
+    """
+    view = memoryview(image)
+    area = bytearray()
+    for sector in mad_sectors(view, check_crc=check_crc):
+        if sector >= mifare_classic_sector_count(len(view)):
+            break
+        blocks = mifare_classic_sector_blocks(sector)
+        area += view[blocks[0] * 16:blocks[-1] * 16]
+    return area
+
+
+def classic_message(image, check_crc=True):
+    """Return the NDEF message of a MiFare Classic card image as a memoryview,
+    or None if the card holds no NDEF TLV.
+    """
+    return find_message(classic_data_area(image, check_crc))
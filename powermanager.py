@@ -0,0 +1,125 @@
+# Low-power polling for the PN532.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Polling for cards on a battery budget.
+
+A reader that polls continuously keeps the RF field on and the PN532 awake
+all the time.  PowerManager instead polls on a schedule set by a
+PowerProfile and puts the chip in PowerDown while it waits; the command that
+starts the next poll wakes it with the shortest HSU preamble (see
+PN532.hsu_wake_preamble).  RFConfiguration bounds each poll: with
+MxRtyPassiveActivation low, InListPassiveTarget gives up on an empty field
+after a few activation attempts instead of waiting for a card.
+
+    manager = PowerManager(pn532, LOW_POWER)
+    while True:
+        uid = manager.poll()
+        if uid is not None:
+            print(uid.hex())
+
+A longer poll_interval draws less current and detects cards later.
+"""
+
+import time
+from collections import namedtuple
+
+import PN532
+
+
+PowerProfile = namedtuple('PowerProfile', 'name poll_interval passive_activation retry_timeout power_down')
+PowerProfile.__doc__ = """How to poll: at most once per poll_interval seconds, with
+MxRtyPassiveActivation passive_activation (0xFF waits for a card for as long
+as the poll's timeout) and the RFConfiguration retry_timeout code, powering
+the PN532 down between polls if power_down is set.
+"""
+
+# Field always on, cards reported as soon as they arrive.
+ALWAYS_ON = PowerProfile('always_on', 0.0, 0xFF, PN532.PN532_RFCFG_TIMEOUT_51MS, False)
+# Ten short polls per second, asleep in between.
+BALANCED = PowerProfile('balanced', 0.1, 0x02, PN532.PN532_RFCFG_TIMEOUT_51MS, True)
+# Two single-attempt polls per second, asleep in between.
+LOW_POWER = PowerProfile('low_power', 0.5, 0x00, PN532.PN532_RFCFG_TIMEOUT_13MS, True)
+
+PROFILES = {profile.name: profile for profile in (ALWAYS_ON, BALANCED, LOW_POWER)}
+
+
+class PowerManager:
+    """Polls a PN532 for cards according to a PowerProfile.  wake_sources
+    (PN532_WAKE_* bits) are what may wake the PN532 from PowerDown; the host
+    always wakes it over HSU for the next poll.
+    """
+
+    def __init__(self, pn532, profile=BALANCED, card_baud=PN532.PN532_MIFARE_ISO14443A,
+                 wake_sources=PN532.PN532_WAKE_HSU, clock=time.monotonic):
+        self.pn532 = pn532
+        self.card_baud = card_baud
+        self.wake_sources = wake_sources
+        self.clock = clock
+        self.polls = 0
+        self.cards = 0
+        self.power_downs = 0
+        self._profile = profile
+        self._applied = False
+        self._next_poll = None
+
+    @property
+    def profile(self):
+        return self._profile
+
+    @profile.setter
+    def profile(self, profile):
+        """Switch to another PowerProfile, from the next poll on."""
+        self._profile = profile
+        self._applied = False
+
+    def apply(self, timeout=1.0):
+        """Send the profile's RFConfiguration to the PN532."""
+        self.pn532.set_max_retries(passive_activation=self._profile.passive_activation, timeout=timeout)
+        self.pn532.set_rf_timings(retry_timeout=self._profile.retry_timeout, timeout=timeout)
+        self._applied = True
+
+    def poll(self, timeout=1.0):
+        """Wait for the next poll slot, powered down if the profile says so,
+        then poll once and return the UID of the card found, or None.
+        timeout bounds each command.
+        """
+        profile = self._profile
+        if self._next_poll is not None and self._next_poll > self.clock():
+            if profile.power_down and not self.pn532.powered_down:
+                if self.pn532.power_down(self.wake_sources, timeout=timeout):
+                    self.power_downs += 1
+            wait = self._next_poll - self.clock()
+            if wait > 0:
+                time.sleep(wait)
+        self._next_poll = max(self.clock(), self._next_poll or 0.0) + profile.poll_interval
+
+        if not self._applied:
+            self.apply(timeout)
+        self.polls += 1
+        uid = self.pn532.read_passive_target(self.card_baud, timeout)
+        if uid == "no_card":
+            return None
+        self.cards += 1
+        return uid
@@ -0,0 +1,235 @@
+# Run many PN532 readers concurrently.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Polling many PN532 readers at once.
+
+ReaderPool runs every reader on its own worker thread: it opens the reader,
+polls for cards, runs an optional on_card handler for the card I/O and puts
+a CardEvent tagged with the reader ID on one shared queue.  The workers spend
+nearly all their time blocked on their serial port, so throughput scales
+with the number of readers.
+
+    pool = ReaderPool({'gate-1': '/dev/ttyUSB0', 'gate-2': '/dev/ttyUSB1'})
+    pool.start()
+    for event in pool.events():
+        print(event.reader_id, event.uid.hex())
+
+Up to max_events events are queued; while the queue is full, new events are
+dropped (and counted in the reader's stats) rather than holding up the
+workers.  A supervisor thread restarts readers whose worker died or stopped making
+progress for wedge_timeout seconds (closing a wedged reader's transport so
+its blocked worker gives up), without touching the others.
+"""
+
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import PN532
+
+
+CardEvent = namedtuple('CardEvent', 'reader_id uid timestamp result')
+ReaderStats = namedtuple('ReaderStats', 'alive cards cards_per_second restarts last_error dropped_events')
+
+
+class _Reader:
+    def __init__(self, reader_id, factory):
+        self.reader_id = reader_id
+        self.factory = factory
+        self.pn532 = None
+        self.thread = None
+        self.generation = 0
+        self.heartbeat = 0.0
+        self.started = 0.0
+        self.cards = 0
+        self.restarts = 0
+        self.last_error = None
+        self.dropped_events = 0
+
+
+class ReaderPool:
+    """Readers maps reader IDs to serial port names or to callables returning
+    a ready-to-use PN532 instance.  on_card(pn532, uid), if given, runs on the
+    reader's worker thread for every card and its return value becomes the
+    event's result.  A card resting on a reader is reported once unless
+    repeat is set.  poll_timeout bounds each InListPassiveTarget, so workers
+    check in at least that often.
+    """
+
+    def __init__(self, readers, on_card=None, repeat=False, poll_timeout=1.0, wedge_timeout=10.0,
+                 restart_delay=1.0, max_events=10000):
+        self.on_card = on_card
+        self.repeat = repeat
+        self.poll_timeout = poll_timeout
+        self.wedge_timeout = wedge_timeout
+        self.restart_delay = restart_delay
+
+        self._readers = {}
+        for reader_id, factory in readers.items():
+            if isinstance(factory, str):
+                factory = (lambda port: lambda: PN532.PN532(port))(factory)
+            self._readers[reader_id] = _Reader(reader_id, factory)
+
+        self._events = queue.Queue(max_events)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._supervisor = None
+
+    def start(self):
+        for reader in self._readers.values():
+            self._start_worker(reader)
+        self._supervisor = threading.Thread(target=self._supervise, name='ReaderPool supervisor', daemon=True)
+        self._supervisor.start()
+
+    def stop(self):
+        self._stopping.set()
+        with self._lock:
+            for reader in self._readers.values():
+                self._close_reader(reader)
+        for reader in self._readers.values():
+            if reader.thread is not None:
+                reader.thread.join()
+        if self._supervisor is not None:
+            self._supervisor.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get(self, timeout=None):
+        """Return the next CardEvent from any reader, or None on timeout."""
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def events(self, timeout=None):
+        """Yield CardEvents as they arrive until the pool is stopped (or, with
+        a timeout, until no event arrives for timeout seconds).
+        """
+        while not self._stopping.is_set():
+            event = self.get(timeout if timeout is not None else 0.5)
+            if event is not None:
+                yield event
+            elif timeout is not None:
+                return
+
+    def stats(self):
+        """Return a dict of ReaderStats per reader ID."""
+        now = time.monotonic()
+        ret = {}
+        with self._lock:
+            for reader_id, reader in self._readers.items():
+                elapsed = now - reader.started if reader.started else 0.0
+                ret[reader_id] = ReaderStats(
+                    reader.thread is not None and reader.thread.is_alive(),
+                    reader.cards,
+                    reader.cards / elapsed if elapsed > 0 else 0.0,
+                    reader.restarts,
+                    reader.last_error,
+                    reader.dropped_events,
+                )
+        return ret
+
+    def _start_worker(self, reader):
+        with self._lock:
+            reader.generation += 1
+            reader.heartbeat = time.monotonic()
+            if not reader.started:
+                reader.started = reader.heartbeat
+            reader.thread = threading.Thread(target=self._run, args=(reader, reader.generation),
+                                             name='ReaderPool {}'.format(reader.reader_id), daemon=True)
+            reader.thread.start()
+
+    def _close_reader(self, reader):
+        pn532, reader.pn532 = reader.pn532, None
+        if pn532 is not None:
+            try:
+                pn532.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+    def _run(self, reader, generation):
+        def current():
+            return generation == reader.generation and not self._stopping.is_set()
+
+        try:
+            pn532 = reader.factory()
+            with self._lock:
+                if not current():
+                    pn532.close()
+                    return
+                reader.pn532 = pn532
+            pn532.begin()
+            pn532.SAM_configuration()
+
+            last_uid = None
+            while current():
+                reader.heartbeat = time.monotonic()
+                uid = pn532.read_passive_target(timeout=self.poll_timeout)
+                if uid in (None, "no_card"):
+                    last_uid = None
+                    continue
+                if uid == last_uid and not self.repeat:
+                    continue
+                last_uid = uid
+
+                result = self.on_card(pn532, uid) if self.on_card is not None else None
+                reader.heartbeat = time.monotonic()
+                reader.cards += 1
+                try:
+                    self._events.put_nowait(CardEvent(reader.reader_id, uid, time.time(), result))
+                except queue.Full:
+                    reader.dropped_events += 1
+        except Exception as e:  # pylint: disable=broad-except
+            if current():
+                reader.last_error = e
+        finally:
+            with self._lock:
+                if generation == reader.generation:
+                    self._close_reader(reader)
+
+    def _supervise(self):
+        while not self._stopping.wait(min(1.0, self.wedge_timeout / 4)):
+            now = time.monotonic()
+            for reader in self._readers.values():
+                alive = reader.thread.is_alive()
+                if alive and now - reader.heartbeat < self.wedge_timeout:
+                    continue
+                if not alive and now - reader.heartbeat < self.restart_delay:
+                    continue
+
+                # Dead or wedged: abandon the worker (closing its transport
+                # unblocks it) and start over with a fresh one.
+                with self._lock:
+                    if alive and reader.last_error is None:
+                        reader.last_error = RuntimeError('Reader stopped responding')
+                    reader.generation += 1
+                    self._close_reader(reader)
+                    reader.restarts += 1
+                self._start_worker(reader)
@@ -27,7 +27,10 @@ import argparse
 import binascii
 import string
 
+import ndef
 import PN532
+from cardsession import CardSession
+from keymanager import KeyManager
 
 
 CHARS_TO_PRINT = set(string.printable) - set(string.whitespace)
@@ -44,7 +47,18 @@ def printable(s):
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('com_port')
-    args = p.parse_args(['COM5'])
+    p.add_argument('--4k', dest='card_size', action='store_const', const=4096, default=1024,
+                   help='read a MiFare Classic 4K card')
+    p.add_argument('-k', '--key', action='append', type=bytes.fromhex,
+                   help='hex key to try as key A and key B, may be repeated (default: key B {})'.format(bytes(CARD_KEY).hex()))
+    p.add_argument('--ndef', action='store_true',
+                   help='decode the NDEF message (MAD layout; NFC Forum cards need -k a0a1a2a3a4a5 -k d3f7d3f7d3f7)')
+    p.add_argument('--fast', action='store_true',
+                   help='switch the serial link to the fastest baud rate that works (back to 115200 on exit)')
+    args = p.parse_args()
+
+    # With --key, find a working key per sector instead of using CARD_KEY.
+    keys = KeyManager(args.key) if args.key else None
 
     # Create an instance of the PN532 class.
     pn532 = PN532.PN532(args.com_port, 115200)
@@ -60,31 +74,56 @@ def main():
     ic, ver, rev, support = pn532.get_firmware_version()
     print('Found PN532 with firmware version: {}.{}'.format(ver, rev))
 
-    # Main loop to detect cards and read a block.
-    print('Waiting for MiFare card...')
-    while True:
-        # Check if a card is available to read.
-        uid = pn532.read_passive_target()
-
-        # Try again if no card is available.
-        if uid == 'no_card':
-            continue
-        print('Found card with UID: {:#x}'.format(int.from_bytes(uid, 'big')))
-
-        # Authenticate block 4 for reading with default key (0xFFFFFFFFFFFF).
-        for i in range(16):
-            if not pn532.mifare_classic_authenticate_block(uid, i, PN532.MIFARE_CMD_AUTH_B, CARD_KEY):
-                print('Failed to authenticate block {}'.format(i))
-                break
-
-            # Read block 4 data.
-            data = pn532.mifare_classic_read_block(i)
-            if data is None:
-                print('Failed to read block {}'.format(i))
-                continue
-            # Note that 16 bytes are returned, so only show the first 4 bytes for the block.
+    # Speed up the serial link; the PN532 keeps the new speed until it is
+    # switched back or powered off.
+    if args.fast:
+        print('Serial link at {} baud'.format(pn532.negotiate_baudrate()))
+
+    # Track the card in the field, so that a card left on the reader is only
+    # read (and printed) once per tap.
+    session = CardSession(pn532)
 
-            print("Block {:>2}: {} : {}".format(i, binascii.hexlify(data).decode(), printable(data.decode('latin1'))))
+    try:
+        # Main loop to detect cards and read a block.
+        print('Waiting for MiFare card...')
+        while True:
+            # Check if a card is available to read.
+            uid = session.poll()
+
+            # Try again if no card is available or it is still the same tap.
+            if uid is None or not session.arrived:
+                continue
+            print('Found card with UID: {:#x}'.format(int.from_bytes(uid, 'big')))
+
+            # Read the whole card, authenticating once per sector with the default
+            # key (0xFFFFFFFFFFFF) or whichever --key works.
+            image, failed = session.dump_card(PN532.MIFARE_CMD_AUTH_B, CARD_KEY, args.card_size, keys)
+            for sector in range(PN532.mifare_classic_sector_count(args.card_size)):
+                if sector in failed:
+                    print('Failed to read sector {}'.format(sector))
+                    continue
+                for i in PN532.mifare_classic_sector_blocks(sector):
+                    data = image[i * 16:i * 16 + 16]
+                    print("Block {:>3}: {} : {}".format(i, binascii.hexlify(data).decode(), printable(data.decode('latin1'))))
+
+            if args.ndef:
+                try:
+                    message = ndef.classic_message(image)
+                    records = ndef.decode_message(message) if message is not None else []
+                except ValueError as e:
+                    print('No NDEF message: {}'.format(e))
+                    continue
+                for record in records:
+                    if record.is_uri():
+                        print('NDEF URI: {}'.format(record.uri()))
+                    elif record.is_text():
+                        print('NDEF Text ({1}): {0}'.format(*record.text()))
+                    else:
+                        print('NDEF record: TNF {} type {!r}, {} bytes'.format(
+                            record.tnf, bytes(record.type), len(record.payload)))
+    finally:
+        if args.fast:
+            pn532.set_baudrate(115200)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,161 @@
+# Shadowed, batched register access for the PN532.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Register and GPIO settings applied in as few exchanges as possible.
+
+ReadRegister and WriteRegister take many addresses per frame.  RegisterShadow
+keeps the last known value of every register it has read or written, so a
+write that changes nothing is not sent at all, and apply() turns a profile
+(a dict of register addresses to values, or to (mask, value) pairs for
+some bits only) into at most one batched read, for the bits it does not know
+yet, and one batched write, for the registers that change:
+
+    LED, BUZZER = PN532.PN532_GPIO_P32, PN532.PN532_GPIO_P34
+    shadow = RegisterShadow(pn532)
+    shadow.apply({PN532.PN532_SFR_P3: gpio_pins(high=[LED, BUZZER])})  # tap feedback on
+    shadow.apply({PN532.PN532_SFR_P3: gpio_pins(low=[LED, BUZZER])})   # and off
+
+The P3 and P7 GPIO ports are registers too (PN532_SFR_P3, PN532_SFR_P7), so
+LEDs, a buzzer and CIU tuning can all change in the same exchange.  The
+shadow assumes nothing else writes the registers it holds; invalidate()
+forgets them after something might have (a reset, or a command that
+reconfigures the CIU).
+"""
+
+import threading
+
+from PN532 import PN532_MAX_READ_REGISTERS, PN532_MAX_WRITE_REGISTERS, PN532Error
+
+
+def gpio_pins(high=(), low=()):
+    """Return the (mask, value) that sets the high pins and clears the low
+    ones (bit numbers, like PN532_GPIO_P30) of a port and leaves the rest.
+    """
+    mask = value = 0
+    for pin in high:
+        mask |= 1 << pin
+        value |= 1 << pin
+    for pin in low:
+        mask |= 1 << pin
+    return mask, value
+
+
+class RegisterShadow:
+    """Shadow copies of PN532 registers in front of batched ReadRegister and
+    WriteRegister commands.  reads and writes count the frames sent and
+    skipped the register writes left out.  Methods return None or False when
+    a command fails, or pass on its PN532Error, after forgetting the
+    registers involved.
+    """
+
+    def __init__(self, pn532):
+        self.pn532 = pn532
+        self.reads = 0
+        self.writes = 0
+        self.skipped = 0
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, address):
+        return address in self._values
+
+    def invalidate(self, addresses=None):
+        """Forget the shadow copy of addresses (all registers by default)."""
+        with self._lock:
+            if addresses is None:
+                self._values.clear()
+            else:
+                self._forget(addresses)
+
+    def _read(self, addresses, timeout):
+        missing = [address for address in addresses if address not in self._values]
+        for i in range(0, len(missing), PN532_MAX_READ_REGISTERS):
+            chunk = missing[i:i + PN532_MAX_READ_REGISTERS]
+            self.reads += 1
+            try:
+                values = self.pn532.read_registers(chunk, timeout)
+            except PN532Error:
+                self._forget(chunk)
+                raise
+            if values is None:
+                return False
+            self._values.update(zip(chunk, values))
+        return True
+
+    def _write(self, changes, timeout):
+        for i in range(0, len(changes), PN532_MAX_WRITE_REGISTERS):
+            chunk = changes[i:i + PN532_MAX_WRITE_REGISTERS]
+            self.writes += 1
+            try:
+                ok = self.pn532.write_registers(chunk, timeout)
+            except PN532Error:
+                self._forget(address for address, value in chunk)
+                raise
+            if not ok:
+                self._forget(address for address, value in chunk)
+                return False
+            self._values.update(chunk)
+        return True
+
+    def _forget(self, addresses):
+        for address in addresses:
+            self._values.pop(address, None)
+
+    def read(self, addresses, refresh=False, timeout=1.0):
+        """Return a dict of the values of the registers at addresses, reading
+        the ones not in the shadow (all of them with refresh) in one batch.
+        """
+        with self._lock:
+            if refresh:
+                self._forget(addresses)
+            if not self._read(addresses, timeout):
+                return None
+            return {address: self._values[address] for address in addresses}
+
+    def apply(self, profile, force=False, timeout=1.0):
+        """Bring the registers to profile: a dict of addresses to values, or
+        to (mask, value) pairs changing only the mask bits.  Reads what it
+        needs to know of the masked registers, then writes those that change
+        (all of them with force), as few frames as possible each.  Returns
+        True on success.
+        """
+        with self._lock:
+            masked = [address for address, setting in profile.items() if isinstance(setting, tuple)]
+            if not self._read(masked, timeout):
+                return False
+
+            changes = []
+            for address, setting in profile.items():
+                if isinstance(setting, tuple):
+                    mask, value = setting
+                    value = (self._values[address] & ~mask | value & mask) & 0xFF
+                else:
+                    value = setting
+                if force or self._values.get(address) != value:
+                    changes.append((address, value))
+            self.skipped += len(profile) - len(changes)
+            if not changes:
+                return True
+
+            return self._write(changes, timeout)
@@ -0,0 +1,1012 @@
+# In-process PN532 simulator, usable as a PN532 transport.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Byte-accurate PN532 simulator.
+
+SimulatedPN532 is a PN532.Transport that parses the host's frames, answers
+them the way a PN532 on HSU would (ACK, then a response frame) and models the
+time spent on the wire at the configured baud rate plus the chip's own
+processing latency.  Virtual cards are placed in its RF field:
+
+    sim = SimulatedPN532(cards=[VirtualMifareClassic(b'\\x01\\x02\\x03\\x04')])
+    pn532 = PN532.PN532(transport=sim)
+"""
+
+import math
+import os
+import select
+import threading
+import time
+
+try:
+    import tty
+except ImportError:  # No termios (Windows): PtyBridge is unavailable.
+    tty = None
+
+import PN532
+from PN532 import mifare_classic_block_sector, mifare_classic_is_trailer, mifare_classic_sector_blocks
+
+
+DEFAULT_KEY = b'\xFF\xFF\xFF\xFF\xFF\xFF'
+DEFAULT_ACCESS_BITS = b'\xFF\x07\x80\x69'
+
+# PN532 status byte values (first byte of an InDataExchange response).
+STATUS_OK = 0x00
+STATUS_TIMEOUT = 0x01
+STATUS_MIFARE_AUTH_ERROR = 0x14
+STATUS_WRONG_CONTEXT = 0x27
+STATUS_RELEASED = PN532.PN532_STATUS_RELEASED
+
+
+class VirtualMifareClassic:
+    """A MIFARE Classic 1K or 4K card.  Access bits are not enforced: any
+    block can be read or written once its sector is authenticated with either
+    of the sector's keys.  Value blocks take increment, decrement, restore and
+    transfer.
+    """
+
+    brty = PN532.PN532_MIFARE_ISO14443A
+    autopoll_types = (PN532.PN532_AUTOPOLL_GENERIC_106, PN532.PN532_AUTOPOLL_MIFARE)
+
+    def __init__(self, uid=b'\xDE\xAD\xBE\xEF', size=1024, key_a=DEFAULT_KEY, key_b=DEFAULT_KEY, data=None):
+        assert size in (1024, 4096), 'Card size must be 1024 or 4096 bytes.'
+        self.uid = bytes(uid)
+        self.size = size
+        self.sens_res = b'\x00\x04' if size == 1024 else b'\x00\x02'
+        self.sel_res = 0x08 if size == 1024 else 0x18
+        self.ats = None
+
+        if data is not None:
+            assert len(data) == size, 'Card data must be {} bytes.'.format(size)
+            self.memory = bytearray(data)
+        else:
+            self.memory = bytearray(size)
+            if len(self.uid) == 4:
+                bcc = self.uid[0] ^ self.uid[1] ^ self.uid[2] ^ self.uid[3]
+                manufacturer = self.uid + bytes([bcc, self.sel_res]) + self.sens_res[::-1]
+            else:
+                manufacturer = self.uid + bytes([self.sel_res]) + self.sens_res[::-1]
+            self.memory[0:len(manufacturer)] = manufacturer
+            for block in range(size // 16):
+                if mifare_classic_is_trailer(block):
+                    self.memory[block * 16:block * 16 + 16] = bytes(key_a) + DEFAULT_ACCESS_BITS + bytes(key_b)
+
+        self.halted = False
+        self._auth_sector = None
+        self._transfer_buffer = None
+
+    @staticmethod
+    def trailer_of(block):
+        return mifare_classic_sector_blocks(mifare_classic_block_sector(block))[-1]
+
+    def _block(self, block):
+        return self.memory[block * 16:block * 16 + 16]
+
+    def activate(self):
+        """Bring the card to the active state, as a REQA/WUPA + select does."""
+        self.halted = False
+        self._auth_sector = None
+        self._transfer_buffer = None
+
+    def target_record(self, tg):
+        """The card's target record in an InListPassiveTarget response."""
+        record = bytes([tg]) + self.sens_res + bytes([self.sel_res, len(self.uid)]) + self.uid
+        if self.ats is not None:
+            record += self.ats
+        return record
+
+    def exchange(self, data):
+        """Handle a MIFARE command sent through InDataExchange.  Returns a
+        (status, response bytes) tuple.
+        """
+        if self.halted:
+            return STATUS_TIMEOUT, b''
+
+        cmd = data[0]
+        block = data[1] if len(data) > 1 else 0
+        if block * 16 >= self.size:
+            return STATUS_TIMEOUT, b''
+
+        if cmd in (PN532.MIFARE_CMD_AUTH_A, PN532.MIFARE_CMD_AUTH_B):
+            trailer = self._block(self.trailer_of(block))
+            key = trailer[0:6] if cmd == PN532.MIFARE_CMD_AUTH_A else trailer[10:16]
+            if bytes(data[2:8]) != key or bytes(data[8:12]) != self.uid[:4]:
+                self.halted = True
+                self._auth_sector = None
+                return STATUS_MIFARE_AUTH_ERROR, b''
+            self._auth_sector = mifare_classic_block_sector(block)
+            self._transfer_buffer = None
+            return STATUS_OK, b''
+
+        if self._auth_sector != mifare_classic_block_sector(block):
+            self.halted = True
+            return STATUS_MIFARE_AUTH_ERROR, b''
+
+        if cmd == PN532.MIFARE_CMD_READ:
+            ret = bytearray(self._block(block))
+            if mifare_classic_is_trailer(block):
+                ret[0:6] = bytes(6)  # Key A is never readable.
+            return STATUS_OK, bytes(ret)
+
+        if cmd == PN532.MIFARE_CMD_WRITE:
+            if len(data) != 18:
+                return STATUS_WRONG_CONTEXT, b''
+            self.memory[block * 16:block * 16 + 16] = data[2:18]
+            return STATUS_OK, b''
+
+        if cmd in (PN532.MIFARE_CMD_INCREMENT, PN532.MIFARE_CMD_DECREMENT, PN532.MIFARE_CMD_STORE):
+            if len(data) != 6:
+                return STATUS_WRONG_CONTEXT, b''
+            try:
+                value, address = PN532.mifare_classic_parse_value_block(self._block(block))
+            except ValueError:
+                self.halted = True
+                return STATUS_TIMEOUT, b''
+            delta = int.from_bytes(data[2:6], 'little')
+            if cmd == PN532.MIFARE_CMD_INCREMENT:
+                value += delta
+            elif cmd == PN532.MIFARE_CMD_DECREMENT:
+                value -= delta
+            # The value wraps around as a signed 32-bit integer.
+            self._transfer_buffer = (((value + 2 ** 31) % 2 ** 32) - 2 ** 31, address)
+            return STATUS_OK, b''
+
+        if cmd == PN532.MIFARE_CMD_TRANSFER:
+            if self._transfer_buffer is None:
+                self.halted = True
+                return STATUS_TIMEOUT, b''
+            self.memory[block * 16:block * 16 + 16] = PN532.mifare_classic_value_block(*self._transfer_buffer)
+            self._transfer_buffer = None
+            return STATUS_OK, b''
+
+        self.halted = True
+        return STATUS_TIMEOUT, b''
+
+
+class VirtualUltralight:
+    """A MIFARE Ultralight or NTAG21x tag (model is a PN532.ULTRALIGHT_TYPES
+    name or 'MIFARE Ultralight').  READ, WRITE, GET_VERSION and FAST_READ are
+    supported (the last two not by plain Ultralight); lock bits and passwords
+    are not enforced.  A command the tag does not accept makes it NAK and go
+    idle, like the real thing.
+    """
+
+    brty = PN532.PN532_MIFARE_ISO14443A
+    autopoll_types = (PN532.PN532_AUTOPOLL_GENERIC_106,)
+
+    def __init__(self, uid=b'\x04\x11\x22\x33\x44\x55\x66', model='NTAG216', data=None):
+        assert len(uid) == 7, 'Ultralight and NTAG UIDs are 7 bytes.'
+        self.uid = bytes(uid)
+        self.version = None
+        if model == PN532.ULTRALIGHT.name:
+            self.tag_type = PN532.ULTRALIGHT
+        else:
+            key = next(k for k, t in PN532.ULTRALIGHT_TYPES.items() if t.name == model)
+            self.tag_type = PN532.ULTRALIGHT_TYPES[key]
+            self.version = bytes([0x00, 0x04, key[0], 0x02 if key[0] == 0x04 else 0x01, 0x01, 0x00, key[1], 0x03])
+        self.sens_res = b'\x00\x44'
+        self.sel_res = 0x00
+        self.ats = None
+
+        size = self.tag_type.pages * 4
+        if data is not None:
+            assert len(data) == size, 'Tag data must be {} bytes.'.format(size)
+            self.memory = bytearray(data)
+        else:
+            self.memory = bytearray(size)
+            uid = self.uid
+            self.memory[0:4] = uid[0:3] + bytes([0x88 ^ uid[0] ^ uid[1] ^ uid[2]])
+            self.memory[4:9] = uid[3:7] + bytes([uid[3] ^ uid[4] ^ uid[5] ^ uid[6]])
+            # Capability container: NDEF, version 1.0, user memory size / 8.
+            self.memory[12:16] = bytes([0xE1, 0x10, (self.tag_type.user_end - 4) * 4 // 8, 0x00])
+            self.memory[16:19] = b'\x03\x00\xFE'  # Empty NDEF TLV
+
+        self.halted = False
+
+    def activate(self):
+        self.halted = False
+
+    def target_record(self, tg):
+        return bytes([tg]) + self.sens_res + bytes([self.sel_res, len(self.uid)]) + self.uid
+
+    def _nak(self):
+        self.halted = True
+        return STATUS_TIMEOUT, b''
+
+    def exchange(self, data):
+        """Handle a command sent through InDataExchange or InCommunicateThru.
+        Returns a (status, response bytes) tuple.
+        """
+        if self.halted or not data:
+            return STATUS_TIMEOUT, b''
+
+        pages = self.tag_type.pages
+        cmd = data[0]
+        if cmd == PN532.MIFARE_CMD_READ and len(data) == 2 and data[1] < pages:
+            # Four pages, rolling over to page 0 at the end of memory.
+            return STATUS_OK, bytes((self.memory * 2)[data[1] * 4:data[1] * 4 + 16])
+
+        if cmd == PN532.MIFARE_ULTRALIGHT_CMD_WRITE and len(data) == 6 and 2 <= data[1] < pages:
+            self.memory[data[1] * 4:data[1] * 4 + 4] = data[2:6]
+            return STATUS_OK, b''
+
+        if self.version is None:
+            return self._nak()
+
+        if cmd == PN532.NTAG_CMD_GET_VERSION and len(data) == 1:
+            return STATUS_OK, self.version
+
+        if cmd == PN532.NTAG_CMD_FAST_READ and len(data) == 3 and data[1] <= data[2] < pages:
+            return STATUS_OK, bytes(self.memory[data[1] * 4:data[2] * 4 + 4])
+
+        return self._nak()
+
+
+class VirtualIsoDepCard:
+    """An ISO14443-4 (ISO-DEP) smart card answering ISO7816-4 APDUs, short or
+    extended length.  applications maps application IDs to their data:
+    SELECT by name (00 A4 04 00) picks one, and READ BINARY and UPDATE BINARY
+    work on its data (a bytearray).  With max_response, longer answers are
+    handed out that many bytes at a time, the rest waiting for GET RESPONSE
+    (status word 61XX) as some cards do.
+    """
+
+    brty = PN532.PN532_MIFARE_ISO14443A
+    autopoll_types = (PN532.PN532_AUTOPOLL_GENERIC_106, PN532.PN532_AUTOPOLL_ISO14443_4A)
+
+    def __init__(self, uid=b'\x04\x52\x61\x72\x01\x12\x80', applications=None, max_response=None,
+                 ats=b'\x06\x75\x77\x81\x02\x80'):
+        self.uid = bytes(uid)
+        self.sens_res = b'\x03\x44'
+        self.sel_res = 0x20
+        self.ats = bytes(ats)
+        self.applications = {bytes(aid): bytearray(data) for aid, data in (applications or {}).items()}
+        self.max_response = max_response
+        self.selected = None
+        self._pending = b''
+
+    def activate(self):
+        self.selected = None
+        self._pending = b''
+
+    def target_record(self, tg):
+        return bytes([tg]) + self.sens_res + bytes([self.sel_res, len(self.uid)]) + self.uid + self.ats
+
+    @staticmethod
+    def _parse(apdu):
+        """Split a command APDU into its data and Le (None if absent)."""
+        body = apdu[4:]
+        if not body:
+            return b'', None
+        if len(body) == 1:
+            return b'', body[0] or 256
+        if body[0]:
+            lc, start, le_size, le_max = body[0], 1, 1, 256
+        elif len(body) == 3:
+            return b'', int.from_bytes(body[1:3], 'big') or 65536
+        else:
+            lc, start, le_size, le_max = int.from_bytes(body[1:3], 'big'), 3, 2, 65536
+        rest = body[start + lc:]
+        if len(body) < start + lc or len(rest) not in (0, le_size):
+            raise ValueError('Bad APDU length')
+        return body[start:start + lc], (int.from_bytes(rest, 'big') or le_max) if rest else None
+
+    def apdu(self, apdu):
+        """Handle a command APDU and return the response APDU."""
+        if len(apdu) < 4:
+            return b'\x67\x00'
+        cla, ins, p1, p2 = apdu[0:4]
+        try:
+            data, le = self._parse(apdu)
+        except ValueError:
+            return b'\x67\x00'
+        if cla != 0x00:
+            return b'\x6E\x00'
+
+        if ins == PN532.ISO7816_INS_GET_RESPONSE:
+            if not self._pending:
+                return b'\x69\x85'
+            out, self._pending = self._pending[:le or 256], self._pending[le or 256:]
+            return self._answer(out, allow_chaining=False)
+        self._pending = b''
+
+        if ins == PN532.ISO7816_INS_SELECT:
+            if p1 != 0x04:
+                return b'\x6A\x86'
+            if bytes(data) not in self.applications:
+                return b'\x6A\x82'
+            self.selected = bytes(data)
+            return b'\x90\x00'
+
+        if ins in (PN532.ISO7816_INS_READ_BINARY, PN532.ISO7816_INS_UPDATE_BINARY):
+            if self.selected is None:
+                return b'\x69\x86'
+            memory = self.applications[self.selected]
+            offset = ((p1 & 0x7F) << 8) | p2
+            if ins == PN532.ISO7816_INS_READ_BINARY:
+                if offset > len(memory):
+                    return b'\x6B\x00'
+                return self._answer(memory[offset:offset + (le or 256)])
+            if offset + len(data) > len(memory):
+                return b'\x6A\x84'
+            memory[offset:offset + len(data)] = data
+            return b'\x90\x00'
+
+        return b'\x6D\x00'
+
+    def _answer(self, out, allow_chaining=True):
+        if allow_chaining and self.max_response is not None and len(out) > self.max_response:
+            self._pending = bytes(out[self.max_response:])
+            out = out[:self.max_response]
+        if self._pending:
+            return bytes(out) + bytes([0x61, min(len(self._pending), 256) & 0xFF])
+        return bytes(out) + b'\x90\x00'
+
+
+class VirtualInitiator:
+    """A reader (or P2P initiator) that activates the simulated PN532 as a
+    target.  script is a generator yielding the commands to send, each yield
+    evaluating to the target's answer; the initiator releases the target when
+    the script ends.
+    """
+
+    # ATR_REQ a P2P initiator opens with (NFCID3i, DIDi, BSi, BRi, PPi).
+    ATR_REQ = b'\xD4\x00' + bytes(range(10)) + b'\x00\x00\x00\x32'
+
+    def __init__(self, script):
+        self.script = script
+        self.commands = 0
+
+    def start(self):
+        """Return the first command, or None if there is none."""
+        return self._next(None)
+
+    def answer(self, data):
+        """Take the answer to the last command and return the next command,
+        or None once the script is done.
+        """
+        return self._next(bytes(data))
+
+    def _next(self, data):
+        try:
+            command = next(self.script) if data is None else self.script.send(data)
+        except StopIteration:
+            return None
+        self.commands += 1
+        return bytes(command)
+
+
+def type4_reader(result, le=0xF6):
+    """VirtualInitiator script reading the NDEF message off a Type 4 tag the
+    way a phone does (select the application, read the capability container
+    and the NDEF file le bytes at a time).  The message, or None if the tag
+    would not give it, is appended to result.
+    """
+    def ok(answer):
+        return answer[-2:] == b'\x90\x00'
+
+    if not ok((yield PN532.encode_apdu(0x00, PN532.ISO7816_INS_SELECT, 0x04, 0x00,
+                                       bytes.fromhex('D2760000850101'), le=256))):
+        result.append(None)
+        return
+    if not ok((yield PN532.encode_apdu(0x00, PN532.ISO7816_INS_SELECT, 0x00, 0x0C, b'\xE1\x03'))):
+        result.append(None)
+        return
+    cc = yield PN532.encode_apdu(0x00, PN532.ISO7816_INS_READ_BINARY, 0x00, 0x00, le=15)
+    if not ok(cc) or len(cc) < 17:
+        result.append(None)
+        return
+    le = min(le, int.from_bytes(cc[3:5], 'big'))
+    if not ok((yield PN532.encode_apdu(0x00, PN532.ISO7816_INS_SELECT, 0x00, 0x0C, cc[9:11]))):
+        result.append(None)
+        return
+    nlen = yield PN532.encode_apdu(0x00, PN532.ISO7816_INS_READ_BINARY, 0x00, 0x00, le=2)
+    if not ok(nlen):
+        result.append(None)
+        return
+    end = 2 + int.from_bytes(nlen[:2], 'big')
+    message = bytearray()
+    offset = 2
+    while offset < end:
+        count = min(le, end - offset)
+        chunk = yield PN532.encode_apdu(0x00, PN532.ISO7816_INS_READ_BINARY, offset >> 8, offset & 0xFF, le=count)
+        if not ok(chunk):
+            result.append(None)
+            return
+        message += chunk[:-2]
+        offset += count
+    result.append(bytes(message))
+
+
+class SimulatedPN532(PN532.Transport):
+    """A simulated PN532 on an HSU link.
+
+    latency is the chip's processing time for a command (after the ACK) and
+    can be overridden per command code with command_latency.  baudrate sets
+    how long frames take on the wire in both directions (8N1, ten bits per
+    byte).  The chip's speed changes with SetSerialBaudRate and the host's
+    through the baudrate property, up to host_max_baudrate; while the two
+    differ, everything on the wire is garbled.  The simulator is safe to close
+    from another thread while a read is blocked on it.
+
+    Cards can be added and removed from other threads while the host waits:
+    a pending InListPassiveTarget or InAutoPoll is answered as soon as a card
+    shows up, like the real chip would.  passive_activation_retries plays the
+    role of RFConfiguration's MxRtyPassiveActivation (0xFF retries forever).
+    Setting unresponsive makes the chip ignore everything the host sends, as
+    a wedged or unplugged reader would.  For noisy links, drop_commands makes
+    the chip ignore that many of the next command frames and
+    corrupt_responses garbles the checksum of that many of the next response
+    frames (a NACK from the host gets the response sent again).
+
+    PowerDown puts the chip to sleep until one of its wake-up sources: on
+    HSU, a 0x55 byte, after which everything that arrives within wake_time
+    is lost; with PN532_WAKE_RF, a card coming into the field.  time_asleep
+    adds up the time spent powered down.
+
+    For target mode, set_initiator() brings a VirtualInitiator into the
+    field: a pending TgInitAsTarget is answered with its activation, and
+    TgGetData and TgSetData carry its commands and their answers.
+    """
+
+    # Time the chip spends on one passive activation attempt.
+    PASSIVE_ACTIVATION_TIME = 0.005
+
+    def __init__(self, cards=(), baudrate=115200, latency=0.002, ack_latency=0.0002,
+                 command_latency=None, firmware=(0x32, 0x01, 0x06, 0x07), host_max_baudrate=None,
+                 wake_time=PN532.PN532_HSU_WAKE_DELAY):
+        self.cards = list(cards)
+        self.chip_baudrate = baudrate
+        self.host_max_baudrate = host_max_baudrate
+        self._baudrate = baudrate
+        self._next_baudrate = None
+        self.latency = latency
+        self.ack_latency = ack_latency
+        self.command_latency = dict(command_latency or {})
+        self.firmware = bytes(firmware)
+        self.wake_time = wake_time
+
+        self.sam_configured = False
+        self.passive_activation_retries = 0xFF
+        self.rf_field = True
+        # Register values by address; unlisted registers read 0.
+        self.registers = {PN532.PN532_SFR_P3: 0xFF, PN532.PN532_SFR_P7: 0xFF}
+        self.rf_timings = (0x00, PN532.PN532_RFCFG_TIMEOUT_102MS, PN532.PN532_RFCFG_TIMEOUT_51MS)
+        self.asleep = False
+        self.wake_sources = 0
+        self.wakeups = 0
+        self._asleep_since = None
+        self._time_asleep = 0.0
+        self._awake_at = 0.0  # bytes arriving before this are lost
+        self._host_line_free_at = 0.0
+        self.unresponsive = False
+        self.drop_commands = 0
+        self.corrupt_responses = 0
+        self.targets = {}
+        self.current_target = None
+        self.commands_handled = 0
+        self._chain_out = bytearray()  # ISO-DEP command parts from the host
+        self._chain_in = b''  # ISO-DEP answer not yet handed to the host
+        self.parameters = 0
+        self.initiator = None
+        self._initiator_active = False
+        self._initiator_command = None  # next command for TgGetData
+
+        self._commands = {
+            PN532.PN532_COMMAND_GETFIRMWAREVERSION: self._get_firmware_version,
+            PN532.PN532_COMMAND_SAMCONFIGURATION: self._sam_configuration,
+            PN532.PN532_COMMAND_INLISTPASSIVETARGET: self._in_list_passive_target,
+            PN532.PN532_COMMAND_INDATAEXCHANGE: self._in_data_exchange,
+            PN532.PN532_COMMAND_INAUTOPOLL: self._in_auto_poll,
+            PN532.PN532_COMMAND_SETSERIALBAUDRATE: self._set_serial_baudrate,
+            PN532.PN532_COMMAND_INCOMMUNICATETHRU: self._in_communicate_thru,
+            PN532.PN532_COMMAND_INSELECT: self._in_select,
+            PN532.PN532_COMMAND_INRELEASE: self._in_release,
+            PN532.PN532_COMMAND_SETPARAMETERS: self._set_parameters,
+            PN532.PN532_COMMAND_TGINITASTARGET: self._tg_init_as_target,
+            PN532.PN532_COMMAND_TGGETDATA: self._tg_get_data,
+            PN532.PN532_COMMAND_TGSETDATA: self._tg_set_data,
+            PN532.PN532_COMMAND_READREGISTER: self._read_register,
+            PN532.PN532_COMMAND_WRITEREGISTER: self._write_register,
+            PN532.PN532_COMMAND_READGPIO: self._read_gpio,
+            PN532.PN532_COMMAND_WRITEGPIO: self._write_gpio,
+            PN532.PN532_COMMAND_POWERDOWN: self._power_down,
+            PN532.PN532_COMMAND_RFCONFIGURATION: self._rf_configuration,
+        }
+
+        self._host_parser = PN532.FrameParser()
+        self._builder = PN532.FrameBuilder()
+        self._pending = []  # [ready_at, bytes] in delivery order
+        self._line_free_at = 0.0
+        self._waiting = None  # (command, params, queued empty answer) while polling
+        self._last_response = None
+        self._cond = threading.Condition()
+        self._closed = False
+
+    # Virtual RF field
+
+    def add_card(self, card):
+        with self._cond:
+            self.cards.append(card)
+            if self.asleep and self.wake_sources & PN532.PN532_WAKE_RF:
+                self._wake_up(time.monotonic())
+            self._wake()
+
+    def remove_card(self, card):
+        # The PN532 keeps the target in its list; exchanges with it time out.
+        with self._cond:
+            self.cards.remove(card)
+
+    def set_initiator(self, initiator):
+        """Bring initiator into the field (None takes the current one away)."""
+        with self._cond:
+            self.initiator = initiator
+            self._initiator_active = False
+            self._initiator_command = None
+            if initiator is not None:
+                self._wake()
+
+    @property
+    def time_asleep(self):
+        with self._cond:
+            if self.asleep:
+                return self._time_asleep + time.monotonic() - self._asleep_since
+            return self._time_asleep
+
+    def _wake_up(self, at):
+        self.asleep = False
+        self.wakeups += 1
+        self._time_asleep += at - self._asleep_since
+        self._awake_at = at + self.wake_time
+
+    def _wake(self):
+        """Answer the command that has been polling for something in the field."""
+        if self._waiting is None:
+            return
+        now = time.monotonic()
+        command, params, give_up = self._waiting
+        if give_up is not None:
+            if give_up[0] <= now:
+                return
+            self._pending.remove(give_up)
+            self._line_free_at = self._pending[-1][0] if self._pending else now
+        self._respond(command, params, now)
+        self._cond.notify_all()
+
+    # Transport interface
+
+    def _byte_time(self):
+        return 10.0 / self.chip_baudrate
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        if self.host_max_baudrate is not None and baudrate > self.host_max_baudrate:
+            raise ValueError('Host serial port cannot do {} baud'.format(baudrate))
+        with self._cond:
+            self._baudrate = baudrate
+
+    def write(self, data):
+        with self._cond:
+            if self._closed:
+                raise OSError('Simulated PN532 is closed')
+            if self._baudrate != self.chip_baudrate:
+                # The chip only sees framing errors.
+                return
+            now = time.monotonic()
+            byte_time = self._byte_time()
+            start = max(now, self._host_line_free_at)
+            self._host_line_free_at = received_at = start + len(data) * byte_time
+            if self.asleep:
+                # Only a 0x55 byte on HSU wakes the chip.
+                wake = bytes(data).find(b'\x55') if self.wake_sources & PN532.PN532_WAKE_HSU else -1
+                if wake < 0:
+                    return
+                self._wake_up(start + (wake + 1) * byte_time)
+            if start < self._awake_at:
+                # Still waking up: the bytes are lost.
+                data = data[math.ceil((self._awake_at - start) / byte_time):]
+            self._host_parser.feed(data)
+            self._process(received_at)
+            self._cond.notify_all()
+
+    def read(self, size, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise OSError('Simulated PN532 is closed')
+                now = time.monotonic()
+                buf = self._take_ready(size, now)
+                if buf and self._baudrate != self.chip_baudrate:
+                    buf = b'\xFF' * len(buf)
+                if buf or (deadline is not None and now >= deadline):
+                    return buf
+                wait = self._pending[0][0] - now if self._pending else None
+                if deadline is not None:
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(wait)
+
+    @property
+    def in_waiting(self):
+        now = time.monotonic()
+        with self._cond:
+            return sum(len(buf) for ready_at, buf in self._pending if ready_at <= now)
+
+    def reset_input_buffer(self):
+        now = time.monotonic()
+        with self._cond:
+            self._pending = [p for p in self._pending if p[0] > now]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _take_ready(self, size, now):
+        out = bytearray()
+        while self._pending and self._pending[0][0] <= now and len(out) < size:
+            ready_at, buf = self._pending[0]
+            take = size - len(out)
+            out += buf[:take]
+            if len(buf) > take:
+                self._pending[0][1] = buf[take:]
+            else:
+                self._pending.pop(0)
+        return bytes(out)
+
+    def _send(self, not_before, frame):
+        """Queue frame to arrive at the host after it has been clocked out.
+        Returns the queue entry, [arrival time, frame].
+        """
+        start = max(not_before, self._line_free_at)
+        self._line_free_at = start + len(frame) * self._byte_time()
+        entry = [self._line_free_at, frame]
+        self._pending.append(entry)
+        return entry
+
+    # Chip
+
+    def _process(self, now):
+        """Consume complete host frames and queue the chip's answers."""
+        for frame in self._host_parser:
+            if self.unresponsive:
+                continue
+            if frame.kind == PN532.FRAME_ACK:
+                # ACK from the host aborts whatever the chip is doing, or
+                # confirms a SetSerialBaudRate.
+                self._pending = [p for p in self._pending if p[0] <= now]
+                self._waiting = None
+                if self._next_baudrate is not None:
+                    self.chip_baudrate, self._next_baudrate = self._next_baudrate, None
+                continue
+            if frame.kind == PN532.FRAME_NACK:
+                # NACK from the host asks for the last response again.
+                if self._last_response is not None:
+                    self._send_garbled(now, self._last_response)
+                continue
+            data = frame.data
+            if frame.kind != PN532.FRAME_INFO or len(data) < 2 or data[0] != PN532.PN532_HOSTTOPN532:
+                continue
+            if self.drop_commands:
+                self.drop_commands -= 1
+                continue
+
+            ack_sent = self._send(now + self.ack_latency, PN532.PN532_ACK_FRAME)[0]
+            self._handle_command(data[1], data[2:], ack_sent)
+
+    def _handle_command(self, command, params, ack_sent):
+        self._waiting = None
+        self._next_baudrate = None
+        if command not in self._commands:
+            # Syntax error frame, as the PN532 sends for unknown commands.
+            self._send(ack_sent, b'\x00\x00\xFF\x01\xFF\x7F\x81\x00')
+            return
+        self.commands_handled += 1
+        self._respond(command, params, ack_sent)
+
+    def _respond(self, command, params, not_before):
+        response = self._commands[command](params)
+        if response is None:
+            # Nothing in the field: keep polling until a card is added, or
+            # answer "no target" once the chip gives up.
+            give_up = self._poll_time(command, params)
+            if give_up is not None:
+                give_up = self._send_response(command, b'\x00', not_before + give_up)
+            self._waiting = (command, params, give_up)
+            return
+        self._send_response(command, response, not_before + self.command_latency.get(command, self.latency))
+
+    def _send_response(self, command, response, not_before):
+        frame = self._builder.build(PN532.PN532_PN532TOHOST, command + 1, (response,))
+        self._last_response = bytes(frame)
+        return self._send_garbled(not_before, self._last_response)
+
+    def _send_garbled(self, not_before, frame):
+        """_send, breaking the frame's checksum if corrupt_responses says so."""
+        if self.corrupt_responses:
+            self.corrupt_responses -= 1
+            frame = bytearray(frame)
+            frame[-2] ^= 0xFF
+        return self._send(not_before, bytes(frame))
+
+    def _poll_time(self, command, params):
+        """How long the chip polls for a card before giving up, None for ever."""
+        if command == PN532.PN532_COMMAND_TGINITASTARGET:
+            return None
+        if command == PN532.PN532_COMMAND_INAUTOPOLL:
+            if params[0] == PN532.PN532_AUTOPOLL_ENDLESS:
+                return None
+            return params[0] * params[1] * 0.15 * len(params[2:])
+        if self.passive_activation_retries == 0xFF:
+            return None
+        return (self.passive_activation_retries + 1) * self.PASSIVE_ACTIVATION_TIME
+
+    def _get_firmware_version(self, params):
+        return self.firmware
+
+    def _sam_configuration(self, params):
+        self.sam_configured = True
+        return b''
+
+    def _set_serial_baudrate(self, params):
+        # Takes effect once the host has acknowledged the response.
+        self._next_baudrate = PN532.PN532_SERIAL_BAUDRATES[params[0]]
+        return b''
+
+    def _in_list_passive_target(self, params):
+        max_tg, brty = params[0], params[1]
+        cards = [card for card in self.cards if card.brty == brty][:max_tg]
+        if not cards:
+            return None
+
+        self.targets = {}
+        self.current_target = 1
+        self._chain_out = bytearray()
+        self._chain_in = b''
+        response = bytearray([len(cards)])
+        for tg, card in enumerate(cards, 1):
+            card.activate()
+            self.targets[tg] = card
+            response += card.target_record(tg)
+        return bytes(response)
+
+    def _in_auto_poll(self, params):
+        # Report up to two targets, each as the first requested type it matches.
+        found = []
+        for card in self.cards:
+            for target_type in params[2:]:
+                if target_type in card.autopoll_types:
+                    found.append((target_type, card))
+                    break
+        if not found:
+            return None
+
+        self.targets = {}
+        self.current_target = 1
+        self._chain_out = bytearray()
+        self._chain_in = b''
+        response = bytearray([0])
+        for tg, (target_type, card) in enumerate(found[:2], 1):
+            card.activate()
+            self.targets[tg] = card
+            record = card.target_record(tg)
+            response[0] += 1
+            response += bytes([target_type, len(record)]) + record
+        return bytes(response)
+
+    def _in_data_exchange(self, params):
+        card = self.targets.get(params[0] & 0x0F)
+        if card is None:
+            return bytes([STATUS_WRONG_CONTEXT])
+        self.current_target = params[0] & 0x0F
+        if card not in self.cards:
+            return bytes([STATUS_TIMEOUT])
+        if isinstance(card, VirtualIsoDepCard):
+            return self._iso_dep_exchange(card, params[0] & PN532.PN532_MI, params[1:])
+        status, response = card.exchange(params[1:])
+        return bytes([status]) + response
+
+    def _iso_dep_exchange(self, card, more, data):
+        # The chip collects chained parts until one comes without MI, and
+        # hands a long answer out in parts, the next one for every
+        # InDataExchange without data.
+        if self._chain_in and not more and not data and not self._chain_out:
+            out, self._chain_in = self._chain_in[:PN532.PN532_MAX_EXCHANGE_DATA], \
+                self._chain_in[PN532.PN532_MAX_EXCHANGE_DATA:]
+            return bytes([STATUS_OK | (PN532.PN532_MI if self._chain_in else 0)]) + out
+        self._chain_out += data
+        if more:
+            return bytes([STATUS_OK])
+        apdu, self._chain_out = bytes(self._chain_out), bytearray()
+        self._chain_in = card.apdu(apdu)
+        return self._iso_dep_exchange(card, 0, b'')
+
+    def _in_select(self, params):
+        # Re-activates the target, which fails once it has left the field.
+        tg = params[0] & 0x0F
+        card = self.targets.get(tg)
+        if card is None:
+            return bytes([STATUS_WRONG_CONTEXT])
+        if card not in self.cards:
+            return bytes([STATUS_TIMEOUT])
+        card.activate()
+        self.current_target = tg
+        self._chain_out = bytearray()
+        self._chain_in = b''
+        return bytes([STATUS_OK])
+
+    def _in_release(self, params):
+        tg = params[0] & 0x0F
+        if tg == 0:
+            self.targets = {}
+        elif self.targets.pop(tg, None) is None:
+            return bytes([STATUS_WRONG_CONTEXT])
+        if self.current_target not in self.targets:
+            self.current_target = None
+        return bytes([STATUS_OK])
+
+    def _set_parameters(self, params):
+        self.parameters = params[0]
+        return b''
+
+    def _read_register(self, params):
+        return bytes(self.registers.get((params[i] << 8) | params[i + 1], 0x00) for i in range(0, len(params) - 1, 2))
+
+    def _write_register(self, params):
+        for i in range(0, len(params) - 2, 3):
+            self.registers[(params[i] << 8) | params[i + 1]] = params[i + 2]
+        return b''
+
+    def _read_gpio(self, params):
+        # I0 and I1 both low select HSU.
+        return bytes([self.registers[PN532.PN532_SFR_P3] & 0x3F, self.registers[PN532.PN532_SFR_P7] & 0x06, 0x00])
+
+    def _write_gpio(self, params):
+        for address, value, pins in ((PN532.PN532_SFR_P3, params[0], 0x3F), (PN532.PN532_SFR_P7, params[1], 0x06)):
+            if value & PN532.PN532_GPIO_VALIDATIONBIT:
+                self.registers[address] = self.registers[address] & ~pins | value & pins
+        return b''
+
+    def _power_down(self, params):
+        # The chip answers, then sleeps.
+        self.wake_sources = params[0]
+        self.asleep = True
+        self._asleep_since = time.monotonic()
+        return bytes([STATUS_OK])
+
+    def _rf_configuration(self, params):
+        item, data = params[0], params[1:]
+        if item == PN532.PN532_RFCFG_FIELD:
+            self.rf_field = bool(data[0] & 0x01)
+        elif item == PN532.PN532_RFCFG_TIMINGS:
+            self.rf_timings = tuple(data[:3])
+        elif item == PN532.PN532_RFCFG_MAX_RETRIES:
+            self.passive_activation_retries = data[2]
+        return b''
+
+    def _tg_init_as_target(self, params):
+        # Waits for an initiator.  An emulated ISO14443-4 card gets the
+        # reader's first command (the chip answers RATS itself); a P2P target
+        # gets the ATR_REQ and the first command through TgGetData.
+        if self.initiator is None or self._initiator_active:
+            return None
+        command = self.initiator.start()
+        if command is None:
+            self.initiator = None
+            return None
+        self._initiator_active = True
+        mode = params[0]
+        if mode & PN532.PN532_TARGET_PICC_ONLY and self.parameters & PN532.PN532_PARAM_ISO14443_4_PICC:
+            self._initiator_command = None
+            return b'\x08' + command
+        self._initiator_command = command
+        return b'\x04' + VirtualInitiator.ATR_REQ
+
+    def _tg_get_data(self, params):
+        if not self._initiator_active:
+            return bytes([STATUS_WRONG_CONTEXT])
+        if self._initiator_command is None:
+            # Script done: the initiator deselects the target.
+            self._initiator_active = False
+            self.initiator = None
+            return bytes([STATUS_RELEASED])
+        return bytes([STATUS_OK]) + self._initiator_command
+
+    def _tg_set_data(self, params):
+        if not self._initiator_active:
+            return bytes([STATUS_WRONG_CONTEXT])
+        self._initiator_command = self.initiator.answer(params)
+        return bytes([STATUS_OK])
+
+    def _in_communicate_thru(self, params):
+        # Raw frames go to the current target; cards that only speak MIFARE
+        # Classic through InDataExchange do not answer.
+        card = self.targets.get(self.current_target)
+        if card is None:
+            return bytes([STATUS_WRONG_CONTEXT])
+        if card not in self.cards or isinstance(card, VirtualMifareClassic):
+            return bytes([STATUS_TIMEOUT])
+        status, response = card.exchange(params)
+        return bytes([status]) + response
+
+
+class PtyBridge:
+    """Serves a SimulatedPN532 on a pseudo-terminal, so that anything that
+    opens a serial port (PN532.SerialTransport, asyncpn532.AsyncPN532, other
+    tools) can talk to it.  Open the pty at port:
+
+        bridge = PtyBridge(SimulatedPN532(cards=[VirtualMifareClassic()]))
+        pn532 = PN532.PN532(bridge.port)
+
+    A pty has no line speed, so the simulated host side of the link simply
+    follows the chip's baud rate.  Only available where os.openpty is (Linux
+    and other POSIX systems).
+    """
+
+    def __init__(self, sim):
+        if tty is None:
+            raise RuntimeError('PtyBridge needs pseudo-terminal support (POSIX only)!')
+        self.sim = sim
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._host_to_sim, daemon=True),
+            threading.Thread(target=self._sim_to_host, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _host_to_sim(self):
+        while self._running:
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 4096)
+                self.sim.baudrate = self.sim.chip_baudrate
+                self.sim.write(data)
+            except OSError:
+                break
+
+    def _sim_to_host(self):
+        while self._running:
+            try:
+                data = self.sim.read(4096, 0.05)
+                if data:
+                    os.write(self._master, data)
+            except OSError:
+                break
+
+    def close(self):
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        os.close(self._master)
+        os.close(self._slave)
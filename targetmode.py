@@ -0,0 +1,268 @@
+# Card emulation and P2P target mode for the PN532.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Target mode: the PN532 as an emulated card or P2P target.
+
+TargetServer waits for a reader with TgInitAsTarget and then answers its
+commands, one TgGetData/TgSetData pair per exchange, with a handler: any
+callable taking the command bytes and returning the answer bytes.  The PN532
+takes care of the ISO-DEP (or DEP) framing.  Type4Tag is such a handler,
+emulating an NFC Forum Type 4 tag holding an NDEF message:
+
+    server = TargetServer(pn532, Type4Tag(ndef.encode_message([ndef.uri_record('https://example.com')])))
+    server.serve_forever()
+
+A reader only waits so long for an answer (the frame waiting time, as
+little as a few milliseconds), so the exchange path does as little as
+possible: the TgGetData frame is built once, TgSetData frames are kept for
+every distinct answer, and Type4Tag keeps the answers to the READ BINARYs it
+has seen.  Once a reader has read the tag, serving it again builds nothing.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import PN532
+
+
+NDEF_TAG_APPLICATION_AID = bytes.fromhex('D2760000850101')
+CC_FILE_ID = b'\xE1\x03'
+NDEF_FILE_ID = b'\xE1\x04'
+
+SW_OK = b'\x90\x00'
+SW_WRONG_LENGTH = b'\x67\x00'
+SW_SECURITY_STATUS = b'\x69\x82'
+SW_NOT_ALLOWED = b'\x69\x86'
+SW_NOT_FOUND = b'\x6A\x82'
+SW_WRONG_OFFSET = b'\x6B\x00'
+SW_INS_NOT_SUPPORTED = b'\x6D\x00'
+
+
+class Type4Tag:
+    """An NFC Forum Type 4 tag (mapping version 2.0) holding an NDEF message,
+    as a TargetServer handler.  max_size is the NDEF file size (at least
+    the message plus its 2-byte length); with writable, readers can replace
+    the message with UPDATE BINARY.  mle is the most data the tag returns
+    per READ BINARY.
+    """
+
+    def __init__(self, message=b'', max_size=None, writable=False, mle=0xF6):
+        size = max(len(message) + 2, max_size or 0)
+        assert size <= 0x7FFF, 'The NDEF file cannot be more than 32767 bytes.'
+        self.writable = writable
+        self.ndef_file = bytearray(size)
+        self.ndef_file[0:2] = len(message).to_bytes(2, 'big')
+        self.ndef_file[2:2 + len(message)] = message
+        self.cc_file = (b'\x00\x0F\x20' + mle.to_bytes(2, 'big') + (0xFF).to_bytes(2, 'big') +
+                        b'\x04\x06' + NDEF_FILE_ID + size.to_bytes(2, 'big') +
+                        (b'\x00\x00' if writable else b'\x00\xFF'))
+        self._files = {CC_FILE_ID: self.cc_file, NDEF_FILE_ID: self.ndef_file}
+        self._answers = {}  # (file ID, READ BINARY offset and Le bytes) -> answer
+        self._application = False
+        self._file = None
+
+    @property
+    def message(self):
+        """The NDEF message currently on the tag."""
+        return bytes(self.ndef_file[2:2 + int.from_bytes(self.ndef_file[0:2], 'big')])
+
+    def reset(self):
+        """Start over for a new reader, with nothing selected."""
+        self._application = False
+        self._file = None
+
+    def __call__(self, apdu):
+        apdu = bytes(apdu)
+        if len(apdu) < 4:
+            return SW_WRONG_LENGTH
+        ins = apdu[1]
+
+        if ins == PN532.ISO7816_INS_READ_BINARY:
+            if self._file is None:
+                return SW_NOT_ALLOWED
+            key = (self._file, apdu[2:])
+            answer = self._answers.get(key)
+            if answer is None:
+                answer = self._read_binary(apdu)
+                self._answers[key] = answer
+            return answer
+
+        if ins == PN532.ISO7816_INS_SELECT:
+            if len(apdu) < 5 or len(apdu) < 5 + apdu[4]:
+                return SW_WRONG_LENGTH
+            name = apdu[5:5 + apdu[4]]
+            if apdu[2] == 0x04:
+                self._application = name == NDEF_TAG_APPLICATION_AID
+                self._file = None
+                return SW_OK if self._application else SW_NOT_FOUND
+            if apdu[2] == 0x00 and self._application and name in self._files:
+                self._file = bytes(name)
+                return SW_OK
+            return SW_NOT_FOUND
+
+        if ins == PN532.ISO7816_INS_UPDATE_BINARY:
+            if self._file is None:
+                return SW_NOT_ALLOWED
+            if self._file != NDEF_FILE_ID or not self.writable:
+                return SW_SECURITY_STATUS
+            if len(apdu) < 5 or len(apdu) != 5 + apdu[4]:
+                return SW_WRONG_LENGTH
+            offset = (apdu[2] << 8) | apdu[3]
+            if offset + apdu[4] > len(self.ndef_file):
+                return SW_WRONG_OFFSET
+            self.ndef_file[offset:offset + apdu[4]] = apdu[5:]
+            self._answers.clear()
+            return SW_OK
+
+        return SW_INS_NOT_SUPPORTED
+
+    def _read_binary(self, apdu):
+        data = self._files[self._file]
+        offset = (apdu[2] << 8) | apdu[3]
+        le = (apdu[4] or 256) if len(apdu) > 4 else 256
+        if offset > len(data):
+            return SW_WRONG_OFFSET
+        return bytes(data[offset:offset + le]) + SW_OK
+
+
+class TargetServer:
+    """Serves a handler to the readers that activate the PN532 as a target.
+    mode and the activation parameters go to TgInitAsTarget (see
+    PN532.tg_init_as_target); with PN532_TARGET_PICC_ONLY in mode the PN532 is
+    set up to emulate an ISO14443-4 card.  Readers are served according to
+    how they activated the target (see the activation mode byte): an
+    ISO14443-4 reader gets its first command answered right away, a DEP
+    initiator is served from TgGetData on.  Readers using any other framing,
+    or one that mode does not allow, are turned away and counted in rejected.
+    A handler with a reset() method has it called for every new reader.  Up
+    to frame_cache_size TgSetData frames are kept for reuse, least recently
+    used go first (0 builds every frame afresh).
+    """
+
+    def __init__(self, pn532, handler, mode=PN532.PN532_TARGET_PICC_ONLY, sens_res=b'\x04\x00',
+                 nfcid1=b'\x12\x34\x56', sel_res=0x20, general_bytes=b'', historical_bytes=b'',
+                 frame_cache_size=256):
+        self.pn532 = pn532
+        self.handler = handler
+        self.mode = mode
+        self.sens_res = sens_res
+        self.nfcid1 = nfcid1
+        self.sel_res = sel_res
+        self.general_bytes = general_bytes
+        self.historical_bytes = historical_bytes
+        self.frame_cache_size = frame_cache_size
+
+        self.sessions = 0
+        self.rejected = 0
+        self.exchanges = 0
+        self.turnaround = 0.0
+        self.max_turnaround = 0.0
+
+        self._get_data_frame = pn532.build_frame(PN532.PN532_COMMAND_TGGETDATA)
+        self._set_data_frames = OrderedDict()  # answer -> TgSetData frame
+        self._configured = False
+
+    def _set_data_frame(self, answer):
+        if not isinstance(answer, bytes):
+            answer = bytes(answer)
+        frames = self._set_data_frames
+        frame = frames.get(answer)
+        if frame is not None:
+            frames.move_to_end(answer)
+            return frame
+        frame = self.pn532.build_frame(PN532.PN532_COMMAND_TGSETDATA, answer)
+        if self.frame_cache_size:
+            frames[answer] = frame
+            if len(frames) > self.frame_cache_size:
+                frames.popitem(last=False)
+        return frame
+
+    def serve(self, timeout=None, command_timeout=1.0):
+        """Wait up to timeout seconds (None for ever) for a reader and answer
+        its commands until it releases the target, goes away or sends nothing
+        for command_timeout seconds.  Returns the number of exchanges (0 for a
+        reader that was turned away), or None if no reader came.
+        """
+        pn532 = self.pn532
+        if not self._configured and self.mode & PN532.PN532_TARGET_PICC_ONLY:
+            pn532.set_parameters(PN532.PN532_PARAM_AUTOMATIC_ATR_RES | PN532.PN532_PARAM_AUTOMATIC_RATS |
+                                 PN532.PN532_PARAM_ISO14443_4_PICC)
+            self._configured = True
+
+        activation = pn532.tg_init_as_target(self.mode, self.sens_res, self.nfcid1, self.sel_res,
+                                             general_bytes=self.general_bytes,
+                                             historical_bytes=self.historical_bytes, timeout=timeout)
+        if activation is None:
+            return None
+        activated, first = activation
+
+        # An emulated card gets the reader's first command right away; a P2P
+        # target gets the ATR_REQ, which the PN532 has answered already.
+        if activated & PN532.PN532_TARGET_ACTIVATED_PICC and not self.mode & PN532.PN532_TARGET_DEP_ONLY:
+            command = first
+        elif activated & PN532.PN532_TARGET_ACTIVATED_DEP and not self.mode & PN532.PN532_TARGET_PICC_ONLY:
+            command = None
+        else:
+            self.rejected += 1
+            return 0
+
+        self.sessions += 1
+        reset = getattr(self.handler, 'reset', None)
+        if reset is not None:
+            reset()
+        get_data_frame = self._get_data_frame
+        handler = self.handler
+        exchanges = 0
+        while True:
+            if command is None:
+                response = pn532.call_frame(PN532.PN532_COMMAND_TGGETDATA, get_data_frame, command_timeout)
+                if PN532.response_status(response) != 0x00:
+                    break
+                command = response[1:]
+
+            start = time.perf_counter()
+            frame = self._set_data_frame(handler(command))
+            turnaround = time.perf_counter() - start
+            self.turnaround += turnaround
+            if turnaround > self.max_turnaround:
+                self.max_turnaround = turnaround
+
+            response = pn532.call_frame(PN532.PN532_COMMAND_TGSETDATA, frame, command_timeout)
+            if PN532.response_status(response) != 0x00:
+                break
+            exchanges += 1
+            command = None
+
+        self.exchanges += exchanges
+        return exchanges
+
+    def serve_forever(self, stop=None, poll_timeout=1.0, command_timeout=1.0):
+        """Serve reader after reader until stop (a threading.Event) is set.
+        poll_timeout bounds each wait for a reader, so stop is checked at
+        least that often.
+        """
+        stop = threading.Event() if stop is None else stop
+        while not stop.is_set():
+            self.serve(poll_timeout, command_timeout)
@@ -0,0 +1,138 @@
+# Tests for the UID allowlist.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+
+import pytest
+
+from allowlist import (ALLOW, EXPIRED, NO_NOT_AFTER, NO_NOT_BEFORE, NOT_YET_VALID, UNKNOWN, Allowlist,
+                       write_allowlist)
+
+
+UID4 = b'\x01\x02\x03\x04'
+UID7 = b'\x04\x11\x22\x33\x44\x55\x66'
+UID10 = bytes(range(10))
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'site.acl')
+    write_allowlist(path, [UID4, (UID7, 100, 200), (UID10, None, 300)])
+    return path
+
+
+def test_windows(path):
+    allowlist = Allowlist(path)
+    assert len(allowlist) == 3
+    assert allowlist.window(UID4) == (NO_NOT_BEFORE, NO_NOT_AFTER)
+    assert allowlist.window(UID7) == (100, 200)
+    assert allowlist.window(UID10) == (NO_NOT_BEFORE, 300)
+    assert allowlist.window(b'\x01\x02\x03') is None
+    assert allowlist.window(UID4 + b'\x00') is None
+    assert bytearray(UID7) in allowlist
+
+
+def test_decide(path):
+    allowlist = Allowlist(path, clock=lambda: 150)
+    assert allowlist.decide(UID7) == ALLOW
+    assert allowlist.decide(UID7, now=50) == NOT_YET_VALID
+    assert allowlist.decide(UID7, now=250) == EXPIRED
+    assert allowlist.decide(b'\x09\x09\x09\x09') == UNKNOWN
+    assert allowlist.allowed(UID7) and not allowlist.allowed(UID7, now=250)
+    assert allowlist.allowed(bytearray(UID10), now=300) and not allowlist.allowed(UID10, now=301)
+
+
+def test_many_entries(tmp_path):
+    path = str(tmp_path / 'big.acl')
+    uids = [i.to_bytes(4, 'big') for i in range(5000)]
+    assert write_allowlist(path, uids + uids[:10]) == 5000
+    allowlist = Allowlist(path)
+    assert len(allowlist) == 5000
+    assert all(allowlist.allowed(uid, now=0) for uid in uids)
+    assert not any(allowlist.allowed(i.to_bytes(4, 'big'), now=0) for i in range(5000, 6000))
+
+
+def test_apply_delta(path):
+    allowlist = Allowlist(path)
+    allowlist.apply_delta(added=[b'\x0A\x0B\x0C\x0D', (UID7, 0, 50)], removed=[bytearray(UID4)])
+    assert len(allowlist) == 3
+    assert allowlist.window(b'\x0A\x0B\x0C\x0D') == (NO_NOT_BEFORE, NO_NOT_AFTER)
+    assert allowlist.window(UID7) == (0, 50)
+    assert allowlist.window(UID4) is None and not allowlist.allowed(UID4)
+    assert sorted(allowlist.entries()) == sorted([
+        (b'\x0A\x0B\x0C\x0D', NO_NOT_BEFORE, NO_NOT_AFTER), (UID7, 0, 50), (UID10, NO_NOT_BEFORE, 300)])
+
+    # Removing a UID that was never listed does not change the count.
+    allowlist.apply_delta(removed=[b'\x09\x09\x09\x09'])
+    assert len(allowlist) == 3
+
+
+def test_apply_delta_file(path, tmp_path):
+    delta = tmp_path / 'site.delta'
+    delta.write_text('# nightly\n+ 0a0b0c0d\n+ {} 10 -\n\n- {}\n'.format(UID7.hex(), UID4.hex()))
+    allowlist = Allowlist(path)
+    allowlist.apply_delta_file(str(delta))
+    assert allowlist.window(b'\x0A\x0B\x0C\x0D') == (NO_NOT_BEFORE, NO_NOT_AFTER)
+    assert allowlist.window(UID7) == (10, NO_NOT_AFTER)
+    assert UID4 not in allowlist
+
+    delta.write_text('* 01020304\n')
+    with pytest.raises(ValueError):
+        allowlist.apply_delta_file(str(delta))
+
+
+def test_compact(path):
+    allowlist = Allowlist(path)
+    allowlist.apply_delta(added=[b'\x0A\x0B\x0C\x0D'], removed=[UID4])
+    allowlist.compact()
+    assert len(allowlist) == 3
+    fresh = Allowlist(path)
+    assert sorted(fresh.entries()) == sorted(allowlist.entries())
+    assert b'\x0A\x0B\x0C\x0D' in fresh and UID4 not in fresh
+
+
+def test_reload_drops_deltas(path):
+    allowlist = Allowlist(path)
+    allowlist.apply_delta(removed=[UID4])
+    allowlist.reload()
+    assert UID4 in allowlist
+
+
+def test_maybe_reload(path):
+    allowlist = Allowlist(path)
+    assert not allowlist.maybe_reload()
+    write_allowlist(path, [b'\x0A\x0B\x0C\x0D'])
+    assert allowlist.maybe_reload()
+    assert len(allowlist) == 1 and UID4 not in allowlist
+    os.remove(path)
+    assert not allowlist.maybe_reload()
+    assert b'\x0A\x0B\x0C\x0D' in allowlist
+
+
+def test_not_an_allowlist(tmp_path):
+    path = tmp_path / 'other.acl'
+    path.write_bytes(bytes(64))
+    with pytest.raises(ValueError):
+        Allowlist(str(path))
@@ -0,0 +1,94 @@
+# Tests for capture files and their replay.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import pytest
+
+import PN532
+from capture import (RECORD_RX, RECORD_TX, CaptureReader, RecordingTransport, ReplayMismatch,
+                     ReplayTransport)
+from simulator import SimulatedPN532, VirtualMifareClassic
+
+
+UID = b'\x01\x02\x03\x04'
+
+
+@pytest.fixture
+def capture_path(tmp_path):
+    path = str(tmp_path / 'session.cap')
+    sim = SimulatedPN532(cards=[VirtualMifareClassic(UID)], latency=0.0, ack_latency=0.0)
+    transport = RecordingTransport(sim, path)
+    pn532 = PN532.PN532(transport=transport)
+    assert pn532.get_firmware_version() == tuple(sim.firmware)
+    assert pn532.read_passive_target() == UID
+    transport.close()
+    return path
+
+
+def test_capture_records_both_directions(capture_path):
+    with CaptureReader(capture_path) as reader:
+        records = list(reader)
+    assert sum(record.kind == RECORD_TX for record in records) == 2
+    assert [record.timestamp for record in records] == sorted(record.timestamp for record in records)
+    parser = PN532.FrameParser()
+    for record in records:
+        if record.kind == RECORD_RX:
+            parser.feed(record.data)
+    kinds = [frame.kind for frame in parser]
+    assert kinds == [PN532.FRAME_ACK, PN532.FRAME_INFO] * 2
+    assert parser.checksum_errors == 0
+
+
+def test_truncated_record_is_ignored(capture_path):
+    with CaptureReader(capture_path) as reader:
+        count = len(list(reader))
+    with open(capture_path, 'r+b') as f:
+        f.seek(-1, 2)
+        f.truncate()
+    with CaptureReader(capture_path) as reader:
+        assert len(list(reader)) == count - 1
+
+
+def test_replay_answers_like_the_reader(capture_path):
+    transport = ReplayTransport(capture_path, speed=None)
+    pn532 = PN532.PN532(transport=transport)
+    assert pn532.get_firmware_version() == (0x32, 0x01, 0x06, 0x07)
+    assert pn532.read_passive_target() == UID
+    assert transport.done
+    transport.close()
+
+
+def test_replay_rejects_a_different_command(capture_path):
+    transport = ReplayTransport(capture_path, speed=None)
+    pn532 = PN532.PN532(transport=transport)
+    with pytest.raises(ReplayMismatch):
+        pn532.read_passive_target()
+    transport.close()
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(bytes(64))
+    with pytest.raises(ValueError):
+        CaptureReader(str(path))
@@ -0,0 +1,140 @@
+# Tests for FrameParser and FrameBuilder.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import pytest
+
+import PN532
+from PN532 import FRAME_ACK, FRAME_ERROR, FRAME_INFO, FRAME_NACK, FrameBuilder, FrameParser, RetryPolicy
+
+
+def build(command, *params, tfi=PN532.PN532_PN532TOHOST):
+    return bytes(FrameBuilder().build(tfi, command, params))
+
+
+def frames(parser):
+    return [(frame.kind, frame.data) for frame in parser]
+
+
+def test_ack_nack_and_error_frames():
+    parser = FrameParser()
+    parser.feed(PN532.PN532_ACK_FRAME + PN532.PN532_NACK_FRAME + b'\x00\x00\xFF\x01\xFF\x7F\x81\x00')
+    assert frames(parser) == [(FRAME_ACK, b''), (FRAME_NACK, b''), (FRAME_ERROR, b'\x7F')]
+
+
+def test_frame_split_across_feeds():
+    frame = build(0x03, b'\x32\x01\x06\x07')
+    parser = FrameParser()
+    # Everything up to the DCS is not yet a frame; the postamble is not needed.
+    for i in range(len(frame) - 2):
+        parser.feed(frame[i:i + 1])
+        assert parser.next_frame() is None
+    parser.feed(frame[-2:])
+    assert frames(parser) == [(FRAME_INFO, b'\xD5\x03\x32\x01\x06\x07')]
+    assert len(parser) == 1  # the postamble
+
+
+def test_garbage_before_frame_is_skipped():
+    parser = FrameParser()
+    parser.feed(b'\x55\x00\x12\x00\xFF' + build(0x4B, 0x00))
+    assert frames(parser) == [(FRAME_INFO, b'\xD5\x4B\x00')]
+
+
+@pytest.mark.parametrize('corrupt', ['lcs', 'dcs'])
+def test_resync_after_bad_checksum(corrupt):
+    bad = bytearray(build(0x41, 0x00, bytes(16)))
+    if corrupt == 'lcs':
+        bad[4] ^= 0xFF
+    else:
+        bad[-2] ^= 0xFF
+    good = build(0x41, 0x00, bytes(range(16)))
+    parser = FrameParser()
+    parser.feed(bytes(bad) + good)
+    assert frames(parser) == [(FRAME_INFO, b'\xD5\x41\x00' + bytes(range(16)))]
+    assert parser.checksum_errors == 1
+
+
+def test_bad_frame_whose_payload_hides_a_frame():
+    # A corrupted frame is skipped one byte at a time, so a frame inside its
+    # payload is still found.
+    inner = build(0x03, b'\x32\x01\x06\x07')
+    bad = bytearray(build(0x41, 0x00, inner))
+    bad[-2] ^= 0xFF
+    parser = FrameParser()
+    parser.feed(bytes(bad))
+    assert frames(parser) == [(FRAME_INFO, b'\xD5\x03\x32\x01\x06\x07')]
+    assert parser.checksum_errors == 1
+
+
+def test_builder_matches_the_documented_layout():
+    frame = build(PN532.PN532_COMMAND_GETFIRMWAREVERSION, tfi=PN532.PN532_HOSTTOPN532)
+    assert frame == b'\x00\x00\xFF\x02\xFE\xD4\x02\x2A\x00'
+
+
+def test_builder_flattens_params():
+    frame = build(0x40, 1, [0x60, 4], (b'\xFF' * 6,), bytearray(b'\xDE\xAD'), 'AB', tfi=PN532.PN532_HOSTTOPN532)
+    parser = FrameParser()
+    parser.feed(frame)
+    assert parser.next_frame().data == b'\xD4\x40\x01\x60\x04' + b'\xFF' * 6 + b'\xDE\xADAB'
+
+
+def test_extended_frame_round_trip():
+    payload = bytes(range(256)) + bytes(6)
+    frame = build(PN532.PN532_COMMAND_INDATAEXCHANGE, 1, payload, tfi=PN532.PN532_HOSTTOPN532)
+    assert frame[3:5] == b'\xFF\xFF'
+    length = int.from_bytes(frame[5:7], 'big')
+    assert length == len(payload) + 3 and (frame[5] + frame[6] + frame[7]) & 0xFF == 0
+    parser = FrameParser()
+    parser.feed(frame)
+    assert frames(parser) == [(FRAME_INFO, b'\xD4\x40\x01' + payload)]
+
+
+def test_254_data_bytes_is_still_a_normal_frame():
+    frame = build(0x40, bytes(252), tfi=PN532.PN532_HOSTTOPN532)
+    assert frame[3] == 254 and frame[4] == 2
+
+
+def test_extended_frame_with_bad_lcs_is_skipped():
+    bad = bytearray(build(0x40, bytes(260)))
+    bad[7] ^= 0x01
+    good = build(0x41, 0x00)
+    parser = FrameParser()
+    parser.feed(bytes(bad) + good)
+    assert frames(parser) == [(FRAME_INFO, b'\xD5\x41\x00')]
+    assert parser.checksum_errors == 1
+
+
+def test_builder_rejects_oversized_frames():
+    with pytest.raises(ValueError):
+        FrameBuilder().build(PN532.PN532_HOSTTOPN532, 0x40, (bytes(PN532.PN532_MAX_FRAME_DATA),))
+
+
+def test_builder_rejects_unsupported_params():
+    with pytest.raises(ValueError):
+        FrameBuilder().build(PN532.PN532_HOSTTOPN532, 0x40, (1.5,))
+
+
+def test_retry_policy_backoff_is_capped():
+    policy = RetryPolicy(max_attempts=5, backoff=0.01, backoff_factor=2.0, max_backoff=0.03)
+    assert [policy.delay(attempt) for attempt in range(1, 6)] == [0.0, 0.01, 0.02, 0.03, 0.03]
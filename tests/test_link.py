@@ -0,0 +1,104 @@
+# Tests for PN532 link recovery, run against SimulatedPN532.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import pytest
+
+import PN532
+from simulator import SimulatedPN532, VirtualMifareClassic
+
+
+class RecordingSimulator(SimulatedPN532):
+    """SimulatedPN532 that keeps every frame the host wrote."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return super().write(data)
+
+
+def make_reader(*cards, sim_class=SimulatedPN532):
+    sim = sim_class(cards=cards, latency=0.0, ack_latency=0.0)
+    return sim, PN532.PN532(transport=sim)
+
+
+def test_corrupted_response_is_nacked_not_run_again():
+    sim, pn532 = make_reader()
+    handled = sim.commands_handled
+    sim.corrupt_responses = 1
+    assert pn532.get_firmware_version() == tuple(sim.firmware)
+    assert sim.commands_handled == handled + 1
+    assert sim.corrupt_responses == 0
+
+
+def test_response_that_stays_corrupted_raises():
+    sim, pn532 = make_reader()
+    sim.corrupt_responses = pn532.retry.max_attempts
+    with pytest.raises(PN532.PN532ChecksumError):
+        pn532.get_firmware_version()
+    sim.corrupt_responses = 0
+    assert pn532.get_firmware_version() == tuple(sim.firmware)
+
+
+def test_dropped_command_is_sent_again():
+    sim, pn532 = make_reader()
+    handled = sim.commands_handled
+    sim.drop_commands = 1
+    assert pn532.get_firmware_version() == tuple(sim.firmware)
+    assert sim.commands_handled == handled + 1
+
+
+def test_unresponsive_reader_times_out():
+    sim, pn532 = make_reader()
+    pn532.retry = PN532.RetryPolicy(max_attempts=2, ack_timeout=0.02, backoff=0.0)
+    sim.unresponsive = True
+    with pytest.raises(PN532.PN532TimeoutError):
+        pn532.get_firmware_version()
+    sim.unresponsive = False
+    assert pn532.get_firmware_version() == tuple(sim.firmware)
+
+
+def test_poll_timeout_aborts_with_ack():
+    sim, pn532 = make_reader(sim_class=RecordingSimulator)
+    assert pn532.read_passive_target(timeout=0.2) == "no_card"
+    assert sim.written[-1] == PN532.PN532_ACK_FRAME
+    # The aborted InListPassiveTarget left nothing behind: the next command
+    # gets its own answer.
+    sim.add_card(VirtualMifareClassic(b'\x01\x02\x03\x04'))
+    assert pn532.read_passive_target(timeout=0.5) == b'\x01\x02\x03\x04'
+    assert pn532.get_firmware_version() == tuple(sim.firmware)
+
+
+def test_finite_auto_poll_returns_without_a_card():
+    sim, pn532 = make_reader()
+    assert list(pn532.auto_poll(poll_count=1, period=1)) == []
+
+
+def test_auto_poll_reports_the_card():
+    sim, pn532 = make_reader(VirtualMifareClassic(b'\x01\x02\x03\x04'))
+    targets = pn532.auto_poll(poll_count=1, period=1)
+    assert next(targets).uid == b'\x01\x02\x03\x04'
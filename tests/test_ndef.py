@@ -0,0 +1,160 @@
+# Tests for the NDEF, TLV and MAD codecs.
+#
+# Copyright (c) 2016 Manuel Fernando Galindo
+#
+# MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import pytest
+
+import ndef
+
+
+def round_trip(records, chunk_size=None):
+    return ndef.decode_message(ndef.encode_message(records, chunk_size))
+
+
+def test_uri_record_round_trip():
+    record, = round_trip([ndef.uri_record('https://www.example.com/path')])
+    assert record.is_uri()
+    assert bytes(record.payload[:1]) == b'\x02'  # https://www. abbreviated
+    assert record.uri() == 'https://www.example.com/path'
+
+
+def test_uri_without_known_prefix():
+    record, = round_trip([ndef.uri_record('gopher://example.com/')])
+    assert record.payload[0] == 0
+    assert record.uri() == 'gopher://example.com/'
+
+
+def test_text_and_mime_records_round_trip():
+    records = round_trip([ndef.text_record('héllo', 'fr'), ndef.mime_record('application/json', b'{}'),
+                          ndef.external_record('example.com:kiosk', b'\x01')])
+    assert [record.tnf for record in records] == [ndef.TNF_WELL_KNOWN, ndef.TNF_MIME, ndef.TNF_EXTERNAL]
+    assert records[0].text() == ('héllo', 'fr')
+    assert records[1].type == b'application/json' and bytes(records[1].payload) == b'{}'
+    assert records[2].type == b'example.com:kiosk'
+
+
+def test_message_flags():
+    data = ndef.encode_message([ndef.uri_record('http://a'), ndef.uri_record('http://b'),
+                                ndef.uri_record('http://c')])
+    records = ndef.decode_message(data)
+    assert [record.uri() for record in records] == ['http://a', 'http://b', 'http://c']
+    assert data[0] & (ndef.NDEF_MB | ndef.NDEF_ME) == ndef.NDEF_MB
+
+
+def test_long_payload_uses_the_normal_record_format():
+    payload = bytes(range(256)) * 2
+    data = ndef.encode_message([ndef.mime_record('application/octet-stream', payload)])
+    assert not data[0] & ndef.NDEF_SR
+    record, = ndef.decode_message(data)
+    assert bytes(record.payload) == payload
+
+
+def test_chunked_records_are_joined():
+    payload = bytes(range(100))
+    data = ndef.encode_message([ndef.mime_record('application/octet-stream', payload),
+                                ndef.uri_record('http://x')], chunk_size=30)
+    first, second = ndef.decode_message(data)
+    assert first.type == b'application/octet-stream' and first.payload == payload
+    assert second.uri() == 'http://x'
+
+
+@pytest.mark.parametrize('data', [b'\xD1\x01', b'\xD1\x01\x05U\x00ab', b'\xB1\x01\x01U\x00'])
+def test_malformed_messages_raise(data):
+    with pytest.raises(ValueError):
+        ndef.decode_message(data)
+
+
+@pytest.mark.parametrize('length', [0, 10, 254, 255, 1000])
+def test_tlv_round_trip(length):
+    message = bytes(i & 0xFF for i in range(length))
+    data = ndef.encode_tlv(message)
+    assert data[-1] == ndef.TLV_TERMINATOR
+    assert data[1] == (length if length < 0xFF else 0xFF)
+    assert bytes(ndef.find_message(b'\x00\x00' + data)) == message
+
+
+def test_tlvs_before_the_message_are_skipped():
+    data = b'\x01\x03\xA0\x10\x44' + ndef.encode_tlv(b'\xD0\x00\x00')
+    assert [tag for tag, value in ndef.iter_tlvs(data)] == [ndef.TLV_LOCK_CONTROL, ndef.TLV_NDEF]
+    assert ndef.find_message(b'\xFE' + data) is None
+
+
+def test_truncated_tlv_raises():
+    with pytest.raises(ValueError):
+        ndef.find_message(b'\x03\x10\xD0')
+
+
+def type2_dump(message):
+    dump = bytearray(b'\x04\x11\x22\xB7\x33\x44\x55\x66\x00\x48\x00\x00\xE1\x10\x12\x00')
+    area = ndef.encode_tlv(message)
+    dump += area + bytes(144 - len(area))
+    return dump
+
+
+def test_type2_message():
+    message = ndef.encode_message([ndef.uri_record('https://example.com/')])
+    assert bytes(ndef.type2_message(type2_dump(message))) == message
+
+
+def test_type2_not_formatted():
+    dump = type2_dump(b'')
+    dump[12] = 0
+    with pytest.raises(ValueError):
+        ndef.type2_message(dump)
+
+
+def test_mad_crc_vector():
+    # A MAD1 assigning all 15 sectors to NDEF, info byte 0x01.
+    assert ndef.mad_crc(b'\x01' + b'\x03\xE1' * 15) == 0x14
+
+
+def classic_image(message, sectors=(1, 2)):
+    image = bytearray(1024)
+    mad = bytearray(32)
+    mad[1] = 0x01
+    for sector in sectors:
+        mad[sector * 2:sector * 2 + 2] = b'\x03\xE1'
+    mad[0] = ndef.mad_crc(mad[1:])
+    image[16:48] = mad
+    area = ndef.encode_tlv(message)
+    for sector in sectors:
+        blocks = ndef.mifare_classic_sector_blocks(sector)
+        chunk, area = area[:48], area[48:]
+        image[blocks[0] * 16:blocks[0] * 16 + len(chunk)] = chunk
+    return image
+
+
+def test_classic_message_round_trip():
+    message = ndef.encode_message([ndef.text_record('x' * 60)])
+    image = classic_image(message)
+    assert ndef.mad_sectors(image) == [1, 2]
+    assert bytes(ndef.classic_message(image)) == message
+
+
+def test_classic_bad_mad_crc():
+    image = classic_image(ndef.encode_message([ndef.uri_record('http://a')]))
+    image[16] ^= 0xFF
+    with pytest.raises(ValueError):
+        ndef.mad_sectors(image)
+    assert ndef.mad_sectors(image, check_crc=False) == [1, 2]
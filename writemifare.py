@@ -26,25 +26,59 @@
 import argparse
 
 import PN532
+from keymanager import KeyManager
 
 
 CARD_KEY = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
 
 
+def wait_for_card(pn532, previous_uid=None):
+    """Wait for a card other than previous_uid to be placed on the PN532."""
+    uid = pn532.read_passive_target()
+    while uid == "no_card" or (previous_uid is not None and bytes(uid) == bytes(previous_uid)):
+        uid = pn532.read_passive_target()
+    return uid
+
+
+def wait_for_removal(pn532, uid):
+    """Wait until the card with the given UID has left the PN532."""
+    found = pn532.read_passive_target()
+    while found != "no_card" and bytes(found) == bytes(uid):
+        found = pn532.read_passive_target()
+
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('com_port')
-    p.add_argument('block', type=lambda n: int(n, 0))
-    p.add_argument('data', type=lambda s: s.encode())
+    p.add_argument('writes', nargs='+', metavar='BLOCK DATA',
+                   help='block number followed by the data to write to it, repeat for more blocks')
     p.add_argument('-y', '--yes', action='store_true')
+    p.add_argument('--verify', action='store_true', help='read blocks back after writing them')
+    p.add_argument('--allow-trailers', action='store_true', help='allow writing sector trailers (keys and access bits)')
+    p.add_argument('--repeat', action='store_true', help='keep writing every new card placed on the PN532')
+    p.add_argument('-k', '--key', action='append', type=bytes.fromhex,
+                   help='hex key to try as key A and key B, may be repeated (default: key B {})'.format(bytes(CARD_KEY).hex()))
+    p.add_argument('--fast', action='store_true',
+                   help='switch the serial link to the fastest baud rate that works (back to 115200 on exit)')
     args = p.parse_args()
 
-    if not (4 <= args.block < 16):
-        p.error('block must be between 4 and 15')
-    if len(args.data) > 16:
-        p.error('data cannot be more than 16 bytes')
+    # With --key, find a working key per sector instead of using CARD_KEY.
+    keys = KeyManager(args.key) if args.key else None
+
+    if len(args.writes) % 2:
+        p.error('every block needs data to write')
 
-    args.data += b'\0' * (16 - len(args.data))
+    blocks = {}
+    for block, data in zip(args.writes[::2], args.writes[1::2]):
+        block = int(block, 0)
+        data = data.encode()
+        if not (4 <= block < 64):
+            p.error('block must be between 4 and 63')
+        if PN532.mifare_classic_is_trailer(block) and not args.allow_trailers:
+            p.error('block {} is a sector trailer, use --allow-trailers to write it'.format(block))
+        if len(data) > 16:
+            p.error('data cannot be more than 16 bytes')
+        blocks[block] = data + b'\0' * (16 - len(data))
 
     # Create an instance of the PN532 class.
     pn532 = PN532.PN532(args.com_port, 115200)
@@ -55,49 +89,45 @@ def main():
     ic, ver, rev, support = pn532.get_firmware_version()
     print(('Found PN532 with firmware version: {}.{}'.format(ver, rev)))
 
-    # Step 1, wait for card to be present.
     print('Mifare NFC Writer')
     print('')
-    print('Place the card to be written on the PN532...')
-    uid = pn532.read_passive_target()
-    while uid == "no_card":
-        uid = pn532.read_passive_target()
-    print('')
-    print('Found card with UID: {:#x}'.format(int.from_bytes(uid, 'big')))
-    print('')
-    print('==============================================================')
-    print('WARNING: DO NOT REMOVE CARD FROM PN532 UNTIL FINISHED WRITING!')
-    print('==============================================================')
-    print('')
-
-    print('')
-    print('Block: {}'.format(args.block))
-    print('Data: {}'.format(args.data))
+    for block, data in sorted(blocks.items()):
+        print('Block: {}'.format(block))
+        print('Data: {}'.format(data))
     if (not args.yes) and input('Are you sure? [y/N] ').lower() not in ('y', 'yes'):
         print('Aborted!')
         return
 
-    print('Writing card (DO NOT REMOVE CARD FROM PN532)...')
-
-    # Write the card!
-    # First authenticate block 4.
-    if not pn532.mifare_classic_authenticate_block(uid, args.block, PN532.MIFARE_CMD_AUTH_B, CARD_KEY):
-        print('Error! Failed to authenticate block 4 with the card.')
-        return
-
-    # Next build the data to write to the card.
-    # Format is as follows:
-    # - Bytes 0-3 are a header with ASCII value 'MCPI'
-    # - Byte 4 is the block ID byte
-    # - Byte 5 is 0 if block has no subtype or 1 if block has a subtype
-    # - Byte 6 is the subtype byte (optional, only if byte 5 is 1)
-
-    # Finally write the card.
-    if not pn532.mifare_classic_write_block(args.block, args.data):
-        print('Error! Failed to write to the card.')
-        return
-
-    print('Wrote card successfully! You may now remove the card from the PN532.')
+    # Speed up the serial link; the PN532 keeps the new speed until it is
+    # switched back or powered off.
+    if args.fast:
+        print('Serial link at {} baud'.format(pn532.negotiate_baudrate()))
+
+    try:
+        uid = None
+        while True:
+            # Step 1, wait for card to be present.
+            print('')
+            print('Place the card to be written on the PN532...')
+            uid = wait_for_card(pn532, uid)
+            print('')
+            print('Found card with UID: {:#x}'.format(int.from_bytes(uid, 'big')))
+            print('Writing card (DO NOT REMOVE CARD FROM PN532)...')
+
+            # Write the card, one authentication per sector.
+            failed = pn532.mifare_classic_write_blocks(uid, blocks, PN532.MIFARE_CMD_AUTH_B, CARD_KEY,
+                                                       verify=args.verify, allow_trailers=args.allow_trailers, keys=keys)
+            if failed:
+                print('Error! Failed to write blocks: {}'.format(', '.join(map(str, failed))))
+            else:
+                print('Wrote card successfully! You may now remove the card from the PN532.')
+
+            if not args.repeat:
+                break
+            wait_for_removal(pn532, uid)
+    finally:
+        if args.fast:
+            pn532.set_baudrate(115200)
 
 
 if __name__ == "__main__":